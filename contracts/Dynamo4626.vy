@@ -6,14 +6,19 @@ import LPAdapter as LPAdapter
 implements: ERC20
 
 
-MAX_POOLS : constant(int128) = 5
+# Every loop over the pools stops at the live pool count so capacity costs
+# nothing until it's used.
+MAX_POOLS : constant(uint256) = 16
 MAX_BALTX_DEPOSIT : constant(uint8) = 2
 
 # Contract owner hold 10% of the yield.
-YIELD_FEE_PERCENTAGE : constant(decimal) = 10.0
+YIELD_FEE_PERCENTAGE : constant(uint256) = 10
 
 # 1% of the yield belongs to the Strategy proposer.
-PROPOSER_FEE_PERCENTAGE: constant(decimal) = 1.0
+PROPOSER_FEE_PERCENTAGE: constant(uint256) = 1
+
+# Float settings are expressed in basis points of totalAssets.
+MAX_FLOAT_BPS : constant(uint256) = 10000
 
 
 name: public(immutable(String[64]))
@@ -21,10 +26,19 @@ symbol: public(immutable(String[32]))
 decimals: public(immutable(uint8))
 asset: public(immutable(address))
 
-total_assets_deposited: public(uint256)
-total_assets_withdrawn: public(uint256)
-total_yield_fees_claimed: public(uint256)
-total_strategy_fees_claimed: public(uint256)
+# Accounting counters are kept as uint128 pairs sharing a slot since they're
+# read together on every conversion. Low half / high half:
+#   packed_asset_flows  - total_assets_deposited / total_assets_withdrawn
+#   packed_fees_claimed - total_yield_fees_claimed / total_strategy_fees_claimed
+packed_asset_flows: uint256
+packed_fees_claimed: uint256
+
+# Fees are taken as vault shares minted to the vault itself whenever the total
+# returns pass their high-water mark, at state changing calls only. Views then
+# convert with a single division. Low half / high half:
+#   packed_fee_shares - yield fee shares / strategy fee shares
+packed_fee_shares: public(uint256)
+fee_high_water_mark: uint256
 
 struct AdapterStrategy:
     adapter: address
@@ -32,8 +46,9 @@ struct AdapterStrategy:
 
 owner: address
 governance: address
-current_proposer: address
-min_proposer_payout: uint256
+# current_proposer in the low 160 bits with min_proposer_payout above it, which
+# is why set_strategy only accepts a uint96 payout.
+packed_proposer: uint256
 
 dlending_pools : DynArray[address, MAX_POOLS]
 
@@ -41,14 +56,52 @@ totalSupply: public(uint256)
 balanceOf: public(HashMap[address, uint256])
 allowance: public(HashMap[address, HashMap[address, uint256]])
 
-# Maps adapter address (not LP address) to ratios.
-strategy: public(HashMap[address, uint256])
+# Adapter ratios in dlending_pools order, WEIGHT_BITS each so all MAX_POOLS of
+# them share one slot, along with their sum so rebalancing reads two slots
+# rather than looking up & totaling every adapter's ratio on each user action.
+WEIGHT_BITS: constant(uint256) = 16
+MAX_WEIGHT: constant(uint256) = 2**16 - 1
+packed_strategy_weights: public(uint256)
+total_strategy_weight: public(uint256)
+
+# Assets rebalance() has moved since the strategy was last set.
+strategy_assets_moved: public(uint256)
+
+# Idle asset buffer ("float") kept in the vault. Deposits & withdrawals that leave
+# the local balance between the low & high watermarks never touch the adapters,
+# otherwise we rebalance back to the target float. All zero means every asset
+# is pushed into the adapters & deposits/withdrawals skip the float math.
+# The low, target & high watermarks share a slot FLOAT_BITS apart, bps never
+# exceed MAX_FLOAT_BPS, so a deposit or withdrawal reads just the one slot.
+FLOAT_BITS : constant(uint256) = 16
+FLOAT_LOW : constant(int128) = 0
+FLOAT_TARGET : constant(int128) = 16
+FLOAT_HIGH : constant(int128) = 32
+packed_float_bps: uint256
+
+# Every balance the vault is responsible for, read once per external call
+# and handed down to the conversion, fee & rebalance logic. The adapter
+# arrays follow dlending_pools order.
+struct VaultSnapshot:
+    local_asset_balance: uint256
+    adapter_balances: DynArray[uint256, MAX_POOLS]
+    # What the vault can move in/out of each adapter right now.
+    adapter_max_withdraws: DynArray[uint256, MAX_POOLS]
+    adapter_max_deposits: DynArray[uint256, MAX_POOLS]
+    total_balance: uint256
 
 
 event PoolAdded:
     sender: indexed(address)
     contract_addr: indexed(address)
 
+# Emitted for every remove_pool step, the pool is gone once assets_remaining is 0.
+event PoolRemoval:
+    sender: indexed(address)
+    contract_addr: indexed(address)
+    assets_withdrawn: uint256
+    assets_remaining: uint256
+
 event Transfer:
     sender: indexed(address)
     receiver: indexed(address)
@@ -59,9 +112,16 @@ event Approval:
     spender: indexed(address)
     value: uint256    
 
+# The strategy itself is only logged as the keccak256 of its ABI encoding.
 event StrategyActivation:
-    strategy: AdapterStrategy[MAX_POOLS]
-    proposer: address
+    proposer: indexed(address)
+    strategy_hash: bytes32
+
+event Rebalance:
+    sender: indexed(address)
+    moves: uint256
+    assets_moved: uint256
+    gas_used: uint256
     
 
 @external
@@ -110,44 +170,98 @@ def lending_pools() -> DynArray[address, MAX_POOLS]: return self.dlending_pools
 
 
 @internal
-def _set_strategy(_proposer: address, _strategies : AdapterStrategy[MAX_POOLS], _min_proposer_payout : uint256) -> bool:
+@pure
+def _weight(_weights: uint256, _pos: uint256) -> uint256:
+    return bitwise_and(shift(_weights, -convert(_pos * WEIGHT_BITS, int128)), MAX_WEIGHT)
+
+
+@internal
+@pure
+def _set_weight(_weights: uint256, _pos: uint256, _ratio: uint256) -> uint256:
+    bits : int128 = convert(_pos * WEIGHT_BITS, int128)
+    return bitwise_or(bitwise_and(_weights, bitwise_not(shift(MAX_WEIGHT, bits))), shift(_ratio, bits))
+
+
+@external
+def set_strategy(_proposer: address, _strategies : DynArray[AdapterStrategy, MAX_POOLS], _min_proposer_payout : uint96) -> bool:
     assert msg.sender == self.governance, "Only Governance DAO may set a new strategy."
     assert _proposer != empty(address), "Proposer can't be null address."
 
     # Are we replacing the old proposer?
-    if self.current_proposer != _proposer:
+    current_proposer : address = empty(address)
+    min_proposer_payout : uint256 = 0
+    current_proposer, min_proposer_payout = self._proposer()
+    if current_proposer != _proposer:
 
-        current_assets : uint256 = self._totalAssets()
+        # Pay prior proposer his earned fees if there's enough to actually do a transaction.
+        self._claim_fees(0, False, min_proposer_payout)
 
-        # Is there enough payout to actually do a transaction?
-        if self._claimable_fees_available(current_assets, False) >= self.min_proposer_payout:
-                
-            # Pay prior proposer his earned fees.
-            self._claim_fees(0, False, current_assets)
+        self.packed_proposer = bitwise_or(shift(convert(_min_proposer_payout, uint256), 160), convert(_proposer, uint256))
 
-        self.current_proposer = _proposer
-        self.min_proposer_payout = _min_proposer_payout
+    else:
+        # Fees up to now are still earned under the old weights.
+        self._checkpoint()
+
+    # Pools missing from the new plan get no allocation. Strategies listed in
+    # pool order match without scanning the whole plan.
+    strategy_count : uint256 = len(_strategies)
+    weights : uint256 = 0
+    total_weight : uint256 = 0
+    pos : uint256 = 0
+    for pool in self.dlending_pools:
+        ratio : uint256 = 0
+        if pos < strategy_count and _strategies[pos].adapter == pool:
+            ratio = _strategies[pos].ratio
+        else:
+            for strategy in _strategies:
+                if strategy.adapter == pool:
+                    ratio = strategy.ratio
+                    break
+
+        assert ratio <= MAX_WEIGHT, "Strategy ratio must fit in 16 bits."
+        weights = self._set_weight(weights, pos, ratio)
+        total_weight += ratio
+        pos += 1
 
+    self.packed_strategy_weights = weights
+    self.total_strategy_weight = total_weight
 
-    # Clear out all existing ratio allocations.
-    for pool in self.dlending_pools:
-        self.strategy[pool] = empty(uint256)
+    # Moving the assets over is left to rebalance() so a large shift can be
+    # made in as many bounded steps as it takes, see DynamoLens.rebalance_progress().
+    self.strategy_assets_moved = 0
 
-    # Now set strategies according to the new plan.
-    for strategy in _strategies:
-        self.strategy[strategy.adapter] = strategy.ratio 
+    log StrategyActivation(_proposer, keccak256(_abi_encode(_strategies)))
+
+    return True
 
-    # Rebalance vault according to new strategy.
-    self._balanceAdapters(0, convert(MAX_POOLS, uint8))
 
-    log StrategyActivation(_strategies, _proposer)
+@external
+def set_float(_low_bps: uint256, _target_bps: uint256, _high_bps: uint256) -> bool:
+    assert msg.sender == self.owner, "Only owner can set the float."
+    assert _low_bps <= _target_bps and _target_bps <= _high_bps, "Float watermarks out of order."
+    assert _high_bps <= MAX_FLOAT_BPS, "Float can't exceed totalAssets."
 
+    self.packed_float_bps = bitwise_or(bitwise_or(_low_bps, shift(_target_bps, FLOAT_TARGET)), shift(_high_bps, FLOAT_HIGH))
     return True
 
 
+@internal
+@pure
+def _float_watermark(_packed_bps: uint256, _offset: int128) -> uint256:
+    return bitwise_and(shift(_packed_bps, -_offset), 2**FLOAT_BITS - 1)
+
+
 @external
-def set_strategy(_proposer: address, _strategies : AdapterStrategy[MAX_POOLS], _min_proposer_payout : uint256) -> bool:
-    return self._set_strategy(_proposer, _strategies, _min_proposer_payout)
+@view
+def float_bps() -> (uint256, uint256, uint256):
+    packed : uint256 = self.packed_float_bps
+    return self._float_watermark(packed, FLOAT_LOW), self._float_watermark(packed, FLOAT_TARGET), self._float_watermark(packed, FLOAT_HIGH)
+
+
+@internal
+@pure
+def _float_balance(_total_assets: uint256, _float_bps: uint256) -> uint256:
+    return _total_assets * _float_bps / MAX_FLOAT_BPS
 
 
 @internal 
@@ -156,16 +270,18 @@ def _add_pool(_pool: address) -> bool:
     assert (_pool in self.dlending_pools) == False, "pool already supported."
 
     # Is this likely to be an actual LPAdapter contract?
-    response: Bytes[32] = empty(Bytes[32])
+    # Snapshots are built from state() so a pool without it would brick the vault.
+    response: Bytes[96] = empty(Bytes[96])
     result_ok: bool = empty(bool)
 
-    result_ok, response = raw_call(_pool, method_id("maxDeposit()"), max_outsize=32, is_static_call=True, revert_on_failure=False)
-    assert (response != empty(Bytes[32])), "Doesn't appear to be an LPAdapter."
+    result_ok, response = raw_call(_pool, method_id("state()"), max_outsize=96, is_static_call=True, revert_on_failure=False)
+    assert result_ok and len(response) == 96, "Doesn't appear to be an LPAdapter."
 
     self.dlending_pools.append(_pool)
 
     # TODO : Hack - for now give each pool equal strategic balance.
-    self.strategy[_pool] = 1
+    self.packed_strategy_weights = self._set_weight(self.packed_strategy_weights, len(self.dlending_pools) - 1, 1)
+    self.total_strategy_weight += 1
 
     log PoolAdded(msg.sender, _pool)
 
@@ -181,54 +297,107 @@ def add_pool(_pool: address) -> bool:
 
 
 @internal
-def _remove_pool(_pool: address) -> bool:
-    # TODO - pull out all assets, remove pool, rebalance pool.
-    return False
-
-
+def _remove_pool(_pool: address, _max_assets: uint256) -> bool:
+    # Settle fees against the assets before any of them move.
+    snapshot : VaultSnapshot = self._checkpoint()
+
+    pool_count : uint256 = len(self.dlending_pools)
+    pos : uint256 = pool_count
+    for i in range(MAX_POOLS):
+        if i == pool_count: break
+        if self.dlending_pools[i] == _pool:
+            pos = i
+            break
+    assert pos < pool_count, "pool not supported."
+
+    # Stop allocating to the pool so rebalancing only ever moves assets out of it.
+    weights : uint256 = self.packed_strategy_weights
+    weight : uint256 = self._weight(weights, pos)
+    if weight != 0:
+        weights = self._set_weight(weights, pos, 0)
+        self.packed_strategy_weights = weights
+        self.total_strategy_weight -= weight
+
+    # Pull out at most one chunk, whatever the adapter lets go of right now.
+    remaining : uint256 = snapshot.adapter_balances[pos]
+    max_withdraw : uint256 = 0
+    max_deposit : uint256 = 0
+    withdrawn : uint256 = min(snapshot.adapter_max_withdraws[pos], _max_assets)
+    if withdrawn > 0:
+        self._adapter_withdraw(_pool, withdrawn, self)
+        remaining, max_withdraw, max_deposit = self._poolState(_pool)
+
+    if remaining == 0:
+        # Empty, so fill the hole with the last pool.
+        last : uint256 = pool_count - 1
+        if pos != last:
+            self.dlending_pools[pos] = self.dlending_pools[last]
+            weights = self._set_weight(weights, pos, self._weight(weights, last))
+        self.dlending_pools.pop()
+        self.packed_strategy_weights = self._set_weight(weights, last, 0)
+
+    # Put what we freed up to work by the current strategy, the rest of the
+    # pool stays put until the next step.
+    if withdrawn > 0:
+        snapshot = self._snapshot()
+        if remaining > 0:
+            snapshot.adapter_max_withdraws[pos] = 0
+        self._balanceAdapters(self._float_balance(snapshot.total_balance, self._float_watermark(self.packed_float_bps, FLOAT_TARGET)), snapshot)
+
+    log PoolRemoval(msg.sender, _pool, withdrawn, remaining)
+
+    return remaining == 0
+
+
+# Removes a pool in steps of at most _max_assets (and the adapter's maxWithdraw)
+# so each transaction's gas stays bounded however large the position is.
+# Call again until it returns True.
 @external
-def remove_pool(_pool: address) -> bool:
+def remove_pool(_pool: address, _max_assets: uint256 = max_value(uint256)) -> bool:
     # Is this from the owner?
     assert msg.sender == self.owner, "Only owner can remove Lending Pools."
 
-    return self._remove_pool(_pool)
+    return self._remove_pool(_pool, _max_assets)
 
 
 @internal
 @view
-def _poolAssets(_pool: address) -> uint256:
-    response: Bytes[32] = empty(Bytes[32])
-    result_ok: bool = False
+def _poolState(_pool: address) -> (uint256, uint256, uint256):
+    assert _pool != empty(address), "EMPTY POOL!!"
 
-    assert _pool != empty(address), "EMPTY POOL!!"    
+    # One call for the balance & both limits, clamped to what the vault can move.
+    asset_balance : uint256 = 0
+    max_withdraw : uint256 = 0
+    max_deposit : uint256 = 0
+    asset_balance, max_withdraw, max_deposit = LPAdapter(_pool).state()
+    return asset_balance, min(max_withdraw, asset_balance), min(max_deposit, convert(max_value(int256), uint256))
 
-    # TODO: Shouldn't I just 'assetQty += LPAdapter(pool).totalAssets()'???
-    # assetQty += LPAdapter(pool).totalAssets()
-    result_ok, response = raw_call(
-        _pool,
-        method_id("totalAssets()"),
-        max_outsize=32,
-        is_static_call=True,
-        #is_delegate_call=True,
-        revert_on_failure=False
-        )
 
-    if result_ok:
-        return convert(response, uint256)
+@internal
+@view
+def _snapshot() -> VaultSnapshot:
+    result : VaultSnapshot = empty(VaultSnapshot)
+    result.local_asset_balance = ERC20(asset).balanceOf(self)
+    result.total_balance = result.local_asset_balance
 
-    assert result_ok, "TOTAL ASSETS REVERT!"        
-    return empty(uint256)
+    for pool in self.dlending_pools:
+        pool_balance : uint256 = 0
+        max_withdraw : uint256 = 0
+        max_deposit : uint256 = 0
+        pool_balance, max_withdraw, max_deposit = self._poolState(pool)
+        result.adapter_balances.append(pool_balance)
+        result.adapter_max_withdraws.append(max_withdraw)
+        result.adapter_max_deposits.append(max_deposit)
+        result.total_balance += pool_balance
+
+    return result
 
 
 @internal
 @view
 def _totalAssets() -> uint256:
-    assetQty : uint256 = ERC20(asset).balanceOf(self)
-    for pool in self.dlending_pools:
-        if pool == empty(address): break
-        assetQty += self._poolAssets(pool)
-
-    return assetQty
+    # Same state() calls as every other balance read.
+    return self._snapshot().total_balance
 
 
 @external
@@ -236,63 +405,225 @@ def _totalAssets() -> uint256:
 def totalAssets() -> uint256: return self._totalAssets()
 
 
+# The vault's balances & adapter limits as it sees them, for DynamoLens.
+@external
+@view
+def snapshot() -> VaultSnapshot: return self._snapshot()
+
+
 @internal
-@view 
-def _totalReturns(_current_assets : uint256 = 0) -> int256:
-    # Avoid having to call _totalAssets if we already know the value.
-    current_holdings : uint256 = _current_assets
-    if current_holdings == 0:
-        current_holdings = self._totalAssets()
+@pure
+def _mul_div(_x: uint256, _y: uint256, _denominator: uint256, _roundup: bool) -> uint256:
+    # Full precision x * y / denominator, rounded up or down as ERC-4626 requires.
+    # https://xn--2-umb.com/21/muldiv/
+    assert _denominator != 0, "mul_div division by zero."
+
+    # 512 bit product [prod1 prod0] = x * y via the Chinese Remainder Theorem.
+    mm : uint256 = uint256_mulmod(_x, _y, max_value(uint256))
+    prod0 : uint256 = unsafe_mul(_x, _y)
+    prod1 : uint256 = 0
+    if mm < prod0:
+        prod1 = unsafe_sub(unsafe_sub(mm, prod0), 1)
+    else:
+        prod1 = unsafe_sub(mm, prod0)
 
-    total_returns: int256 = convert(self.total_assets_withdrawn + current_holdings, int256) - convert(self.total_assets_deposited, int256)
-    return total_returns    
+    remainder : uint256 = uint256_mulmod(_x, _y, _denominator)
+    round_up : uint256 = 0
+    if _roundup and remainder != 0:
+        round_up = 1
+
+    # Fits in 256 bits so plain division will do.
+    if prod1 == 0:
+        return unsafe_div(prod0, _denominator) + round_up
+
+    assert _denominator > prod1, "mul_div overflow."
+
+    # Make the division exact by subtracting the remainder.
+    if remainder > prod0:
+        prod1 = unsafe_sub(prod1, 1)
+    prod0 = unsafe_sub(prod0, remainder)
+
+    # Factor the largest power of two out of the denominator.
+    twos : uint256 = bitwise_and(unsafe_sub(0, _denominator), _denominator)
+    denominator : uint256 = unsafe_div(_denominator, twos)
+    prod0 = unsafe_div(prod0, twos)
+
+    # Shift in the bits from prod1, twos becomes 2**256 / twos.
+    twos = unsafe_add(unsafe_div(unsafe_sub(0, twos), twos), 1)
+    prod0 = bitwise_or(prod0, unsafe_mul(prod1, twos))
+
+    # Invert the now odd denominator mod 2**256 by Newton-Raphson, each step
+    # doubles the correct bits starting from 4.
+    inverse : uint256 = bitwise_xor(unsafe_mul(3, denominator), 2)
+    for i in range(6):
+        inverse = unsafe_mul(inverse, unsafe_sub(2, unsafe_mul(denominator, inverse)))
+
+    return unsafe_mul(prod0, inverse) + round_up
+
+
+@internal
+@pure
+def _pack(_low : uint256, _high : uint256) -> uint256:
+    # Converting through uint128 reverts rather than letting a counter spill
+    # into its neighbour.
+    return bitwise_or(shift(convert(convert(_high, uint128), uint256), 128), convert(convert(_low, uint128), uint256))
+
+
+@internal
+@pure
+def _unpack(_packed : uint256) -> (uint256, uint256):
+    return bitwise_and(_packed, convert(max_value(uint128), uint256)), shift(_packed, -128)
+
+
+@internal
+@view
+def _proposer() -> (address, uint256):
+    packed : uint256 = self.packed_proposer
+    return convert(bitwise_and(packed, convert(max_value(uint160), uint256)), address), shift(packed, -160)
+
+
+@external
+@view
+def total_assets_deposited() -> uint256: return bitwise_and(self.packed_asset_flows, convert(max_value(uint128), uint256))
+
+
+@external
+@view
+def total_assets_withdrawn() -> uint256: return shift(self.packed_asset_flows, -128)
+
+
+@external
+@view
+def total_yield_fees_claimed() -> uint256: return bitwise_and(self.packed_fees_claimed, convert(max_value(uint128), uint256))
+
+
+@external
+@view
+def total_strategy_fees_claimed() -> uint256: return shift(self.packed_fees_claimed, -128)
 
 
 @internal
 @view 
-def _claimable_fees_available(_current_assets : uint256 = 0, _yield : bool = True) -> uint256:
-    total_returns : int256 = self._totalReturns(_current_assets)
-    if total_returns < 0: return 0
+def _totalReturns(_current_assets : uint256) -> int256:
+    deposited : uint256 = 0
+    withdrawn : uint256 = 0
+    deposited, withdrawn = self._unpack(self.packed_asset_flows)
+    total_returns: int256 = convert(withdrawn + _current_assets, int256) - convert(deposited, int256)
+    return total_returns    
+
 
-    fee_percentage: decimal = YIELD_FEE_PERCENTAGE
-    if _yield == False:
-        fee_percentage = PROPOSER_FEE_PERCENTAGE
+@internal
+@view
+def _fee_shares_due(_total_assets : uint256, _total_returns : int256) -> (uint256, uint256):
+    # Only returns above the high-water mark are charged, so a loss has to be
+    # made good before fees are taken again. Returns the shares worth the fees
+    # once minted & how many of them are yield fee shares.
+    high_water_mark : uint256 = self.fee_high_water_mark
+    if _total_returns <= convert(high_water_mark, int256): return 0, 0
 
-    dtotal_fees_available : decimal = convert(total_returns, decimal) * (fee_percentage / 100.0)
+    gain : uint256 = convert(_total_returns, uint256) - high_water_mark
+    yield_fees : uint256 = gain * YIELD_FEE_PERCENTAGE / 100
+    fees : uint256 = yield_fees + gain * PROPOSER_FEE_PERCENTAGE / 100
+    share_supply : uint256 = self.totalSupply
+    if fees == 0 or share_supply == 0: return 0, 0
 
+    fee_shares : uint256 = self._mul_div(fees, share_supply, _total_assets - fees, False)
+    return fee_shares, self._mul_div(fee_shares, yield_fees, fees, False)
+
+
+@internal
+def _accrue_fees(_total_assets : uint256):
+    total_returns : int256 = self._totalReturns(_total_assets)
+    if total_returns <= convert(self.fee_high_water_mark, int256): return
+    fee_shares : uint256 = 0
+    yield_shares : uint256 = 0
+    fee_shares, yield_shares = self._fee_shares_due(_total_assets, total_returns)
+    self.fee_high_water_mark = convert(total_returns, uint256)
+    if fee_shares == 0: return
+
+    yield_fee_shares : uint256 = 0
+    strategy_fee_shares : uint256 = 0
+    yield_fee_shares, strategy_fee_shares = self._unpack(self.packed_fee_shares)
+    self.packed_fee_shares = self._pack(yield_fee_shares + yield_shares, strategy_fee_shares + fee_shares - yield_shares)
+    self._mint(self, fee_shares)
+
+
+# Snapshot for state changing calls, with fees taken up to now.
+@internal
+def _checkpoint() -> VaultSnapshot:
+    snapshot : VaultSnapshot = self._snapshot()
+    self._accrue_fees(snapshot.total_balance)
+    return snapshot
+
+
+@internal
+@view
+def _fee_assets(_yield : bool, _total_assets : uint256) -> uint256:
+    yield_fee_shares : uint256 = 0
+    strategy_fee_shares : uint256 = 0
+    yield_fee_shares, strategy_fee_shares = self._unpack(self.packed_fee_shares)
     if _yield == True:
-        return convert(dtotal_fees_available, uint256) - self.total_yield_fees_claimed
-    else:
-        return convert(dtotal_fees_available, uint256) - self.total_strategy_fees_claimed
+        return self._convertToAssets(yield_fee_shares, _total_assets)
+    return self._convertToAssets(strategy_fee_shares, _total_assets)
 
 
 @internal
-def _claim_fees(_asset_amount: uint256, _yield : bool = True,_current_assets : uint256 = 0) -> uint256:
+def _claim_fees(_asset_amount: uint256, _yield : bool, _min_payout : uint256) -> uint256:
+    # Checkpoints here rather than in each caller, the snapshot is a large
+    # struct to pass around.
+    snapshot : VaultSnapshot = self._checkpoint()
+
     # If current proposer is zero address we pay no strategy fees.    
-    if _yield == False and self.current_proposer == empty(address): return 0
+    current_proposer : address = empty(address)
+    min_proposer_payout : uint256 = 0
+    current_proposer, min_proposer_payout = self._proposer()
+    if _yield == False and current_proposer == empty(address): return 0
 
     claim_amount : uint256 = _asset_amount
 
-    total_fees_remaining : uint256 = self._claimable_fees_available(_current_assets, _yield)
+    total_fees_remaining : uint256 = self._fee_assets(_yield, snapshot.total_balance)
     if _asset_amount == 0:
         claim_amount = total_fees_remaining
 
-    # Do we have _asset_amount of fees available to claim?
-    if total_fees_remaining < claim_amount: return 0
+    # Do we have _asset_amount of fees available to claim? Is it worth a transfer?
+    if total_fees_remaining < claim_amount or claim_amount < _min_payout: return 0
 
     # Good claim. Do we have the balance locally?
-    if ERC20(asset).balanceOf(self) < claim_amount:
+    if snapshot.local_asset_balance < claim_amount:
 
         # Need to liquidate some shares to fulfill 
-        self._balanceAdapters(claim_amount)
+        self._balanceAdapters(claim_amount, snapshot)
 
-    # Account for the claim and move the funds.
+    # Burn the fee shares backing the claim, rounding against the claimant.
+    yield_fee_shares : uint256 = 0
+    strategy_fee_shares : uint256 = 0
+    yield_fee_shares, strategy_fee_shares = self._unpack(self.packed_fee_shares)
+    claim_shares : uint256 = self._convertToShares(claim_amount, snapshot.total_balance, True)
+    if _yield == True:
+        claim_shares = min(claim_shares, yield_fee_shares)
+        self.packed_fee_shares = self._pack(yield_fee_shares - claim_shares, strategy_fee_shares)
+    else:
+        claim_shares = min(claim_shares, strategy_fee_shares)
+        self.packed_fee_shares = self._pack(yield_fee_shares, strategy_fee_shares - claim_shares)
+    self.balanceOf[self] -= claim_shares
+    self.totalSupply -= claim_shares
+    log Transfer(self, empty(address), claim_shares)
+
+    # Account for the claim and move the funds. Claimed fees count as withdrawn
+    # so paying them out doesn't eat into the returns.
+    yield_claimed : uint256 = 0
+    strategy_claimed : uint256 = 0
+    yield_claimed, strategy_claimed = self._unpack(self.packed_fees_claimed)
+    deposited : uint256 = 0
+    withdrawn : uint256 = 0
+    deposited, withdrawn = self._unpack(self.packed_asset_flows)
+    self.packed_asset_flows = self._pack(deposited, withdrawn + claim_amount)
     if _yield == True:
-        self.total_yield_fees_claimed += claim_amount
+        self.packed_fees_claimed = self._pack(yield_claimed + claim_amount, strategy_claimed)
         ERC20(asset).transfer(self.owner, claim_amount)
     else:
-        self.total_strategy_fees_claimed += claim_amount
-        ERC20(asset).transfer(self.current_proposer, claim_amount)
+        self.packed_fees_claimed = self._pack(yield_claimed, strategy_claimed + claim_amount)
+        ERC20(asset).transfer(current_proposer, claim_amount)
 
     return claim_amount
 
@@ -300,71 +631,81 @@ def _claim_fees(_asset_amount: uint256, _yield : bool = True,_current_assets : u
 @external
 def claim_yield_fees(_asset_amount: uint256 = 0) -> uint256:
     assert msg.sender == self.owner, "Only owner may claim yield fees."
-    return self._claim_fees(_asset_amount, True)
+    return self._claim_fees(_asset_amount, True, 0)
 
 
 @external
 def claim_strategy_fees(_asset_amount: uint256 = 0) -> uint256:
-    assert msg.sender == self.current_proposer, "Only curent proposer may claim strategy fees."
-    return self._claim_fees(_asset_amount, False)    
+    current_proposer : address = empty(address)
+    min_proposer_payout : uint256 = 0
+    current_proposer, min_proposer_payout = self._proposer()
+    assert msg.sender == current_proposer, "Only curent proposer may claim strategy fees."
+    return self._claim_fees(_asset_amount, False, 0)
+
+
+# Fee shares the next checkpoint would mint. The conversion views count them so
+# a preview never promises more than the state changing call that follows,
+# which checkpoints first.
+@internal
+@view
+def _pending_fee_shares(_total_assets: uint256) -> uint256:
+    fee_shares : uint256 = 0
+    yield_shares : uint256 = 0
+    fee_shares, yield_shares = self._fee_shares_due(_total_assets, self._totalReturns(_total_assets))
+    return fee_shares
 
 
 @internal
 @view
-def _convertToShares(_asset_amount: uint256) -> uint256:
+def _convertToShares(_asset_amount: uint256, _total_assets: uint256, _roundup: bool = False, _with_pending_fees: bool = False) -> uint256:
     shareQty : uint256 = self.totalSupply
-    assetQty : uint256 = self._totalAssets()
+    assetQty : uint256 = _total_assets
+    if _with_pending_fees:
+        shareQty += self._pending_fee_shares(_total_assets)
 
     # If there aren't any shares/assets yet it's going to be 1:1.
     if shareQty == 0 : return _asset_amount
     if assetQty == 0 : return _asset_amount
 
-    sharesPerAsset : decimal = convert(shareQty, decimal) / convert(assetQty, decimal)
-
-    return convert(convert(_asset_amount, decimal) * sharesPerAsset, uint256)
+    return self._mul_div(_asset_amount, shareQty, assetQty, _roundup)
 
 
 @external
 @view
-def convertToShares(_asset_amount: uint256) -> uint256: return self._convertToShares(_asset_amount)
+def convertToShares(_asset_amount: uint256) -> uint256: return self._convertToShares(_asset_amount, self._totalAssets(), False, True)
 
 
 @internal
 @view
-def _convertToAssets(_share_amount: uint256) -> uint256:
-    # return _share_amount
-
+def _convertToAssets(_share_amount: uint256, _total_assets: uint256, _roundup: bool = False, _with_pending_fees: bool = False) -> uint256:
     shareQty : uint256 = self.totalSupply
-    total_assets : uint256 = self._totalAssets()
-
-    # TODO - do these two calls to claimable_fees_available open us up to potential rounding errors?
-    assetQty : uint256 = total_assets - (self._claimable_fees_available(total_assets, True) + self._claimable_fees_available(total_assets, False))
-
+    if _with_pending_fees:
+        shareQty += self._pending_fee_shares(_total_assets)
 
     # If there aren't any shares yet it's going to be 1:1.
     if shareQty == 0: return _share_amount
 
-    assetsPerShare : decimal = convert(assetQty, decimal) / convert(shareQty, decimal)
-
-    return convert(convert(_share_amount, decimal) * assetsPerShare, uint256)
+    # Fees are out of the picture as shares, see _accrue_fees.
+    return self._mul_div(_share_amount, _total_assets, shareQty, _roundup)
 
 
 @external
 @view
-def convertToAssets(_share_amount: uint256) -> uint256: return self._convertToAssets(_share_amount)
+def convertToAssets(_share_amount: uint256) -> uint256: return self._convertToAssets(_share_amount, self._totalAssets(), False, True)
 
 
 @external
 @view
 def maxDeposit() -> uint256:
     # TODO - if deposits are disabled return 0
-    # Ensure this value cannot take local asset balance over max_value(128) for _getBalanceTxs math.
-    return convert(max_value(int128), uint256) - ERC20(asset).balanceOf(self)
+    # Ensure this value cannot take local asset balance over max_value(int256) for _getBalanceTxs math.
+    return convert(max_value(int256), uint256) - ERC20(asset).balanceOf(self)
 
 
 @external
+@view
 def previewDeposit(_asset_amount: uint256) -> uint256:
-    return self._convertToShares(_asset_amount)
+    return self._convertToShares(_asset_amount, self._totalAssets(), False, True)
 
 
 @external
@@ -372,20 +713,22 @@ def previewDeposit(_asset_amount: uint256) -> uint256:
 # Returns maximum number of shares that can be minted for this address.
 def maxMint(_receiver: address) -> uint256:
     # TODO - if mints are disabled return 0.
-    return convert(max_value(int128), uint256)
+    return convert(max_value(int256), uint256)
 
 
 @external
 @view 
 # Returns asset qty that would be returned for this share_amount.
 def previewMint(_share_amount: uint256) -> uint256:
-    return self._convertToAssets(_share_amount)
+    return self._convertToAssets(_share_amount, self._totalAssets(), True, True)
 
 
 @external
 def mint(_share_amount: uint256, _receiver: address) -> uint256:
-    assetQty : uint256 = self._convertToAssets(_share_amount)
-    return self._deposit(assetQty, _receiver)
+    snapshot : VaultSnapshot = self._checkpoint()
+    assetQty : uint256 = self._convertToAssets(_share_amount, snapshot.total_balance, True)
+    self._deposit(assetQty, _share_amount, _receiver, snapshot)
+    return assetQty
 
 
 @external
@@ -393,13 +736,13 @@ def mint(_share_amount: uint256, _receiver: address) -> uint256:
 # Returns maximum assets this _owner can extract.
 def maxWithdraw(_owner: address) -> uint256:
     # TODO: If withdraws are disabled return 0.
-    return self._convertToAssets(self.balanceOf[_owner])
+    return self._convertToAssets(self.balanceOf[_owner], self._totalAssets(), False, True)
 
 
 @external
 @view 
 def previewWithdraw(_asset_amount: uint256) -> uint256:
-    return self._convertToShares(_asset_amount)
+    return self._convertToShares(_asset_amount, self._totalAssets(), True, True)
 
 
 @external
@@ -413,13 +756,14 @@ def maxRedeem(_owner: address) -> uint256:
 @external
 @view 
 def previewRedeem(_share_amount: uint256) -> uint256:
-    return self._convertToAssets(_share_amount)
+    return self._convertToAssets(_share_amount, self._totalAssets(), False, True)
 
 
 @external
 def redeem(_share_amount: uint256, _receiver: address, _owner: address) -> uint256:
-    assetQty: uint256 = self._convertToAssets(_share_amount)
-    return self._withdraw(assetQty, _receiver, _owner)
+    snapshot : VaultSnapshot = self._checkpoint()
+    assetQty: uint256 = self._convertToAssets(_share_amount, snapshot.total_balance)
+    return self._withdraw(assetQty, _receiver, _owner, snapshot)
 
 
 struct BalanceTX:
@@ -427,150 +771,241 @@ struct BalanceTX:
     Adapter: address
 
 
-# TODO : make sure that a zero allocation for an adapter takes precedence over zero
-#        target balance for main pool. If all adapters have 0 allocation then main
-#        pool must take all the assets regardless of _target_asset_balance!
+# Plans the fewest, largest adapter moves that leave the vault holding at least
+# _target_asset_balance locally and the adapters as close to their strategy
+# ratios as _max_txs allows. Past what the target needs only moves of at least
+# _min_move are planned, none with a _min_move of 0. Withdrawals are always
+# ordered before deposits so they can fund them. An adapter with no strategy
+# allocation is targeted at zero, so if every adapter has a zero allocation the
+# vault keeps all the assets.
+# Only actual moves are returned.
 @internal
-def _getBalanceTxs( _target_asset_balance: uint256, _max_txs: uint8) -> BalanceTX[MAX_POOLS]: # DynArray[BalanceTX, MAX_POOLS]:
-    # result : DynArray[BalanceTX, MAX_POOLS] = empty(DynArray[BalanceTX, MAX_POOLS])
-    result : BalanceTX[MAX_POOLS] = empty(BalanceTX[MAX_POOLS])
+@view
+def _getBalanceTxs( _target_asset_balance: uint256, _max_txs: uint8, _snapshot: VaultSnapshot, _min_move: uint256) -> DynArray[BalanceTX, MAX_POOLS]:
+    result : DynArray[BalanceTX, MAX_POOLS] = empty(DynArray[BalanceTX, MAX_POOLS])
 
     # If there are no pools then nothing to do.
-    if len(self.dlending_pools) == 0: return result
-
-    current_local_asset_balance : uint256 = ERC20(asset).balanceOf(self) 
-
-    # TODO - New stuff starts here!
-    total_balance : uint256 = current_local_asset_balance
-    total_shares : uint256 = 0 
-
-    # Determine current balances.
-    currentBalances : uint256[MAX_POOLS] = empty(uint256[MAX_POOLS])    
-    pos: uint256 = 0
-    for pool in self.dlending_pools:
-        poolBalance : uint256 = self._poolAssets(pool)
-        total_balance += poolBalance
-        total_shares += self.strategy[pool]
-        currentBalances[pos] = poolBalance
-        pos += 1
-
-    # Is there any strategy to deal with?
-    if total_shares == 0: return result        
-
-    available_balance : int256 = convert(total_balance, int256) - convert(_target_asset_balance, int256)
-
-    # Determine target balances.
-    targetBalances : uint256[MAX_POOLS] = empty(uint256[MAX_POOLS])    
-    deltaBalances : int256[MAX_POOLS] = empty(int256[MAX_POOLS])    
-    pos = 0
-    for pool in self.dlending_pools:
-        share_ratio : decimal = convert(self.strategy[pool], decimal) / convert(total_shares, decimal)
-        targetBalances[pos] = convert(convert(available_balance, decimal) * share_ratio, uint256)
-        deltaBalances[pos] = convert(targetBalances[pos],int256) - convert(currentBalances[pos], int256)
+    pool_count : uint256 = len(_snapshot.adapter_balances)
+    if pool_count == 0: return result
+
+    total_shares : uint256 = self.total_strategy_weight
+    weights : uint256 = self.packed_strategy_weights
+
+    available_balance : uint256 = 0
+    if _snapshot.total_balance > _target_asset_balance:
+        available_balance = _snapshot.total_balance - _target_asset_balance
+
+    # Determine how far each adapter is from its target balance, limited by
+    # what the adapter will actually accept or give back right now.
+    deltaBalances : int256[MAX_POOLS] = empty(int256[MAX_POOLS])
+    moveSizes : uint256[MAX_POOLS] = empty(uint256[MAX_POOLS])
+    order : uint256[MAX_POOLS] = empty(uint256[MAX_POOLS])
+    for pos in range(MAX_POOLS):
+        if pos == pool_count: break
+        order[pos] = pos
+        targetBalance : uint256 = 0
+        if total_shares > 0:
+            targetBalance = self._mul_div(available_balance, self._weight(weights, pos), total_shares, False)
+        currentBalance : uint256 = _snapshot.adapter_balances[pos]
+
+        if targetBalance > currentBalance:
+            moveSizes[pos] = min(targetBalance - currentBalance, _snapshot.adapter_max_deposits[pos])
+            deltaBalances[pos] = convert(moveSizes[pos], int256)
+        elif targetBalance < currentBalance:
+            moveSizes[pos] = min(currentBalance - targetBalance, _snapshot.adapter_max_withdraws[pos])
+            deltaBalances[pos] = -convert(moveSizes[pos], int256)
+
+    # Order the adapters by the size of their move, largest first & ties in pool
+    # order. Even strategies usually leave the moves in order already, otherwise
+    # heapsort so this stays O(n log n). The heap keeps the move that sorts last
+    # on top and each pop parks it at the end of the unsorted range.
+    in_order : bool = True
+    for pos in range(1, MAX_POOLS):
+        if pos == pool_count: break
+        if moveSizes[pos] > moveSizes[pos - 1]:
+            in_order = False
+            break
+
+    if not in_order:
+        heap_size : uint256 = pool_count
+        heap_start : uint256 = pool_count / 2
+        for step in range(MAX_POOLS * 2):
+            if heap_start > 0:
+                # Still building the heap, sift down the next parent.
+                heap_start -= 1
+            else:
+                heap_size -= 1
+                if heap_size == 0: break
+                top : uint256 = order[0]
+                order[0] = order[heap_size]
+                order[heap_size] = top
+
+            parent : uint256 = heap_start
+            for depth in range(MAX_POOLS):
+                child : uint256 = 2 * parent + 1
+                if child >= heap_size: break
+                # Pick the child that sorts last.
+                if child + 1 < heap_size:
+                    left : uint256 = order[child]
+                    right : uint256 = order[child + 1]
+                    if moveSizes[left] > moveSizes[right] or (moveSizes[left] == moveSizes[right] and left < right):
+                        child += 1
+                parent_pos : uint256 = order[parent]
+                child_pos : uint256 = order[child]
+                if moveSizes[child_pos] > moveSizes[parent_pos] or (moveSizes[child_pos] == moveSizes[parent_pos] and child_pos < parent_pos): break
+                order[parent] = child_pos
+                order[child] = parent_pos
+                parent = child
+
+    max_txs : uint256 = min(convert(_max_txs, uint256), pool_count)
+    tx_count : uint256 = 0
+    planned : int256[MAX_POOLS] = empty(int256[MAX_POOLS])
+    selected : bool[MAX_POOLS] = empty(bool[MAX_POOLS])
 
     # How far off are we from our target asset balance?
-    deltaTarget : int256 = convert(current_local_asset_balance, int256) - convert(_target_asset_balance, int256)
-
-    # Prioritize and allocate transactions.    
-    pos = 0
-    for pool in self.dlending_pools:
-        # Is the 4626 pool short on its requirements?
-        if deltaTarget < 0:
-            lowest : int256 = 0
-            lowest_pos : uint256 = 0 
-
-            # Find the tx that will bring the most money into the 4626 pool.
-            i : uint256 = 0
-            for ip in self.dlending_pools:                
-                low_candidate : int256 = deltaBalances[pos]
-                if low_candidate < lowest:
-                    lowest = low_candidate
-                    lowest_pos = pos 
-                i+=1
-            result[pos] = BalanceTX({Qty: lowest, Adapter:self.dlending_pools[lowest_pos]})
-            deltaBalances[lowest_pos] = 0
-            deltaTarget -= lowest                        
+    deltaTarget : int256 = convert(_snapshot.local_asset_balance, int256) - convert(_target_asset_balance, int256)
+
+    # Whatever we hold above the target still has to be placed.
+    surplus : uint256 = 0
+    if deltaTarget > 0:
+        surplus = convert(deltaTarget, uint256)
+
+    # Cover any shortfall with the largest withdrawals first.
+    for i in range(MAX_POOLS):
+        if i == pool_count or tx_count == max_txs or deltaTarget >= 0: break
+        pos : uint256 = order[i]
+        delta : int256 = deltaBalances[pos]
+        if delta >= 0: continue
+        planned[pos] = delta
+        selected[pos] = True
+        tx_count += 1
+        deltaTarget -= delta
+
+    # Still short? Then we have to draw adapters down below their targets.
+    if deltaTarget < 0:
+        for i in range(MAX_POOLS):
+            if i == pool_count or deltaTarget >= 0: break
+            pos : uint256 = order[i]
+            if not selected[pos] and tx_count == max_txs: continue
+            drawable : int256 = convert(_snapshot.adapter_max_withdraws[pos], int256) + planned[pos]
+            if drawable <= 0: continue
+            extra : int256 = min(drawable, -deltaTarget)
+            if not selected[pos]:
+                selected[pos] = True
+                tx_count += 1
+            planned[pos] -= extra
+            deltaTarget += extra
+
+        assert deltaTarget >= 0, "CAN'T BALANCE SOON ENOUGH!"
+
+    # Spend any remaining txs on the largest outstanding moves. Once the target
+    # is met & the surplus placed, only on moves of at least _min_move.
+    for i in range(MAX_POOLS):
+        if i == pool_count or tx_count == max_txs: break
+        pos : uint256 = order[i]
+        delta : int256 = deltaBalances[pos]
+        if selected[pos] or delta == 0: continue
+        if (delta < 0 or surplus == 0) and (_min_move == 0 or moveSizes[pos] < _min_move): continue
+        # An unfunded deposit in the last tx would come to nothing, a withdrawal
+        # there keeps a rebalance done in small steps making progress.
+        if delta > 0 and deltaTarget == 0 and unsafe_add(tx_count, 1) == max_txs: continue
+        planned[pos] = delta
+        selected[pos] = True
+        tx_count += 1
+        if delta < 0:
+            deltaTarget -= delta
         else:
-            # Prioritize the tx that will have the highest impact on the balances.
-            largest : int256 = 0
-            largest_pos : uint256 = 0
-
-            i : uint256 = 0
-            for ip in self.dlending_pools: 
-                if abs(deltaBalances[i]) > abs(largest):
-                    # Ensure we don't let our 4626 pool fall short of its requirements.
-                    if deltaTarget + deltaBalances[i] < 0: continue
-                    largest = deltaBalances[i]
-                    largest_pos = i
-                i+=1
-            result[pos] = BalanceTX({Qty: largest, Adapter:self.dlending_pools[largest_pos]})
-            deltaBalances[largest_pos] = 0
-            deltaTarget += largest
-            
-        pos += 1
-
-    # Make sure we meet our _target_asset_balance goal within _max_txs steps!
-    assert current_local_asset_balance <= max_value(int128) and convert(current_local_asset_balance, int256) >= min_value(int128), "BUSTED!" # TODO remove
-    running_balance : int256 = convert(current_local_asset_balance, int256)
-    for btx in result:        
-        if btx.Qty == 0: break
-        running_balance += btx.Qty
-
-
-    if running_balance < convert(_target_asset_balance, int256):
-        diff : int256 = convert(_target_asset_balance, int256) - running_balance
-        pos = 0
-        for btx in result:
-            # Is there enough in the Adapter to satisfy our deficit?
-            available_funds : int256 = convert(self._poolAssets(btx.Adapter), int256) + btx.Qty
-            # TODO : Consider also checking that we aren't over the Adapter's maxWithdraw limit here.
-            if available_funds >= diff:
-                btx.Qty-= diff
-                diff = 0 
-                break
-            elif available_funds > 0:
-                btx.Qty-=available_funds
-                diff+=available_funds
-
-        # TODO - remove this after testing.
-        assert diff <= 0, "CAN'T BALANCE SOON ENOUGH!"
-
-    # Now make sure we aren't asking for more txs than allowed.
-    # Wipe out any extras.
-    pos = 0
-    for btx in result:
-        if btx.Qty != 0: pos+=1
-        if convert(_max_txs, uint256) < pos and btx.Qty != 0:
-            btx.Qty = 0
+            surplus -= min(surplus, moveSizes[pos])
+
+    # Deposits can only be funded from what we hold above our target balance.
+    for i in range(MAX_POOLS):
+        if i == pool_count: break
+        pos : uint256 = order[i]
+        if planned[pos] <= 0: continue
+        planned[pos] = min(planned[pos], deltaTarget)
+        deltaTarget -= planned[pos]
+
+    # Withdrawals go first so they can fund the deposits.
+    for i in range(MAX_POOLS):
+        if i == pool_count: break
+        pos : uint256 = order[i]
+        if planned[pos] < 0:
+            result.append(BalanceTX({Qty: planned[pos], Adapter: self.dlending_pools[pos]}))
+    for i in range(MAX_POOLS):
+        if i == pool_count: break
+        pos : uint256 = order[i]
+        if planned[pos] > 0:
+            result.append(BalanceTX({Qty: planned[pos], Adapter: self.dlending_pools[pos]}))
 
     return result
 
 
 @internal
-def _balanceAdapters( _target_asset_balance: uint256, _max_txs: uint8 = MAX_BALTX_DEPOSIT ):
+def _balanceAdapters( _target_asset_balance: uint256, _snapshot: VaultSnapshot, _max_txs: uint8 = MAX_BALTX_DEPOSIT, _min_move: uint256 = 0 ) -> (uint256, uint256):
+
+    # Make sure we have enough assets to send to _receiver. User flows leave
+    # _min_move at 0 so they only make the moves their target balance needs,
+    # strategy drift is left to rebalance.
+    txs: DynArray[BalanceTX, MAX_POOLS] = self._getBalanceTxs( _target_asset_balance, _max_txs, _snapshot, _min_move )
 
-    # Make sure we have enough assets to send to _receiver.
-    # txs: DynArray[BalanceTX, MAX_POOLS] = empty(DynArray[BalanceTX, MAX_POOLS])
-    txs: BalanceTX[MAX_POOLS] = empty(BalanceTX[MAX_POOLS])
-    txs = self._getBalanceTxs( _target_asset_balance, _max_txs )
+    # Track our local balance rather than asking the asset contract after every move.
+    local_asset_balance : uint256 = _snapshot.local_asset_balance
+    moves : uint256 = 0
+    assets_moved : uint256 = 0
 
     # Move the funds in/out of Lending Pools as required.
     for dtx in txs:
         if dtx.Qty > 0:
+            qty: uint256 = convert(dtx.Qty, uint256)
+            if _min_move > 0:
+                # A skipped dust withdrawal may have been meant to fund this.
+                surplus : uint256 = 0
+                if local_asset_balance > _target_asset_balance:
+                    surplus = local_asset_balance - _target_asset_balance
+                qty = min(qty, surplus)
+                if qty < _min_move: continue
+
             # Move funds into the lending pool's adapter.
-            assert ERC20(asset).balanceOf(self) >= convert(dtx.Qty, uint256), "_balanceAdapters insufficient assets!"
+            assert local_asset_balance >= qty, "_balanceAdapters insufficient assets!"
             # TODO : check for deposit failure. If it's due to going beyond
             #        the adapter's maxDeposit() limit, try again with lower limit.
-            self._adapter_deposit(dtx.Adapter, convert(dtx.Qty, uint256))
+            self._adapter_deposit(dtx.Adapter, qty)
+            local_asset_balance -= qty
+            moves += 1
+            assets_moved += qty
 
         elif dtx.Qty < 0:
             # Liquidate funds from lending pool's adapter.
             qty: uint256 = convert(dtx.Qty * -1, uint256)
+            if qty < _min_move: continue
             # TODO : check for withdraw failure. If it's due to going beyond
             #        the adapter's maxWithdraw limit then try again with lower limit.
             # TODO:  We also have to check to see if we short the 4626 balance, where
             #        the necessary funds will come from! Otherwise this may need to revert.
             self._adapter_withdraw(dtx.Adapter, qty, self)
+            local_asset_balance += qty
+            moves += 1
+            assets_moved += qty
+
+    return moves, assets_moved
+
+
+@external
+def rebalance(_max_txs: uint8, _min_move: uint256) -> uint256:
+    # Lets a keeper bring the adapters in line with the strategy & float in one go
+    # without burdening user transactions. Moves smaller than _min_move are skipped.
+    start_gas : uint256 = msg.gas
+
+    snapshot : VaultSnapshot = self._checkpoint()
+    moves : uint256 = 0
+    assets_moved : uint256 = 0
+    # A _min_move of 0 would only plan for the float.
+    moves, assets_moved = self._balanceAdapters( self._float_balance(snapshot.total_balance, self._float_watermark(self.packed_float_bps, FLOAT_TARGET)), snapshot, _max_txs, max(_min_move, 1) )
+    self.strategy_assets_moved += assets_moved
+
+    log Rebalance(msg.sender, moves, assets_moved, start_gas - msg.gas)
+
+    return moves
 
 
 @internal
@@ -627,44 +1062,50 @@ def _adapter_withdraw(_adapter: address, _asset_amount: uint256, _withdraw_to: a
 
 
 @internal
-def _deposit(_asset_amount: uint256, _receiver: address) -> uint256:
-    assert _receiver != empty(address), "Cannot send shares to zero address."
-
+def _deposit(_asset_amount: uint256, _share_amount: uint256, _receiver: address, _snapshot: VaultSnapshot):
+    # _mint() rejects a zero address receiver.
     assert _asset_amount <= ERC20(asset).balanceOf(msg.sender), "4626Deposit insufficient funds."
 
-    # MUST COMPUTE SHARES FIRST!
-    shares : uint256 = self._convertToShares(_asset_amount)
-
     # Move assets to this contract from caller in one go.
     ERC20(asset).transferFrom(msg.sender, self, _asset_amount)
 
-    # It's our intention to move all funds into the lending pools so 
-    # our target balance is zero.
-    self._balanceAdapters( empty(uint256) )
+    snapshot : VaultSnapshot = _snapshot
+    snapshot.local_asset_balance += _asset_amount
+    snapshot.total_balance += _asset_amount
 
-    # Now mint assets to return to investor.    
-    assert shares == _asset_amount, "DIFFERENT VALUES!"
-    self._mint(_receiver, shares)
+    # Only move funds into the lending pools once we're above our float.
+    float_bps : uint256 = self.packed_float_bps
+    float_high : uint256 = 0
+    float_target : uint256 = 0
+    if float_bps != 0:
+        float_high = self._float_balance(snapshot.total_balance, self._float_watermark(float_bps, FLOAT_HIGH))
+        float_target = self._float_balance(snapshot.total_balance, self._float_watermark(float_bps, FLOAT_TARGET))
+    if snapshot.local_asset_balance > float_high:
+        self._balanceAdapters( float_target, snapshot )
 
-    #assert False, "GOT HERE!"
+    # Now mint shares to return to investor, priced before the deposit.
+    self._mint(_receiver, _share_amount)
 
     # Update all-time assets deposited for yield tracking.
-    self.total_assets_deposited += _asset_amount
-
-    result : uint256 = _asset_amount
-
-    return result
+    deposited : uint256 = 0
+    withdrawn : uint256 = 0
+    deposited, withdrawn = self._unpack(self.packed_asset_flows)
+    self.packed_asset_flows = self._pack(deposited + _asset_amount, withdrawn)
 
 
 @external
-def deposit(_asset_amount: uint256, _receiver: address) -> uint256: return self._deposit(_asset_amount, _receiver)
+def deposit(_asset_amount: uint256, _receiver: address) -> uint256:
+    snapshot : VaultSnapshot = self._checkpoint()
+    shares : uint256 = self._convertToShares(_asset_amount, snapshot.total_balance)
+    self._deposit(_asset_amount, shares, _receiver, snapshot)
+    return shares
 
 
 @internal
-def _withdraw(_asset_amount: uint256,_receiver: address,_owner: address) -> uint256:
+def _withdraw(_asset_amount: uint256,_receiver: address,_owner: address, _snapshot: VaultSnapshot) -> uint256:
 
     # How many shares does it take to get the requested asset amount?
-    shares: uint256 = self._convertToShares(_asset_amount)
+    shares: uint256 = self._convertToShares(_asset_amount, _snapshot.total_balance, True)
 
     # Owner has adequate shares?
     assert self.balanceOf[_owner] >= shares, "Owner has inadequate shares for this withdraw."
@@ -680,8 +1121,16 @@ def _withdraw(_asset_amount: uint256,_receiver: address,_owner: address) -> uint
     self.totalSupply -= shares
     log Transfer(_owner, empty(address), shares)
 
-    # Make sure we have enough assets to send to _receiver.
-    self._balanceAdapters( _asset_amount )
+    # Make sure we have enough assets to send to _receiver without dropping below our float.
+    float_bps : uint256 = self.packed_float_bps
+    float_low : uint256 = _asset_amount
+    float_target : uint256 = _asset_amount
+    if float_bps != 0:
+        remaining_assets : uint256 = _snapshot.total_balance - _asset_amount
+        float_low += self._float_balance(remaining_assets, self._float_watermark(float_bps, FLOAT_LOW))
+        float_target += self._float_balance(remaining_assets, self._float_watermark(float_bps, FLOAT_TARGET))
+    if _snapshot.local_asset_balance < float_low:
+        self._balanceAdapters( float_target, _snapshot )
 
     assert ERC20(asset).balanceOf(self) >= _asset_amount, "ERROR - 4626 DOESN'T HAVE ENOUGH BALANCE TO WITHDRAW!"
 
@@ -689,12 +1138,15 @@ def _withdraw(_asset_amount: uint256,_receiver: address,_owner: address) -> uint
     ERC20(asset).transfer(_receiver, _asset_amount)
 
     # Update all-time assets withdrawn for yield tracking.
-    self.total_assets_withdrawn += _asset_amount
+    deposited : uint256 = 0
+    withdrawn : uint256 = 0
+    deposited, withdrawn = self._unpack(self.packed_asset_flows)
+    self.packed_asset_flows = self._pack(deposited, withdrawn + _asset_amount)
 
     return shares
 
 @external
-def withdraw(_asset_amount: uint256,_receiver: address,_owner: address) -> uint256: return self._withdraw(_asset_amount,_receiver,_owner)
+def withdraw(_asset_amount: uint256,_receiver: address,_owner: address) -> uint256: return self._withdraw(_asset_amount,_receiver,_owner, self._checkpoint())
 
 ### ERC20 functionality.
 
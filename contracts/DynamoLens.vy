@@ -0,0 +1,373 @@
+# @version 0.3.7
+
+# Read only views of a Dynamo4626 vault for dashboards, keepers & off chain
+# planning. They live here rather than in the vault to keep it well under the
+# EIP-170 code size limit. Vyper can't share code between contracts so the
+# planner, _mul_div & _weight are copies of the vault's, keep them in step.
+
+MAX_POOLS : constant(uint256) = 16
+WEIGHT_BITS: constant(uint256) = 16
+MAX_WEIGHT: constant(uint256) = 2**16 - 1
+MAX_FLOAT_BPS : constant(uint256) = 10000
+
+struct VaultSnapshot:
+    local_asset_balance: uint256
+    adapter_balances: DynArray[uint256, MAX_POOLS]
+    adapter_max_withdraws: DynArray[uint256, MAX_POOLS]
+    adapter_max_deposits: DynArray[uint256, MAX_POOLS]
+    total_balance: uint256
+
+struct BalanceTX:
+    Qty: int256
+    Adapter: address
+
+struct AdapterState:
+    adapter: address
+    ratio: uint256
+    total_assets: uint256
+    max_withdraw: uint256
+    max_deposit: uint256
+
+struct VaultState:
+    total_assets: uint256
+    total_supply: uint256
+    local_asset_balance: uint256
+    share_value: uint256
+    total_strategy_weight: uint256
+    float_low_bps: uint256
+    float_target_bps: uint256
+    float_high_bps: uint256
+    claimable_yield_fees: uint256
+    claimable_strategy_fees: uint256
+    adapters: DynArray[AdapterState, MAX_POOLS]
+
+interface Dynamo4626:
+    def snapshot() -> VaultSnapshot: view
+    def lending_pools() -> DynArray[address, MAX_POOLS]: view
+    def packed_strategy_weights() -> uint256: view
+    def total_strategy_weight() -> uint256: view
+    def strategy_assets_moved() -> uint256: view
+    def packed_fee_shares() -> uint256: view
+    def float_bps() -> (uint256, uint256, uint256): view
+    def totalSupply() -> uint256: view
+    def decimals() -> uint8: view
+    def convertToAssets(_share_amount: uint256) -> uint256: view
+
+
+@internal
+@pure
+def _mul_div(_x: uint256, _y: uint256, _denominator: uint256, _roundup: bool) -> uint256:
+    # Full precision x * y / denominator, rounded up or down as ERC-4626 requires.
+    # https://xn--2-umb.com/21/muldiv/
+    assert _denominator != 0, "mul_div division by zero."
+
+    # 512 bit product [prod1 prod0] = x * y via the Chinese Remainder Theorem.
+    mm : uint256 = uint256_mulmod(_x, _y, max_value(uint256))
+    prod0 : uint256 = unsafe_mul(_x, _y)
+    prod1 : uint256 = 0
+    if mm < prod0:
+        prod1 = unsafe_sub(unsafe_sub(mm, prod0), 1)
+    else:
+        prod1 = unsafe_sub(mm, prod0)
+
+    remainder : uint256 = uint256_mulmod(_x, _y, _denominator)
+    round_up : uint256 = 0
+    if _roundup and remainder != 0:
+        round_up = 1
+
+    # Fits in 256 bits so plain division will do.
+    if prod1 == 0:
+        return unsafe_div(prod0, _denominator) + round_up
+
+    assert _denominator > prod1, "mul_div overflow."
+
+    # Make the division exact by subtracting the remainder.
+    if remainder > prod0:
+        prod1 = unsafe_sub(prod1, 1)
+    prod0 = unsafe_sub(prod0, remainder)
+
+    # Factor the largest power of two out of the denominator.
+    twos : uint256 = bitwise_and(unsafe_sub(0, _denominator), _denominator)
+    denominator : uint256 = unsafe_div(_denominator, twos)
+    prod0 = unsafe_div(prod0, twos)
+
+    # Shift in the bits from prod1, twos becomes 2**256 / twos.
+    twos = unsafe_add(unsafe_div(unsafe_sub(0, twos), twos), 1)
+    prod0 = bitwise_or(prod0, unsafe_mul(prod1, twos))
+
+    # Invert the now odd denominator mod 2**256 by Newton-Raphson, each step
+    # doubles the correct bits starting from 4.
+    inverse : uint256 = bitwise_xor(unsafe_mul(3, denominator), 2)
+    for i in range(6):
+        inverse = unsafe_mul(inverse, unsafe_sub(2, unsafe_mul(denominator, inverse)))
+
+    return unsafe_mul(prod0, inverse) + round_up
+
+
+
+@internal
+@pure
+def _weight(_weights: uint256, _pos: uint256) -> uint256:
+    return bitwise_and(shift(_weights, -convert(_pos * WEIGHT_BITS, int128)), MAX_WEIGHT)
+
+
+
+@internal
+@pure
+def _float_balance(_total_assets: uint256, _float_bps: uint256) -> uint256:
+    return _total_assets * _float_bps / MAX_FLOAT_BPS
+
+
+# Everything a dashboard or keeper polls in one call. share_value is
+# convertToAssets(10**decimals), claimable fees are those taken at the last
+# checkpoint and the adapter limits are what the vault itself can move right now.
+@external
+@view
+def vault_state(_vault: address) -> VaultState:
+    snapshot : VaultSnapshot = Dynamo4626(_vault).snapshot()
+
+    result : VaultState = empty(VaultState)
+    result.total_assets = snapshot.total_balance
+    result.total_supply = Dynamo4626(_vault).totalSupply()
+    result.local_asset_balance = snapshot.local_asset_balance
+    result.share_value = Dynamo4626(_vault).convertToAssets(10 ** convert(Dynamo4626(_vault).decimals(), uint256))
+    result.total_strategy_weight = Dynamo4626(_vault).total_strategy_weight()
+    low_bps : uint256 = 0
+    target_bps : uint256 = 0
+    high_bps : uint256 = 0
+    low_bps, target_bps, high_bps = Dynamo4626(_vault).float_bps()
+    result.float_low_bps = low_bps
+    result.float_target_bps = target_bps
+    result.float_high_bps = high_bps
+
+    # Yield fee shares in the low half, strategy fee shares in the high half.
+    fee_shares : uint256 = Dynamo4626(_vault).packed_fee_shares()
+    result.claimable_yield_fees = Dynamo4626(_vault).convertToAssets(bitwise_and(fee_shares, convert(max_value(uint128), uint256)))
+    result.claimable_strategy_fees = Dynamo4626(_vault).convertToAssets(shift(fee_shares, -128))
+
+    weights : uint256 = Dynamo4626(_vault).packed_strategy_weights()
+    pools : DynArray[address, MAX_POOLS] = Dynamo4626(_vault).lending_pools()
+    pos : uint256 = 0
+    for pool in pools:
+        result.adapters.append(AdapterState({adapter: pool,
+                                             ratio: self._weight(weights, pos),
+                                             total_assets: snapshot.adapter_balances[pos],
+                                             max_withdraw: snapshot.adapter_max_withdraws[pos],
+                                             max_deposit: snapshot.adapter_max_deposits[pos]}))
+        pos += 1
+
+    return result
+
+
+@external
+@view
+def strategy(_vault: address, _pool: address) -> uint256:
+    # Ratio of an adapter (not LP address), zero if the vault doesn't hold it.
+    pools : DynArray[address, MAX_POOLS] = Dynamo4626(_vault).lending_pools()
+    pos : uint256 = 0
+    for pool in pools:
+        if pool == _pool: return self._weight(Dynamo4626(_vault).packed_strategy_weights(), pos)
+        pos += 1
+    return 0
+
+
+@external
+@view
+def rebalance_progress(_vault: address) -> (uint256, uint256):
+    # Assets rebalance() has moved since the strategy was set & how far the
+    # adapters still are from their strategy allocation (ignoring adapter limits).
+    snapshot : VaultSnapshot = Dynamo4626(_vault).snapshot()
+    low_bps : uint256 = 0
+    target_bps : uint256 = 0
+    high_bps : uint256 = 0
+    low_bps, target_bps, high_bps = Dynamo4626(_vault).float_bps()
+    available : uint256 = snapshot.total_balance - self._float_balance(snapshot.total_balance, target_bps)
+    weights : uint256 = Dynamo4626(_vault).packed_strategy_weights()
+    total_weight : uint256 = Dynamo4626(_vault).total_strategy_weight()
+    assets_remaining : uint256 = 0
+    pos : uint256 = 0
+    for pool_balance in snapshot.adapter_balances:
+        # No weight at all means every adapter is emptied.
+        target : uint256 = self._mul_div(available, self._weight(weights, pos), max(total_weight, 1), False)
+        assets_remaining += max(target, pool_balance) - min(target, pool_balance)
+        pos += 1
+    return Dynamo4626(_vault).strategy_assets_moved(), assets_remaining
+
+
+# Plans the fewest, largest adapter moves that leave the vault holding at least
+# _target_asset_balance locally and the adapters as close to their strategy
+# ratios as _max_txs allows. Past what the target needs only moves of at least
+# _min_move are planned, none with a _min_move of 0. Withdrawals are always
+# ordered before deposits so they can fund them. An adapter with no strategy allocation is targeted at zero,
+# so if every adapter has a zero allocation the vault keeps all the assets.
+# Only actual moves are returned.
+@internal
+@view
+def _getBalanceTxs(_vault: address, _target_asset_balance: uint256, _max_txs: uint8, _snapshot: VaultSnapshot, _min_move: uint256) -> DynArray[BalanceTX, MAX_POOLS]:
+    result : DynArray[BalanceTX, MAX_POOLS] = empty(DynArray[BalanceTX, MAX_POOLS])
+
+    # If there are no pools then nothing to do.
+    pool_count : uint256 = len(_snapshot.adapter_balances)
+    if pool_count == 0: return result
+
+    total_shares : uint256 = Dynamo4626(_vault).total_strategy_weight()
+    weights : uint256 = Dynamo4626(_vault).packed_strategy_weights()
+    pools : DynArray[address, MAX_POOLS] = Dynamo4626(_vault).lending_pools()
+
+    available_balance : uint256 = 0
+    if _snapshot.total_balance > _target_asset_balance:
+        available_balance = _snapshot.total_balance - _target_asset_balance
+
+    # Determine how far each adapter is from its target balance, limited by
+    # what the adapter will actually accept or give back right now.
+    deltaBalances : int256[MAX_POOLS] = empty(int256[MAX_POOLS])
+    moveSizes : uint256[MAX_POOLS] = empty(uint256[MAX_POOLS])
+    order : uint256[MAX_POOLS] = empty(uint256[MAX_POOLS])
+    for pos in range(MAX_POOLS):
+        if pos == pool_count: break
+        order[pos] = pos
+        targetBalance : uint256 = 0
+        if total_shares > 0:
+            targetBalance = self._mul_div(available_balance, self._weight(weights, pos), total_shares, False)
+        currentBalance : uint256 = _snapshot.adapter_balances[pos]
+
+        if targetBalance > currentBalance:
+            moveSizes[pos] = min(targetBalance - currentBalance, _snapshot.adapter_max_deposits[pos])
+            deltaBalances[pos] = convert(moveSizes[pos], int256)
+        elif targetBalance < currentBalance:
+            moveSizes[pos] = min(currentBalance - targetBalance, _snapshot.adapter_max_withdraws[pos])
+            deltaBalances[pos] = -convert(moveSizes[pos], int256)
+
+    # Order the adapters by the size of their move, largest first & ties in pool
+    # order. Even strategies usually leave the moves in order already, otherwise
+    # heapsort so this stays O(n log n). The heap keeps the move that sorts last
+    # on top and each pop parks it at the end of the unsorted range.
+    in_order : bool = True
+    for pos in range(1, MAX_POOLS):
+        if pos == pool_count: break
+        if moveSizes[pos] > moveSizes[pos - 1]:
+            in_order = False
+            break
+
+    if not in_order:
+        heap_size : uint256 = pool_count
+        heap_start : uint256 = pool_count / 2
+        for step in range(MAX_POOLS * 2):
+            if heap_start > 0:
+                # Still building the heap, sift down the next parent.
+                heap_start -= 1
+            else:
+                heap_size -= 1
+                if heap_size == 0: break
+                top : uint256 = order[0]
+                order[0] = order[heap_size]
+                order[heap_size] = top
+
+            parent : uint256 = heap_start
+            for depth in range(MAX_POOLS):
+                child : uint256 = 2 * parent + 1
+                if child >= heap_size: break
+                # Pick the child that sorts last.
+                if child + 1 < heap_size:
+                    left : uint256 = order[child]
+                    right : uint256 = order[child + 1]
+                    if moveSizes[left] > moveSizes[right] or (moveSizes[left] == moveSizes[right] and left < right):
+                        child += 1
+                parent_pos : uint256 = order[parent]
+                child_pos : uint256 = order[child]
+                if moveSizes[child_pos] > moveSizes[parent_pos] or (moveSizes[child_pos] == moveSizes[parent_pos] and child_pos < parent_pos): break
+                order[parent] = child_pos
+                order[child] = parent_pos
+                parent = child
+
+    max_txs : uint256 = min(convert(_max_txs, uint256), pool_count)
+    tx_count : uint256 = 0
+    planned : int256[MAX_POOLS] = empty(int256[MAX_POOLS])
+    selected : bool[MAX_POOLS] = empty(bool[MAX_POOLS])
+
+    # How far off are we from our target asset balance?
+    deltaTarget : int256 = convert(_snapshot.local_asset_balance, int256) - convert(_target_asset_balance, int256)
+
+    # Whatever we hold above the target still has to be placed.
+    surplus : uint256 = 0
+    if deltaTarget > 0:
+        surplus = convert(deltaTarget, uint256)
+
+    # Cover any shortfall with the largest withdrawals first.
+    for i in range(MAX_POOLS):
+        if i == pool_count or tx_count == max_txs or deltaTarget >= 0: break
+        pos : uint256 = order[i]
+        delta : int256 = deltaBalances[pos]
+        if delta >= 0: continue
+        planned[pos] = delta
+        selected[pos] = True
+        tx_count += 1
+        deltaTarget -= delta
+
+    # Still short? Then we have to draw adapters down below their targets.
+    if deltaTarget < 0:
+        for i in range(MAX_POOLS):
+            if i == pool_count or deltaTarget >= 0: break
+            pos : uint256 = order[i]
+            if not selected[pos] and tx_count == max_txs: continue
+            drawable : int256 = convert(_snapshot.adapter_max_withdraws[pos], int256) + planned[pos]
+            if drawable <= 0: continue
+            extra : int256 = min(drawable, -deltaTarget)
+            if not selected[pos]:
+                selected[pos] = True
+                tx_count += 1
+            planned[pos] -= extra
+            deltaTarget += extra
+
+        assert deltaTarget >= 0, "CAN'T BALANCE SOON ENOUGH!"
+
+    # Spend any remaining txs on the largest outstanding moves. Once the target
+    # is met & the surplus placed, only on moves of at least _min_move.
+    for i in range(MAX_POOLS):
+        if i == pool_count or tx_count == max_txs: break
+        pos : uint256 = order[i]
+        delta : int256 = deltaBalances[pos]
+        if selected[pos] or delta == 0: continue
+        if (delta < 0 or surplus == 0) and (_min_move == 0 or moveSizes[pos] < _min_move): continue
+        # An unfunded deposit in the last tx would come to nothing, a withdrawal
+        # there keeps a rebalance done in small steps making progress.
+        if delta > 0 and deltaTarget == 0 and unsafe_add(tx_count, 1) == max_txs: continue
+        planned[pos] = delta
+        selected[pos] = True
+        tx_count += 1
+        if delta < 0:
+            deltaTarget -= delta
+        else:
+            surplus -= min(surplus, moveSizes[pos])
+
+    # Deposits can only be funded from what we hold above our target balance.
+    for i in range(MAX_POOLS):
+        if i == pool_count: break
+        pos : uint256 = order[i]
+        if planned[pos] <= 0: continue
+        planned[pos] = min(planned[pos], deltaTarget)
+        deltaTarget -= planned[pos]
+
+    # Withdrawals go first so they can fund the deposits.
+    for i in range(MAX_POOLS):
+        if i == pool_count: break
+        pos : uint256 = order[i]
+        if planned[pos] < 0:
+            result.append(BalanceTX({Qty: planned[pos], Adapter: pools[pos]}))
+    for i in range(MAX_POOLS):
+        if i == pool_count: break
+        pos : uint256 = order[i]
+        if planned[pos] > 0:
+            result.append(BalanceTX({Qty: planned[pos], Adapter: pools[pos]}))
+
+    return result
+
+
+
+# The vault's rebalance plan for its current balances, for off chain planning &
+# testing. The default _min_move of 1 plans like rebalance(), 0 like a deposit
+# or withdrawal.
+@external
+@view
+def getBalanceTxs(_vault: address, _target_asset_balance: uint256, _max_txs: uint8, _min_move: uint256 = 1) -> DynArray[BalanceTX, MAX_POOLS]:
+    return self._getBalanceTxs(_vault, _target_asset_balance, _max_txs, Dynamo4626(_vault).snapshot(), _min_move)
@@ -8,8 +8,10 @@ event StrategyVote:
     GuardAddress: indexed(address)
     Endorse: bool
 
+# Refers to the proposal by Nonce, see StrategyProposal for its weights.
 event StrategyActivation:
-    strategy: Strategy
+    Nonce: indexed(uint256)
+    ProposerAddress: indexed(address)
 
 event NewGuard:
     GuardAddress: indexed(address)
@@ -36,6 +38,11 @@ struct ProposedStrategy:
     APYNow: uint256
     APYPredicted: uint256
 
+# What the vault is handed on activation, weights paired with its lending pools.
+struct AdapterStrategy:
+    adapter: address
+    ratio: uint256
+
 struct Strategy:
     Nonce: uint256
     ProposerAddress: address
@@ -44,31 +51,69 @@ struct Strategy:
     APYPredicted: uint256
     TSubmitted: uint256
     TActivated: uint256
+    TExpires: uint256
     Withdrawn: bool
     no_guards: uint256
-    VotesEndorse: DynArray[address, MAX_GUARDS]
-    VotesReject: DynArray[address, MAX_GUARDS]
+    VotesEndorse: uint256
+    VotesReject: uint256
 
+# Slim strategy event, the weights are only logged as the keccak256 of their
+# ABI encoding. The full weights are in the submitStrategy calldata.
 event StrategyProposal:
-    strategy: Strategy
+    Nonce: indexed(uint256)
+    ProposerAddress: indexed(address)
+    WeightsHash: bytes32
+    APYNow: uint256
+    APYPredicted: uint256
     
 # Contract assigned storage 
 contractOwner: public(address)
-MAX_GUARDS: constant(uint256) = 2
-MAX_POOLS: constant(uint256) = 10
+MAX_GUARDS: constant(uint256) = 32
+MAX_POOLS: constant(uint256) = 16
+# The vault packs each strategy ratio into 16 bits.
+MAX_WEIGHT: constant(uint256) = 2**16 - 1
 LGov: public(DynArray[address, MAX_GUARDS])
+# Position of each guard in LGov plus one, zero if not a guard. A strategy's
+# VotesEndorse/VotesReject are bitmaps where bit n is the vote of LGov[n].
+GuardIndex: public(HashMap[address, uint256])
 TDelay: public(uint256)
 no_guards: public(uint256)
-CurrentStrategy: public(Strategy)
-PendingStrategy: public(Strategy)
+# Strategies by nonce, the current one is just a pointer into it.
+Strategies: public(HashMap[uint256, Strategy])
+CurrentNonce: public(uint256)
+# Nonces of the proposals still up for a vote, in no particular order, and the
+# position of each plus one, zero once it has left the queue.
+MAX_PENDING: constant(uint256) = 8
+PendingNonces: DynArray[uint256, MAX_PENDING]
+QueueIndex: HashMap[uint256, uint256]
+# Each strategy's weights as the vault takes them, checked & built once at submission.
+StrategyPlans: HashMap[uint256, DynArray[AdapterStrategy, MAX_POOLS]]
 VotesGC: public(HashMap[address, address])
+# Least the prior proposer is paid when a new strategy is activated.
+MinProposerPayout: public(uint96)
 MIN_GUARDS: constant(uint256) = 1
 NextNonce: uint256
 
+# Masks for counting bits in a vote bitmap: 0x55.., 0x33.., 0x0f.. & 0x01.. repeated.
+POP_M1: constant(uint256) = max_value(uint256) / 3
+POP_M2: constant(uint256) = max_value(uint256) / 5
+POP_M4: constant(uint256) = max_value(uint256) / 17
+POP_H01: constant(uint256) = max_value(uint256) / 255
+
+# StrategyStatus() values.
+STATUS_UNKNOWN: constant(uint256) = 0
+STATUS_PENDING: constant(uint256) = 1
+STATUS_ACTIVE: constant(uint256) = 2
+STATUS_REPLACED: constant(uint256) = 3
+STATUS_WITHDRAWN: constant(uint256) = 4
+STATUS_REJECTED: constant(uint256) = 5
+STATUS_EXPIRED: constant(uint256) = 6
+
 Vault: public(address)
 
 interface Vault:
-    def PoolRebalancer(currentStrategy: Strategy) -> bool: nonpayable
+    def lending_pools() -> DynArray[address, MAX_POOLS]: view
+    def set_strategy(_proposer: address, _strategies: DynArray[AdapterStrategy, MAX_POOLS], _min_proposer_payout: uint96) -> bool: nonpayable
     def replaceGovernanceContract(NewGovernance: address) -> bool: nonpayable
 
 
@@ -82,22 +127,123 @@ def __init__(contractOwner: address, _vault: address, _tdelay: uint256):
         self.TDelay = 21600
 
 
+@external
+@view
+def CurrentStrategy() -> Strategy:
+    return self.Strategies[self.CurrentNonce]
+
+
+@external
+@view
+def PendingStrategies() -> DynArray[uint256, MAX_PENDING]:
+    return self.PendingNonces
+
+
+@internal
+@view
+def _rejected(Nonce: uint256) -> bool:
+    # Short circuited by half the guards there were at submission voting it down.
+    rejections: uint256 = self._popcount(self.Strategies[Nonce].VotesReject)
+    return rejections > 0 and rejections >= self.Strategies[Nonce].no_guards/2
+
+
+@external
+@view
+def StrategyStatus(Nonce: uint256) -> uint256:
+    if Nonce == 0 or Nonce >= self.NextNonce: return STATUS_UNKNOWN
+    if Nonce == self.CurrentNonce: return STATUS_ACTIVE
+    if self.Strategies[Nonce].TActivated != 0: return STATUS_REPLACED
+    if self.Strategies[Nonce].Withdrawn: return STATUS_WITHDRAWN
+    if self.QueueIndex[Nonce] != 0:
+        if block.timestamp > self.Strategies[Nonce].TExpires: return STATUS_EXPIRED
+        return STATUS_PENDING
+
+    # Left the queue without being activated or withdrawn.
+    if self._rejected(Nonce): return STATUS_REJECTED
+    return STATUS_EXPIRED
+
+
+@internal
+@view
+def _is_pending(Nonce: uint256) -> bool:
+    return self.QueueIndex[Nonce] != 0 and block.timestamp <= self.Strategies[Nonce].TExpires
+
+
+@internal
+def _dequeue(Nonce: uint256):
+    # Last one in the queue takes the place of the one leaving.
+    position: uint256 = self.QueueIndex[Nonce]
+    last: uint256 = self.PendingNonces[len(self.PendingNonces) - 1]
+    self.PendingNonces[position - 1] = last
+    self.QueueIndex[last] = position
+    self.PendingNonces.pop()
+    self.QueueIndex[Nonce] = 0
+
+
+@internal
+@pure
+def _popcount(_bitmap: uint256) -> uint256:
+    # Number of guards who voted, counted in parallel across the bitmap.
+    x: uint256 = _bitmap - bitwise_and(shift(_bitmap, -1), POP_M1)
+    x = bitwise_and(x, POP_M2) + bitwise_and(shift(x, -2), POP_M2)
+    x = bitwise_and(x + shift(x, -4), POP_M4)
+    return shift(unsafe_mul(x, POP_H01), -248)
+
+
+@internal
+@pure
+def _move_vote(_bitmap: uint256, _from: uint256, _to: uint256) -> uint256:
+    # Whoever held position _to loses their vote, which becomes the one of the
+    # guard moving in from _from. With _from == _to the vote is just dropped.
+    from_bit: uint256 = shift(1, convert(_from, int256))
+    to_bit: uint256 = shift(1, convert(_to, int256))
+    result: uint256 = bitwise_and(_bitmap, bitwise_not(to_bit))
+    if bitwise_and(result, from_bit) != 0:
+        result = bitwise_or(bitwise_and(result, bitwise_not(from_bit)), to_bit)
+    return result
+
+
+@internal
+def _move_pending_votes(_from: uint256, _to: uint256):
+    for pending in self.PendingNonces:
+        self.Strategies[pending].VotesEndorse = self._move_vote(self.Strategies[pending].VotesEndorse, _from, _to)
+        self.Strategies[pending].VotesReject = self._move_vote(self.Strategies[pending].VotesReject, _from, _to)
+
+
+@internal
+def _vote(Nonce: uint256, _endorse: bool):
+    guard: uint256 = self.GuardIndex[msg.sender]
+    assert guard != 0, "Sender is not eligible to vote"
+    bit: uint256 = shift(1, convert(guard - 1, int256))
+
+    #Check to see that sender has not already voted
+    endorsements: uint256 = self.Strategies[Nonce].VotesEndorse
+    rejections: uint256 = self.Strategies[Nonce].VotesReject
+    assert bitwise_and(bitwise_or(endorsements, rejections), bit) == 0, "Guard already voted"
+
+    if _endorse:
+        self.Strategies[Nonce].VotesEndorse = bitwise_or(endorsements, bit)
+    else:
+        self.Strategies[Nonce].VotesReject = bitwise_or(rejections, bit)
+
+        # Voted down, make room for another proposal.
+        if self._rejected(Nonce): self._dequeue(Nonce)
+
+
 @external
 def submitStrategy(strategy: ProposedStrategy) -> uint256:
     # No Strategy proposals if no governance guards
     assert len(self.LGov) > 0, "Cannot Submit Strategy without Guards"
 
-    # Confirm there's no currently pending strategy so we can replace the old one.
-
-            # First is it the same as the current one?
-            # Otherwise has it been withdrawn? 
-            # Otherwise, has it been short circuited down voted? 
-            # Has the period of protection from being replaced expired already?         
-    assert  (self.CurrentStrategy.Nonce == self.PendingStrategy.Nonce) or \
-            (self.PendingStrategy.Withdrawn == True) or \
-            len(self.PendingStrategy.VotesReject) > 0 and \
-            (len(self.PendingStrategy.VotesReject) >= self.PendingStrategy.no_guards/2) or \
-            (convert(block.timestamp, decimal) > (convert(self.PendingStrategy.TSubmitted, decimal)+(convert(self.TDelay, decimal) * 1.25)))
+    # Confirm there's room in the queue, if not an expired proposal gives up its place.
+    if len(self.PendingNonces) == MAX_PENDING:
+        expired: uint256 = 0
+        for pending in self.PendingNonces:
+            if block.timestamp > self.Strategies[pending].TExpires:
+                expired = pending
+                break
+        assert expired != 0, "Too many pending strategies"
+        self._dequeue(expired)
 
     # Confirm msg.sender Eligibility
     # Confirm msg.sender is not blacklisted
@@ -105,119 +251,131 @@ def submitStrategy(strategy: ProposedStrategy) -> uint256:
     # Confirm strategy meets financial goal improvements.
     assert strategy.APYPredicted - strategy.APYNow > 0, "Cannot Submit Strategy without APY Increase"
 
-    self.PendingStrategy.Nonce = self.NextNonce
+    # Weights go by position in the vault's lending pools, pair them up now so
+    # activation hands the vault a ready made strategy.
+    pools: DynArray[address, MAX_POOLS] = Vault(self.Vault).lending_pools()
+    assert len(strategy.Weights) == len(pools), "Weights must match the vault's lending pools"
+    plan: DynArray[AdapterStrategy, MAX_POOLS] = []
+    total_weight: uint256 = 0
+    for pos in range(MAX_POOLS):
+        if pos == len(pools): break
+        # Caught here rather than failing the vault's set_strategy at activation.
+        assert strategy.Weights[pos] <= MAX_WEIGHT, "Strategy weights must fit in 16 bits"
+        plan.append(AdapterStrategy({adapter: pools[pos], ratio: strategy.Weights[pos]}))
+        total_weight += strategy.Weights[pos]
+    assert total_weight > 0, "Cannot Submit Strategy without Weights"
+
+    # Fresh slot, so no votes & not withdrawn or activated.
+    pending: uint256 = self.NextNonce
     self.NextNonce += 1
-    self.PendingStrategy.ProposerAddress = msg.sender
-    self.PendingStrategy.Weights = strategy.Weights
-    self.PendingStrategy.APYNow = strategy.APYNow
-    self.PendingStrategy.APYPredicted = strategy.APYPredicted
-    self.PendingStrategy.TSubmitted = block.timestamp
-    self.PendingStrategy.TActivated = 0    
-    self.PendingStrategy.Withdrawn = False
-    self.PendingStrategy.no_guards = len(self.LGov)
-    self.PendingStrategy.VotesEndorse = empty(DynArray[address, MAX_GUARDS])
-    self.PendingStrategy.VotesReject = empty(DynArray[address, MAX_GUARDS])
-
-    log StrategyProposal(self.PendingStrategy)
-    return self.PendingStrategy.Nonce
+    self.Strategies[pending].Nonce = pending
+    self.Strategies[pending].ProposerAddress = msg.sender
+    self.Strategies[pending].Weights = strategy.Weights
+    self.Strategies[pending].APYNow = strategy.APYNow
+    self.Strategies[pending].APYPredicted = strategy.APYPredicted
+    self.Strategies[pending].TSubmitted = block.timestamp
+    # Decision period then a quarter of it again to get activated.
+    self.Strategies[pending].TExpires = block.timestamp + self.TDelay * 5 / 4
+    self.Strategies[pending].no_guards = len(self.LGov)
+    self.StrategyPlans[pending] = plan
+    self.PendingNonces.append(pending)
+    self.QueueIndex[pending] = len(self.PendingNonces)
+
+    log StrategyProposal(pending, msg.sender, keccak256(_abi_encode(strategy.Weights)), strategy.APYNow, strategy.APYPredicted)
+    return pending
 
 
 @external
 def withdrawStrategy(Nonce: uint256):
-    #Check to see that the pending strategy is not the current strategy
-    assert (self.CurrentStrategy.Nonce != self.PendingStrategy.Nonce), "Cannot withdraw Current Strategy"
-
-    #Check to see that the pending strategy's nonce matches the nonce we want to withdraw
-    assert self.PendingStrategy.Nonce == Nonce, "Cannot Withdraw Strategy if its not Pending Strategy"
+    #Check to see that the strategy we want to withdraw is still in the queue
+    assert self.QueueIndex[Nonce] != 0, "Cannot Withdraw Strategy if its not Pending Strategy"
 
     #Check to see that sender is eligible to withdraw
-    assert self.PendingStrategy.ProposerAddress == msg.sender
+    assert self.Strategies[Nonce].ProposerAddress == msg.sender
 
     #Withdraw Pending Strategy
-    self.PendingStrategy.Withdrawn = True
+    self.Strategies[Nonce].Withdrawn = True
+    self._dequeue(Nonce)
 
     log StrategyWithdrawal(Nonce)
 
 
 @external
 def endorseStrategy(Nonce: uint256):
-    #Check to see that the pending strategy is not the current strategy
-    assert self.CurrentStrategy.Nonce != self.PendingStrategy.Nonce, "Cannot Endorse Strategy thats already  Strategy"
-
-    #Check to see that the pending strategy's nonce matches the nonce we want to endorse
-    assert self.PendingStrategy.Nonce == Nonce, "Cannot Endorse Strategy if its not Pending Strategy"
-
-    #Check to see that sender is eligible to vote
-    assert msg.sender in self.LGov, "Sender is not eligible to vote"
-
-    #Check to see that sender has not already voted
-    assert msg.sender not in self.PendingStrategy.VotesReject
-    assert msg.sender not in self.PendingStrategy.VotesEndorse
+    #Check to see that the strategy we want to endorse is pending & not expired
+    assert self._is_pending(Nonce), "Cannot Endorse Strategy if its not Pending Strategy"
 
     #Vote to endorse strategy
-    self.PendingStrategy.VotesEndorse.append(msg.sender)
+    self._vote(Nonce, True)
 
     log StrategyVote(Nonce, msg.sender, False)
 
 
 @external
 def rejectStrategy(Nonce: uint256):
-    #Check to see that the pending strategy is not the current strategy
-    assert self.CurrentStrategy.Nonce != self.PendingStrategy.Nonce, "Cannot Reject Strategy thats already Current Strategy"
-
-    #Check to see that the pending strategy's nonce matches the nonce we want to reject
-    assert self.PendingStrategy.Nonce == Nonce, "Cannot Reject Strategy if its not Pending Strategy"
-
-    #Check to see that sender is eligible to vote
-    assert msg.sender in self.LGov
-
-    #Check to see that sender has not already voted
-    assert msg.sender not in self.PendingStrategy.VotesReject
-    assert msg.sender not in self.PendingStrategy.VotesEndorse
+    #Check to see that the strategy we want to reject is pending & not expired
+    assert self._is_pending(Nonce), "Cannot Reject Strategy if its not Pending Strategy"
 
     #Vote to reject strategy
-    self.PendingStrategy.VotesReject.append(msg.sender)
+    self._vote(Nonce, False)
 
     log StrategyVote(Nonce, msg.sender, True)
 
 
 @external
 def activateStrategy(Nonce: uint256):
-    #Confirm there is a currently pending strategy
-    assert (self.CurrentStrategy.Nonce != self.PendingStrategy.Nonce)
-    assert (self.PendingStrategy.Withdrawn == False)
+    #Confirm the Strategy we want to activate is pending & not expired,
+    #withdrawn or rejected ones have left the queue.
+    assert self._is_pending(Nonce)
 
     #Confirm strategy is approved by guards
-    assert (len(self.PendingStrategy.VotesEndorse) >= len(self.LGov)/2) or \
-           ((self.PendingStrategy.TSubmitted + self.TDelay) < block.timestamp)
-    assert len(self.PendingStrategy.VotesReject) < len(self.PendingStrategy.VotesEndorse)
-
-    #Confirm Pending Strategy is the Strategy we want to activate
-    assert self.PendingStrategy.Nonce == Nonce
+    endorsements: uint256 = self._popcount(self.Strategies[Nonce].VotesEndorse)
+    assert (endorsements >= len(self.LGov)/2) or \
+           ((self.Strategies[Nonce].TSubmitted + self.TDelay) < block.timestamp)
+    assert self._popcount(self.Strategies[Nonce].VotesReject) < endorsements
+
+    # The vault's pools may have changed since submission, the weights only make
+    # sense against the pools they were matched up with.
+    pools: DynArray[address, MAX_POOLS] = Vault(self.Vault).lending_pools()
+    assert len(pools) == len(self.StrategyPlans[Nonce]), "Vault's lending pools changed since submission"
+    for pos in range(MAX_POOLS):
+        if pos == len(pools): break
+        assert self.StrategyPlans[Nonce][pos].adapter == pools[pos], "Vault's lending pools changed since submission"
 
     #Make Current Strategy and Activate Strategy
-    self.CurrentStrategy = self.PendingStrategy
-    # Vault(self.Vault).PoolRebalancer(self.CurrentStrategy)
+    self.Strategies[Nonce].TActivated = block.timestamp
+    self.CurrentNonce = Nonce
+    self._dequeue(Nonce)
+
+    # Prior proposer is paid out whatever they have earned.
+    Vault(self.Vault).set_strategy(self.Strategies[Nonce].ProposerAddress, self.StrategyPlans[Nonce], self.MinProposerPayout)
 
-    log StrategyActivation(self.CurrentStrategy)
+    log StrategyActivation(Nonce, self.Strategies[Nonce].ProposerAddress)
  
 
+@external
+def setMinProposerPayout(_min_proposer_payout: uint96):
+    assert msg.sender == self.contractOwner, "Cannot set payout unless you are contract owner"
+    self.MinProposerPayout = _min_proposer_payout
+
+
 @external
 def addGuard(GuardAddress: address):
     #Check to see that sender is the contract owner
     assert msg.sender == self.contractOwner, "Cannot add guard unless you are contract owner"
 
     #Check to see if there is the max amount of Guards
-    assert len(self.LGov) <= MAX_GUARDS, "Cannot add anymore guards"
+    assert len(self.LGov) < MAX_GUARDS, "Cannot add anymore guards"
 
     #Check to see that the Guard being added is a valid address
     assert GuardAddress != ZERO_ADDRESS, "Cannot add ZERO_ADDRESS"
 
     #Check to see that GuardAddress is not already in self.LGov
-    assert GuardAddress not in self.LGov, "Guard already exists"
+    assert self.GuardIndex[GuardAddress] == 0, "Guard already exists"
 
     #Add new guard address as the last in the list of guards
     self.LGov.append(GuardAddress)
+    self.GuardIndex[GuardAddress] = len(self.LGov)
 
     log NewGuard(GuardAddress)
 
@@ -234,20 +392,20 @@ def removeGuard(GuardAddress: address):
     # Correct size to zero offset position.
     last_index -= 1
     
-    #Run through list of guards to find the index of the one we want to remove
-    current_index: uint256 = 0
-    for guard_addr in self.LGov:
-        if guard_addr == GuardAddress: break
-        current_index += 1
-
     #Make sure that GuardAddress is a guard on the list of guards
-    assert GuardAddress == self.LGov[current_index], "GuardAddress not a current Guard."    
+    current_index: uint256 = self.GuardIndex[GuardAddress]
+    assert current_index != 0, "GuardAddress not a current Guard."    
+    current_index -= 1
 
-    # Replace Current Guard with last
-    self.LGov[current_index] = self.LGov[last_index]
+    # Replace Current Guard with last, its vote on the pending strategy moves along.
+    last_guard: address = self.LGov[last_index]
+    self.LGov[current_index] = last_guard
+    self.GuardIndex[last_guard] = current_index + 1
+    self._move_pending_votes(last_index, current_index)
 
     # Eliminate the redundant one at the end.
     self.LGov.pop()
+    self.GuardIndex[GuardAddress] = 0
 
     log GuardRemoved(GuardAddress)
 
@@ -261,19 +419,17 @@ def swapGuard(OldGuardAddress: address, NewGuardAddress: address):
     assert NewGuardAddress != ZERO_ADDRESS, "Cannot add ZERO_ADDRESS"
 
     #Check that the guard we are swapping in is not on the list of guards already
-    assert NewGuardAddress not in self.LGov, "New Guard is already a Guard."
-
-    #Run through list of guards to find the index of the one we want to swap out
-    current_index: uint256 = 0 
-    for guard_addr in self.LGov:
-        if guard_addr == OldGuardAddress: break
-        current_index += 1
+    assert self.GuardIndex[NewGuardAddress] == 0, "New Guard is already a Guard."
 
     #Make sure that OldGuardAddress is a guard on the list of guards
-    assert OldGuardAddress == self.LGov[current_index], "OldGuardAddress not a current Guard."
+    current_index: uint256 = self.GuardIndex[OldGuardAddress]
+    assert current_index != 0, "OldGuardAddress not a current Guard."
 
-    #Replace OldGuardAddress with NewGuardAddress
-    self.LGov[current_index] = NewGuardAddress
+    #Replace OldGuardAddress with NewGuardAddress, who hasn't voted yet.
+    self.LGov[current_index - 1] = NewGuardAddress
+    self.GuardIndex[NewGuardAddress] = current_index
+    self.GuardIndex[OldGuardAddress] = 0
+    self._move_pending_votes(current_index - 1, current_index - 1)
 
     log GuardSwap(OldGuardAddress, NewGuardAddress)
 
@@ -287,7 +443,7 @@ def replaceGovernance(NewGovernance: address):
     assert len(self.LGov) >= MIN_GUARDS
 
     #Check if sender is a guard
-    assert msg.sender in self.LGov
+    assert self.GuardIndex[msg.sender] != 0
 
     #Check if new contract address is not the current)
     assert NewGovernance != self
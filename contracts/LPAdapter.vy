@@ -22,8 +22,22 @@ def maxDeposit() -> uint256:
 def totalAssets() -> uint256:
     return 0
 
+# totalAssets, maxWithdraw & maxDeposit from a single set of upstream reads.
+@external
+@view
+def state() -> (uint256, uint256, uint256):
+    return 0, 0, 0
+
 
 # Deposit the asset into underlying LP. The tokens must be present inside the 4626 vault.
+#
+# Adapters approve their LP lazily: deposit() tops the vault's allowance back up
+# to max_value(uint256) only once it runs short, rather than approving on every
+# deposit or once when the vault adds the pool. Pools already added keep working
+# & so do tokens that spend down even a max allowance. Approvals go through
+# raw_call so tokens that don't return a bool (USDT) work, & through 0 first for
+# tokens that refuse to change a non-zero allowance. Vyper can't share code
+# between contracts so each adapter carries its own ensure_allowance/safe_approve.
 @external
 def deposit(asset_amount: uint256):
     pass
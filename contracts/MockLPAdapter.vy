@@ -74,8 +74,15 @@ def convertToAssets(_share_amount: uint256) -> uint256: return self._convertToAs
 #How much asset can be withdrawn in a single call
 @external
 @view
-def maxWithdraw() -> uint256: 
-    return self._convertToAssets(ERC20(awrappedAsset).balanceOf(msg.sender))
+def maxWithdraw() -> uint256:
+    return self._maxWithdraw(ERC20(aoriginalAsset).balanceOf(adapterLPAddr))
+
+
+@internal
+@view
+def _maxWithdraw(_asset_balance: uint256) -> uint256:
+    # withdraw() burns wrapped assets 1:1 so we're limited by both balances.
+    return min(ERC20(awrappedAsset).balanceOf(msg.sender), _asset_balance)
 
 
 #How much asset can be deposited in a single call
@@ -91,6 +98,13 @@ def totalAssets() -> uint256:
     return ERC20(aoriginalAsset).balanceOf(adapterLPAddr)
 
 
+@external
+@view
+def state() -> (uint256, uint256, uint256):
+    asset_balance : uint256 = ERC20(aoriginalAsset).balanceOf(adapterLPAddr)
+    return asset_balance, self._maxWithdraw(asset_balance), max_value(uint256)
+
+
 # Deposit the asset into underlying LP. The tokens must be present inside the 4626 vault.
 @external
 @nonpayable
@@ -1,36 +1,41 @@
 # @version 0.3.7
 
-event PoolRebalance:
-    newStrategy: Strategy
+struct AdapterStrategy:
+    adapter: address
+    ratio: uint256
+
+event StrategySet:
+    Proposer: address
+    Strategies: DynArray[AdapterStrategy, MAX_POOLS]
+    MinProposerPayout: uint96
 
 event NewGovernanceContract:
     NewGovernance: address
 
-struct Strategy:
-    Nonce: uint256
-    ProposerAddress: address
-    Weights: DynArray[uint256, MAX_POOLS]
-    APYNow: uint256
-    APYPredicted: uint256
-    TSubmitted: uint256
-    TActivated: uint256
-    Withdrawn: bool
-    no_guards: uint256
-    VotesEndorse: DynArray[address, MAX_GUARDS]
-    VotesReject: DynArray[address, MAX_GUARDS]
-
-MAX_GUARDS: constant(uint256) = 2
-MAX_POOLS: constant(uint256) = 10
+MAX_POOLS: constant(uint256) = 16
 GovernanceAddress: public(address)
 contractOwner: public(address)
+pools: DynArray[address, MAX_POOLS]
 
 @external
-def __init__(contractOwner: address):
+def __init__(contractOwner: address, _pools: DynArray[address, MAX_POOLS]):
     self.contractOwner = contractOwner
+    self.pools = _pools
+
+@external
+@view
+def lending_pools() -> DynArray[address, MAX_POOLS]:
+    return self.pools
+
+@external
+def add_pool(_pool: address) -> bool:
+    self.pools.append(_pool)
+    return True
 
 @external
-def PoolRebalancer(newStrategy: Strategy):
-    log PoolRebalance(newStrategy)
+def set_strategy(_proposer: address, _strategies: DynArray[AdapterStrategy, MAX_POOLS], _min_proposer_payout: uint96) -> bool:
+    log StrategySet(_proposer, _strategies, _min_proposer_payout)
+    return True
 
 @external
 def replaceGovernanceContract(NewGovernance: address):
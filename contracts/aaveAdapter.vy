@@ -27,13 +27,35 @@ SUPPLY_CAP_START_BIT_POSITION: constant(int128) = -116
 RESERVE_DECIMALS_START_BIT_POSITION: constant(int128) = -48 #constant RESERVE_DECIMALS_START_BIT_POSITION = 48
 
 
+RAY: constant(uint256) = 10**27
+HALF_RAY: constant(uint256) = 5 * 10**26
+SECONDS_PER_YEAR: constant(uint256) = 365 * 24 * 3600
+
+
 struct ReserveConfigurationMap:
     data: uint256
 
+struct ReserveData:
+    configuration: ReserveConfigurationMap
+    liquidityIndex: uint128
+    currentLiquidityRate: uint128
+    variableBorrowIndex: uint128
+    currentVariableBorrowRate: uint128
+    currentStableBorrowRate: uint128
+    lastUpdateTimestamp: uint40
+    id: uint16
+    aTokenAddress: address
+    stableDebtTokenAddress: address
+    variableDebtTokenAddress: address
+    interestRateStrategyAddress: address
+    accruedToTreasury: uint128
+    unbacked: uint128
+    isolationModeTotalDebt: uint128
+
 interface AAVEV3:
     def deposit(asset: address, amount: uint256, onBehalfOf: address, referralCode: uint16): nonpayable
     def withdraw(asset: address, amount: uint256, to: address) -> uint256: nonpayable
-    def getConfiguration(asset: address) -> ReserveConfigurationMap: view
+    def getReserveData(asset: address) -> ReserveData: view
 
 interface Atoken:
     def scaledTotalSupply() -> uint256: view
@@ -116,30 +138,64 @@ def max_supply(config: uint256) -> uint256:
         return MAX_UINT256
     return shift(supply_flag, SUPPLY_CAP_START_BIT_POSITION) * (10**self.get_decimals(config))
 
+@internal
+@pure
+def ray_mul(a: uint256, b: uint256) -> uint256:
+    return (a * b + HALF_RAY) / RAY
+
+#Liquidity index as of this block, the same linear interest Aave's getNormalizedIncome accrues.
+@internal
+@view
+def normalized_income(reserve: ReserveData) -> uint256:
+    index: uint256 = convert(reserve.liquidityIndex, uint256)
+    last_update: uint256 = convert(reserve.lastUpdateTimestamp, uint256)
+    if last_update == block.timestamp:
+        return index
+    interest: uint256 = RAY + convert(reserve.currentLiquidityRate, uint256) * (block.timestamp - last_update) / SECONDS_PER_YEAR
+    return self.ray_mul(interest, index)
+
+@internal
+@view
+def reserve_data() -> ReserveData:
+    return AAVEV3(lendingPool).getReserveData(originalAsset)
+
 #How much asset can be withdrawn in a single transaction
 @external
 @view
 def maxWithdraw() -> uint256:
-    config: uint256 = AAVEV3(lendingPool).getConfiguration(originalAsset).data
-    if not self.withdraw_allowed(config):
+    return self._maxWithdraw(self.reserve_data(), self._assetBalance())
+
+@internal
+@view
+def _maxWithdraw(reserve: ReserveData, asset_balance: uint256) -> uint256:
+    if not self.withdraw_allowed(reserve.configuration.data):
         return 0
     #How much original asset is currently available in the a-token contract
     cash: uint256 = ERC20(originalAsset).balanceOf(wrappedAsset) #asset
-    return min(cash, self._assetBalance())
+    return min(cash, asset_balance)
 
 #How much asset can be deposited in a single transaction
 @external
 @view
 def maxDeposit() -> uint256:
-    config: uint256 = AAVEV3(lendingPool).getConfiguration(originalAsset).data
+    return self._maxDeposit(self.reserve_data())
+
+@internal
+@view
+def _maxDeposit(reserve: ReserveData) -> uint256:
+    config: uint256 = reserve.configuration.data
     if not self.deposit_allowed(config):
         return 0
-    #TODO: this is still incorrect
+    cap: uint256 = self.max_supply(config)
+    if cap == MAX_UINT256:
+        return MAX_UINT256
+    #Same check as Aave's supply validation, the treasury's accrued share counts against the cap too.
     #https://github.com/aave/aave-v3-core/blob/94e571f3a7465201881a59555314cd550ccfda57/contracts/protocol/libraries/logic/ValidationLogic.sol#L72-L76
-    #We are also supposed to substract whats been provided to treasury or something
-    #loads of internal structures/data used for computation, falling back to totalSupply for approximation
-    supply: uint256 = ERC20(wrappedAsset).totalSupply()
-    return self.max_supply(config) - supply
+    scaled_supply: uint256 = Atoken(wrappedAsset).scaledTotalSupply() + convert(reserve.accruedToTreasury, uint256)
+    supply: uint256 = self.ray_mul(scaled_supply, self.normalized_income(reserve))
+    if supply >= cap:
+        return 0
+    return cap - supply
 
 
 #How much asset this LP is responsible for.
@@ -148,6 +204,14 @@ def maxDeposit() -> uint256:
 def totalAssets() -> uint256:
     return self._assetBalance()
 
+#totalAssets, maxWithdraw & maxDeposit reading the reserve data only once.
+@external
+@view
+def state() -> (uint256, uint256, uint256):
+    reserve: ReserveData = self.reserve_data()
+    asset_balance: uint256 = self._assetBalance()
+    return asset_balance, self._maxWithdraw(reserve, asset_balance), self._maxDeposit(reserve)
+
 @internal
 @view
 def _assetBalance() -> uint256:
@@ -155,13 +219,28 @@ def _assetBalance() -> uint256:
     unWrappedBalance: uint256 = self.atokentoaset(wrappedBalance) #asset
     return unWrappedBalance
 
+#Lazy max allowance to the lending pool, see deposit() in LPAdapter.vy.
+@internal
+def ensure_allowance(spender: address, asset_amount: uint256):
+    allowance: uint256 = ERC20(originalAsset).allowance(self, spender)
+    if allowance >= asset_amount:
+        return
+    if allowance != 0:
+        self.safe_approve(spender, 0)
+    self.safe_approve(spender, max_value(uint256))
+
+@internal
+def safe_approve(spender: address, amount: uint256):
+    response: Bytes[32] = raw_call(originalAsset, _abi_encode(spender, amount, method_id=method_id("approve(address,uint256)")), max_outsize=32)
+    if len(response) > 0:
+        assert convert(response, bool), "approve failed"
+
 #Deposit the asset into underlying LP
 @external
 @nonpayable
 def deposit(asset_amount: uint256):
-    #TODO: NEED SAFE ERC20
     #Approve lending pool
-    ERC20(originalAsset).approve(lendingPool, asset_amount)
+    self.ensure_allowance(lendingPool, asset_amount)
     #Call deposit function
     #"deposit_from" does not make sense. this is the beneficiary of a-tokens which must always be our vault.
     AAVEV3(lendingPool).deposit(originalAsset, asset_amount, self, 0)
@@ -71,10 +71,15 @@ def ctokentoaset(wrapped: uint256) -> uint256:
 @external
 @view
 def maxWithdraw() -> uint256:
+    return self._maxWithdraw(self._assetBalance())
+
+@internal
+@view
+def _maxWithdraw(asset_balance: uint256) -> uint256:
     #TODO: There are additional checks unaccounted here
     #How much original asset is currently available in the c-token contract
     cash: uint256 = ERC20(originalAsset).balanceOf(wrappedAsset) #asset
-    return min(cash, self._assetBalance())
+    return min(cash, asset_balance)
 
 #How much asset can be deposited in a single transaction
 @external
@@ -90,6 +95,13 @@ def maxDeposit() -> uint256:
 def totalAssets() -> uint256:
     return self._assetBalance()
 
+#totalAssets, maxWithdraw & maxDeposit reading the exchange rate only once.
+@external
+@view
+def state() -> (uint256, uint256, uint256):
+    asset_balance: uint256 = self._assetBalance()
+    return asset_balance, self._maxWithdraw(asset_balance), max_value(uint256)
+
 @internal
 @view
 def _assetBalance() -> uint256:
@@ -105,13 +117,28 @@ def stringify(b: uint256) -> String[78]:
     return uint2str(b)
 
 
+#Lazy max allowance to the c-token, see deposit() in LPAdapter.vy.
+@internal
+def ensure_allowance(spender: address, asset_amount: uint256):
+    allowance: uint256 = ERC20(originalAsset).allowance(self, spender)
+    if allowance >= asset_amount:
+        return
+    if allowance != 0:
+        self.safe_approve(spender, 0)
+    self.safe_approve(spender, max_value(uint256))
+
+@internal
+def safe_approve(spender: address, amount: uint256):
+    response: Bytes[32] = raw_call(originalAsset, _abi_encode(spender, amount, method_id=method_id("approve(address,uint256)")), max_outsize=32)
+    if len(response) > 0:
+        assert convert(response, bool), "approve failed"
+
 #Deposit the asset into underlying LP
 @external
 @nonpayable
 def deposit(asset_amount: uint256):
-    #TODO: NEED SAFE ERC20
     #Approve lending pool
-    ERC20(originalAsset).approve(wrappedAsset, asset_amount)
+    self.ensure_allowance(wrappedAsset, asset_amount)
     #Call deposit function
     #"deposit_from" does not make sense. this is the beneficiary of a-tokens which must always be our vault.
     #check for returned error code!!!
@@ -68,17 +68,44 @@ def _assetBalance() -> uint256:
 @external
 @view
 def maxWithdraw() -> uint256:
+    return self._maxWithdraw(self._assetBalance())
+
+@internal
+@view
+def _maxWithdraw(asset_balance: uint256) -> uint256:
     #How much original asset is currently available in the a-token contract
     cash: uint256 = ERC20(originalAsset).balanceOf(fraxPair) #asset
-    return min(cash, self._assetBalance())
+    return min(cash, asset_balance)
+
+#totalAssets, maxWithdraw & maxDeposit with a single share conversion.
+@external
+@view
+def state() -> (uint256, uint256, uint256):
+    asset_balance: uint256 = self._assetBalance()
+    return asset_balance, self._maxWithdraw(asset_balance), MAX_UINT256
+
+#Lazy max allowance to the fraxPair, see deposit() in LPAdapter.vy.
+@internal
+def ensure_allowance(spender: address, asset_amount: uint256):
+    allowance: uint256 = ERC20(originalAsset).allowance(self, spender)
+    if allowance >= asset_amount:
+        return
+    if allowance != 0:
+        self.safe_approve(spender, 0)
+    self.safe_approve(spender, max_value(uint256))
+
+@internal
+def safe_approve(spender: address, amount: uint256):
+    response: Bytes[32] = raw_call(originalAsset, _abi_encode(spender, amount, method_id=method_id("approve(address,uint256)")), max_outsize=32)
+    if len(response) > 0:
+        assert convert(response, bool), "approve failed"
 
 #Deposit the asset into underlying LP
 @external
 @nonpayable
 def deposit(asset_amount: uint256):
-    #TODO: NEED SAFE ERC20
     #Approve fraxPair
-    ERC20(originalAsset).approve(fraxPair, asset_amount)
+    self.ensure_allowance(fraxPair, asset_amount)
     #Call deposit function
     FRAXPAIR(fraxPair).deposit(asset_amount, self)
 
@@ -1,7 +1,9 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import numpy as np
 
 
-MAX_POOLS = 5
+MAX_POOLS = 16
+MAX_UINT256 = 2**256 - 1
 
 int128 = int
 uint256 = int
@@ -37,6 +39,9 @@ class Pool:
     dlending_pools : list[PoolAdapter] 
     derc20asset : ERC20
     strategy : list[uint256]
+    # Optional per adapter maxDeposit()/maxWithdraw() limits, unlimited if absent.
+    max_deposits : dict = field(default_factory=dict)
+    max_withdraws : dict = field(default_factory=dict)
 
     def __eq__(self, other) -> bool:
         return self == other.self
@@ -44,159 +49,263 @@ class Pool:
     def __hash__(self) -> int:
         return hash(42)
 
-    def getBalanceTxs( self, _target_asset_balance: uint256, _max_txs: uint8) -> list[BalanceTX]:
-        # TODO: VERY INCOMPLETE
+    def maxDeposit(self, pool) -> uint256:
+        return self.max_deposits.get(pool, MAX_UINT256)
 
-        # result : DynArray[BalanceTX, MAX_POOLS] = empty(DynArray[BalanceTX, MAX_POOLS])
-        # result : BalanceTX[MAX_POOLS] = list[BalanceTX]
-        result : list[BalanceTX] = [BalanceTX(Qty=0,Adapter=None) for x in range(_max_txs)]
+    def maxWithdraw(self, pool) -> uint256:
+        return min(self.max_withdraws.get(pool, MAX_UINT256), self.derc20asset.balanceOf(pool))
+
+    # Mirrors Dynamo4626._getBalanceTxs, only actual moves are returned.
+    # The default _min_move of 1 plans like rebalance(), 0 like a deposit or withdrawal.
+    def getBalanceTxs( self, _target_asset_balance: uint256, _max_txs: uint8, _min_move: uint256 = 1) -> list[BalanceTX]:
+        result : list[BalanceTX] = []
 
         # If there are no pools then nothing to do.
-        if len(self.dlending_pools) == 0: return result
-
-        total_balance : uint256 = self.derc20asset.balanceOf(self) # + sum([self.derc20asset.balanceOf(pool) for pool in self.dlending_pools])
-        # available_balance = total_balance - _target_asset_balance
-        total_shares : uint256 = 0 #sum(self.strategy)
-        targetBalances : list[uint256] = [0 for x in range(MAX_POOLS)]
-        currentBalances : list[uint256] = [0 for x in range(MAX_POOLS)]
-        deltaBalances : list[uint256] = [0 for x in range(MAX_POOLS)]
-        #sum_in : int128 = 0 
-        #sum_out: int128  = 0
-
-        # Determine current balances.
-        for pos, pool in enumerate(self.dlending_pools):            
-            poolBalance : uint256 = uint256(self.derc20asset.balanceOf(pool))
-            total_balance += poolBalance
-            total_shares += self.strategy[pos]
-            currentBalances[pos] = poolBalance
-            
-        available_balance : int128 = total_balance - _target_asset_balance
-
-        # Determine target balances. 
-        for pos, pool in enumerate(self.dlending_pools):               
-            targetBalances[pos] = int((self.strategy[pos]/total_shares) * available_balance)
-            deltaBalances[pos] = int(targetBalances[pos] - currentBalances[pos])
-            #if deltaBalances[pos] > 0:
-            #    sum_out += deltaBalances[pos]
-            #else:
-            #    sum_in += deltaBalances[pos]
-
-        
-        leftover_balance : int128 = available_balance - (sum(currentBalances) + sum(deltaBalances))
-        deltaTarget : int128 = self.derc20asset.balanceOf(self) - _target_asset_balance 
-
-        print("\nPool Adapters: %s." % self.dlending_pools)
-        print("total_balance = %s." % total_balance)            
-        print("targetBalances = %s." % targetBalances)
-        print("currentBalances = %s." % currentBalances)
-        print("deltaBalances = %s." % deltaBalances)
-        print("leftover_balance = %s." % leftover_balance)
-        print("_target_asset_balance = %s." % _target_asset_balance)
-        print("deltaTarget = %s." % deltaTarget)
-        #print("sum_in = %s." % sum_in)
-        #print("sum_out = %s." % sum_out)
-
-        tx : uint256 = 0
-        for i in range(len(self.dlending_pools)):
-            if deltaTarget < 0:
-                lowest : int128 = 0
-                lowest_pos : uint256 = 0
-                for pos in range(len(self.dlending_pools)):
-                    # Need to bring funds into the pool now.
-                    if deltaBalances[pos] < lowest:
-                        lowest = deltaBalances[pos]
-                        lowest_pos = pos
-                result[tx] = BalanceTX(Qty = lowest, Adapter=self.dlending_pools[lowest_pos])
-                deltaBalances[lowest_pos] = 0
-                deltaTarget -= lowest
-                tx+=1
-                continue
+        pool_count = len(self.dlending_pools)
+        if pool_count == 0: return result
+
+        local_balance : uint256 = self.derc20asset.balanceOf(self)
+        currentBalances : list[uint256] = [self.derc20asset.balanceOf(pool) for pool in self.dlending_pools]
+        total_balance : uint256 = local_balance + sum(currentBalances)
+        total_shares : uint256 = sum(self.strategy[:pool_count])
+
+        available_balance : uint256 = max(total_balance - _target_asset_balance, 0)
+
+        # Determine how far each adapter is from its target balance, limited by
+        # what the adapter will actually accept or give back right now.
+        targetBalances : list[uint256] = [0 for x in range(pool_count)]
+        deltaBalances : list[int128] = [0 for x in range(pool_count)]
+        for pos, pool in enumerate(self.dlending_pools):
+            if total_shares > 0:
+                targetBalances[pos] = available_balance * self.strategy[pos] // total_shares
+            if targetBalances[pos] > currentBalances[pos]:
+                deltaBalances[pos] = min(targetBalances[pos] - currentBalances[pos], self.maxDeposit(pool))
+            elif targetBalances[pos] < currentBalances[pos]:
+                deltaBalances[pos] = -min(currentBalances[pos] - targetBalances[pos], self.maxWithdraw(pool))
+
+        # Order the adapters by the size of their move, largest first & ties in pool order.
+        order = sorted(range(pool_count), key=lambda pos: abs(deltaBalances[pos]), reverse=True)
+
+        max_txs = min(_max_txs, pool_count)
+        tx_count = 0
+        planned : list[int128] = [0 for x in range(pool_count)]
+        selected : list[bool] = [False for x in range(pool_count)]
+
+        # How far off are we from our target asset balance?
+        deltaTarget : int128 = local_balance - _target_asset_balance
+
+        # Whatever we hold above the target still has to be placed.
+        surplus : uint256 = max(deltaTarget, 0)
+
+        # Cover any shortfall with the largest withdrawals first.
+        for pos in order:
+            if tx_count == max_txs or deltaTarget >= 0: break
+            if deltaBalances[pos] >= 0: continue
+            planned[pos] = deltaBalances[pos]
+            selected[pos] = True
+            tx_count += 1
+            deltaTarget -= deltaBalances[pos]
+
+        # Still short? Then we have to draw adapters down below their targets.
+        if deltaTarget < 0:
+            for pos in order:
+                if deltaTarget >= 0: break
+                if not selected[pos] and tx_count == max_txs: continue
+                drawable = self.maxWithdraw(self.dlending_pools[pos]) + planned[pos]
+                if drawable <= 0: continue
+                extra = min(drawable, -deltaTarget)
+                if not selected[pos]:
+                    selected[pos] = True
+                    tx_count += 1
+                planned[pos] -= extra
+                deltaTarget += extra
+
+            assert deltaTarget >= 0, "CAN'T BALANCE IN %s STEP!" % _max_txs
+
+        # Spend any remaining txs on the largest outstanding moves. Once the target
+        # is met & the surplus placed, only on moves of at least _min_move.
+        for pos in order:
+            if tx_count == max_txs: break
+            if selected[pos] or deltaBalances[pos] == 0: continue
+            if (deltaBalances[pos] < 0 or surplus == 0) and (_min_move == 0 or abs(deltaBalances[pos]) < _min_move): continue
+            # An unfunded deposit in the last tx would come to nothing.
+            if deltaBalances[pos] > 0 and deltaTarget <= 0 and tx_count + 1 == max_txs: continue
+            planned[pos] = deltaBalances[pos]
+            selected[pos] = True
+            tx_count += 1
+            if deltaBalances[pos] < 0:
+                deltaTarget -= deltaBalances[pos]
             else:
-                largest : int128 = 0
-                largest_pos : uint256 = 0                
-                for pos in range(len(self.dlending_pools)):
-                    # Now try for the largest abs(tx).
-                    if abs(deltaBalances[pos]) > abs(largest):
-                        # Make sure we don't pull below our target.
-                        if deltaTarget + deltaBalances[pos] < 0: continue
-                        largest = deltaBalances[pos]
-                        largest_pos = pos
-                result[tx] = BalanceTX(Qty = largest, Adapter=self.dlending_pools[largest_pos])
-                deltaBalances[largest_pos] = 0
-                deltaTarget += largest
-                tx+=1
-                continue
-
-        # This likely never can be called.
-        # for i in range(len(self.dlending_pools)):
-        #     for pos in range(len(self.dlending_pools)):
-        #         if deltaBalances[pos] != 0:
-        #             result[tx] = BalanceTX(Qty = deltaBalances[pos], Adapter=self.dlending_pools[pos])
-        #             tx+=1
-
-        # Make sure we meet our _target_asset_balance goal within _max_txs steps!
-        running_balance : uint256 = self.derc20asset.balanceOf(self)
-        for pos in range(_max_txs):
-            running_balance -= result[pos].Qty
-
-        if running_balance < _target_asset_balance:
-            print("Running short! Adjust!")
-            diff : int = _target_asset_balance - running_balance
-            for pos in range(_max_txs):
-                available_funds = self.derc20asset.balanceOf(result[pos].Adapter) + result[pos].Qty
-                if available_funds >= diff:
-                    result[pos].Qty-=diff
-                    diff=0
-                    break
-                elif available_funds > 0:
-                    result[pos].Qty-=available_funds
-                    diff+=available_funds
-
-            assert diff <= 0, "CAN'T BALANCE IN %s STEP!" % _max_txs
-
-        if len(result) > _max_txs:
-            for pos in range(len(result)-_max_txs):
-                result[pos+_max_txs]=BalanceTX(Qty=0,Adapter=PoolAdapter())
-
-        # DEBUGGING ONLY
-        running_balance : int = self.derc20asset.balanceOf(self)                
-        for tx in result:
-            if tx.Adapter == None: break
-            running_balance -= tx.Qty
-            adapt_pos = self.dlending_pools.index(tx.Adapter)
-            print("Adapter:%s target balance: %s, final balance: %s." % (tx.Adapter,targetBalances[adapt_pos],currentBalances[adapt_pos]+tx.Qty))
-        print("Pool target balance: %s, final balance: %s." % (_target_asset_balance,running_balance))            
-
-        return result
-
-
-d = {}
-dai = ERC20(_balanceOf = d)
+                surplus -= min(surplus, deltaBalances[pos])
 
-a1 = PoolAdapter()
-a2 = PoolAdapter()
+        # Deposits can only be funded from what we hold above our target balance.
+        for pos in order:
+            if planned[pos] <= 0: continue
+            planned[pos] = min(planned[pos], deltaTarget)
+            deltaTarget -= planned[pos]
 
-adapters = [a1,a2]
-
-p = Pool(adapters, dai, [0 for x in range(MAX_POOLS)])
-p.strategy[0] = 50
-p.strategy[1] = 50
-
-dai.deposit(a1, 20)
-
-dai.deposit(p,500) 
+        # Withdrawals go first so they can fund the deposits.
+        moves = [pos for pos in order if planned[pos] < 0] + [pos for pos in order if planned[pos] > 0]
+        for pos in moves:
+            result.append(BalanceTX(Qty=planned[pos], Adapter=self.dlending_pools[pos]))
 
+        return result
 
-result = p.getBalanceTxs(0, 5)
 
-print(result)
+# Batched version of Pool.getBalanceTxs for sweeping strategies & market states.
+# Every argument is an array with one row per scenario, adapters along axis 1:
+#
+#   local_balances  (N,)   assets held by the vault itself
+#   balances        (N,P)  assets held by each adapter
+#   strategy        (N,P)  strategy ratios
+#   targets         (N,)   _target_asset_balance
+#   max_txs         (N,)   _max_txs
+#   max_deposits    (N,P)  optional maxDeposit() limits, unlimited if None
+#   max_withdraws   (N,P)  optional maxWithdraw() limits, unlimited if None
+#   min_moves       (N,)   optional _min_move, 1 (rebalance()'s plan) if None
+#
+# Amounts are int64 so they should be in whole tokens (or similar) rather than wei.
 
-result = p.getBalanceTxs(250, 5)
+@dataclass
+class BatchBalanceTxs:
+    planned : np.ndarray       # (N,P) signed move per adapter, 0 if untouched
+    targets : np.ndarray       # (N,P) strategy target balance per adapter
+    tx_count : np.ndarray      # (N,)  number of adapter transactions in the plan
+    residual : np.ndarray      # (N,)  sum of |target - final| over the adapters
+    shortfall : np.ndarray     # (N,)  assets the adapters couldn't cover in max_txs
+    feasible : np.ndarray      # (N,)  False where getBalanceTxs would revert
+
+
+def batch_balance_txs(local_balances, balances, strategy, targets, max_txs, max_deposits=None, max_withdraws=None, min_moves=None) -> BatchBalanceTxs:
+    balances = np.asarray(balances, dtype=np.int64)
+    scenarios, pool_count = balances.shape
+    rows = np.arange(scenarios)
+
+    local_balances = np.asarray(local_balances, dtype=np.int64)
+    strategy = np.asarray(strategy, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    max_txs = np.minimum(np.asarray(max_txs, dtype=np.int64), pool_count)
+
+    int64_max = np.iinfo(np.int64).max
+    max_deposits = np.full_like(balances, int64_max) if max_deposits is None else np.asarray(max_deposits, dtype=np.int64)
+    max_withdraws = balances if max_withdraws is None else np.minimum(np.asarray(max_withdraws, dtype=np.int64), balances)
+    min_moves = np.ones(scenarios, dtype=np.int64) if min_moves is None else np.asarray(min_moves, dtype=np.int64)
+
+    # Totals & available balance * ratio have to fit as well.
+    largest = max(int(local_balances.max(initial=0)), int(balances.max(initial=0)), int(targets.max(initial=0)))
+    if largest * (pool_count + 1) * max(int(strategy.max(initial=0)), 1) > int64_max:
+        raise OverflowError("Balances * strategy ratios overflow int64, scale the amounts down.")
+
+    total_balance = local_balances + balances.sum(axis=1)
+    total_shares = strategy.sum(axis=1)
+    available_balance = np.maximum(total_balance - targets, 0)
+
+    target_balances = np.zeros_like(balances)
+    np.floor_divide(available_balance[:, None] * strategy, total_shares[:, None], out=target_balances, where=total_shares[:, None] > 0)
+
+    delta_balances = np.where(target_balances > balances,
+                              np.minimum(target_balances - balances, max_deposits),
+                              -np.minimum(balances - target_balances, max_withdraws))
+
+    # Largest moves first, ties in adapter order just like the contract.
+    order = np.argsort(-np.abs(delta_balances), axis=1, kind="stable")
+
+    tx_count = np.zeros(scenarios, dtype=np.int64)
+    planned = np.zeros_like(balances)
+    selected = np.zeros(balances.shape, dtype=bool)
+    delta_target = local_balances - targets
+    surplus = np.maximum(delta_target, 0)
+
+    # Each step below walks the adapters in order for every scenario at once,
+    # the early exits of the scalar loops become masks.
+
+    # Cover any shortfall with the largest withdrawals first.
+    for k in range(pool_count):
+        pos = order[:, k]
+        delta = delta_balances[rows, pos]
+        take = (tx_count < max_txs) & (delta_target < 0) & (delta < 0)
+        planned[rows, pos] = np.where(take, delta, planned[rows, pos])
+        selected[rows, pos] |= take
+        tx_count += take
+        delta_target -= np.where(take, delta, 0)
+
+    # Still short? Then we have to draw adapters down below their targets.
+    for k in range(pool_count):
+        pos = order[:, k]
+        drawable = max_withdraws[rows, pos] + planned[rows, pos]
+        take = (delta_target < 0) & (selected[rows, pos] | (tx_count < max_txs)) & (drawable > 0)
+        extra = np.where(take, np.minimum(drawable, -delta_target), 0)
+        tx_count += take & ~selected[rows, pos]
+        selected[rows, pos] |= take
+        planned[rows, pos] -= extra
+        delta_target += extra
+
+    shortfall = np.maximum(-delta_target, 0)
+    feasible = shortfall == 0
+
+    # Spend any remaining txs on the largest outstanding moves. Once the target
+    # is met & the surplus placed, only on moves of at least min_moves.
+    for k in range(pool_count):
+        pos = order[:, k]
+        delta = delta_balances[rows, pos]
+        take = (tx_count < max_txs) & ~selected[rows, pos] & (delta != 0)
+        take &= ~(((delta < 0) | (surplus == 0)) & ((min_moves == 0) | (np.abs(delta) < min_moves)))
+        # An unfunded deposit in the last tx would come to nothing.
+        take &= ~((delta > 0) & (delta_target <= 0) & (tx_count + 1 == max_txs))
+        planned[rows, pos] = np.where(take, delta, planned[rows, pos])
+        selected[rows, pos] |= take
+        tx_count += take
+        delta_target -= np.where(take & (delta < 0), delta, 0)
+        surplus -= np.where(take & (delta > 0), np.minimum(surplus, delta), 0)
+
+    # Deposits can only be funded from what we hold above our target balance.
+    for k in range(pool_count):
+        pos = order[:, k]
+        deposit = planned[rows, pos]
+        capped = np.where(deposit > 0, np.minimum(deposit, np.maximum(delta_target, 0)), deposit)
+        planned[rows, pos] = capped
+        delta_target -= np.where(deposit > 0, capped, 0)
+
+    # Reverted plans move nothing.
+    planned[~feasible] = 0
+
+    return BatchBalanceTxs(
+        planned = planned,
+        targets = target_balances,
+        tx_count = np.count_nonzero(planned, axis=1),
+        residual = np.abs(target_balances - (balances + planned)).sum(axis=1),
+        shortfall = shortfall,
+        feasible = feasible)
+
+
+if __name__ == "__main__":
+    d = {}
+    dai = ERC20(_balanceOf = d)
+
+    a1 = PoolAdapter()
+    a2 = PoolAdapter()
+
+    adapters = [a1,a2]
+
+    p = Pool(adapters, dai, [0 for x in range(MAX_POOLS)])
+    p.strategy[0] = 50
+    p.strategy[1] = 50
 
-print(result)
+    dai.deposit(a1, 20)
+
+    dai.deposit(p,500) 
 
-dai.deposit(a2, 600)
 
-result = p.getBalanceTxs(545, 5)
+    result = p.getBalanceTxs(0, 5)
+
+    print(result)
 
-print(result)
\ No newline at end of file
+    result = p.getBalanceTxs(250, 5)
+
+    print(result)
+
+    dai.deposit(a2, 600)
+
+    result = p.getBalanceTxs(545, 5)
+
+    print(result)
\ No newline at end of file
@@ -7,6 +7,8 @@ interface LPAdapter:
     def maxDeposit() -> uint256: view
     # How much asset this LP is responsible for.
     def totalAssets() -> uint256: view
+    # totalAssets, maxWithdraw & maxDeposit from a single set of upstream reads.
+    def state() -> (uint256, uint256, uint256): view
     # Deposit the asset into underlying LP. The tokens must be present inside the 4626 vault.
     def deposit(asset_amount: uint256): nonpayable
     # Withdraw the asset from the LP to an arbitary address. 
@@ -0,0 +1,275 @@
+# Index Dynamo4626 & Governance event logs into SQLite so analytics can answer
+# balance history & APY questions from the database instead of re-querying
+# state block by block.
+#
+#     from web3 import Web3
+#     from scripts.event_indexer import EventIndexer
+#     indexer = EventIndexer(Web3(Web3.HTTPProvider(rpc_endpoint)), "vault.db", vault_address, governance_address, deploy_block)
+#     indexer.sync()
+#     print(indexer.balance_history(account), indexer.apy(from_block, to_block))
+#
+# Logs are pulled with eth_getLogs in block range batches & only ever appended.
+# At the end of each batch the vault's totalAssets/totalSupply are sampled once
+# so share value, and from it APY, can be looked up later without the node.
+
+import json, sqlite3
+import eth_abi
+from eth_utils import keccak, to_checksum_address
+from hexbytes import HexBytes
+
+DEFAULT_BATCH_SIZE = 2000
+
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+# (name, type, indexed) for each event field, in declaration order.
+VAULT_EVENTS = {
+    "PoolAdded": [("sender", "address", True), ("contract_addr", "address", True)],
+    "PoolRemoval": [("sender", "address", True), ("contract_addr", "address", True),
+                    ("assets_withdrawn", "uint256", False), ("assets_remaining", "uint256", False)],
+    "Transfer": [("sender", "address", True), ("receiver", "address", True), ("value", "uint256", False)],
+    "Approval": [("owner", "address", True), ("spender", "address", True), ("value", "uint256", False)],
+    "StrategyActivation": [("proposer", "address", True), ("strategy_hash", "bytes32", False)],
+    "Rebalance": [("sender", "address", True), ("moves", "uint256", False),
+                  ("assets_moved", "uint256", False), ("gas_used", "uint256", False)],
+}
+
+GOVERNANCE_EVENTS = {
+    "StrategyProposal": [("Nonce", "uint256", True), ("ProposerAddress", "address", True),
+                         ("WeightsHash", "bytes32", False), ("APYNow", "uint256", False),
+                         ("APYPredicted", "uint256", False)],
+    "StrategyWithdrawal": [("Nonce", "uint256", False)],
+    "StrategyVote": [("Nonce", "uint256", False), ("GuardAddress", "address", True), ("Endorse", "bool", False)],
+    "StrategyActivation": [("Nonce", "uint256", True), ("ProposerAddress", "address", True)],
+    "NewGuard": [("GuardAddress", "address", True)],
+    "GuardRemoved": [("GuardAddress", "address", True)],
+    "GuardSwap": [("OldGuardAddress", "address", True), ("NewGuardAddress", "address", True)],
+    "GovernanceContractChanged": [("Vault", "address", False), ("Voter", "address", False),
+                                  ("NewGovernance", "address", True), ("VoteCount", "uint256", False),
+                                  ("TotalGuards", "uint256", False)],
+    "VoteForNewGovernance": [("NewGovernance", "address", True)],
+}
+
+TOTAL_ASSETS_SELECTOR = keccak(text="totalAssets()")[:4]
+TOTAL_SUPPLY_SELECTOR = keccak(text="totalSupply()")[:4]
+
+# StrategyProposal only logs a hash of the weights, they're read back from this call.
+SUBMIT_STRATEGY_SELECTOR = keccak(text="submitStrategy((uint256[],uint256,uint256))")[:4]
+
+# uint256 doesn't fit an SQLite INTEGER so amounts are kept as decimal TEXT.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    contract TEXT NOT NULL,
+    event TEXT NOT NULL,
+    args TEXT NOT NULL,
+    PRIMARY KEY (block_number, log_index)
+);
+CREATE INDEX IF NOT EXISTS events_by_name ON events (event, block_number);
+
+CREATE TABLE IF NOT EXISTS balance_changes (
+    account TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    delta TEXT NOT NULL,
+    PRIMARY KEY (account, block_number, log_index)
+);
+CREATE INDEX IF NOT EXISTS balance_changes_by_block ON balance_changes (block_number);
+
+CREATE TABLE IF NOT EXISTS share_prices (
+    block_number INTEGER PRIMARY KEY,
+    timestamp INTEGER NOT NULL,
+    total_assets TEXT NOT NULL,
+    total_supply TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def event_topic(name, fields):
+    return HexBytes(keccak(text=name + "(" + ",".join(t for _, t, _ in fields) + ")"))
+
+
+def _jsonable(value):
+    # Tuples from eth_abi & bytes values don't survive json.dumps as is.
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+    if isinstance(value, str) and value.startswith("0x") and len(value) == 42:
+        return to_checksum_address(value)
+    return value
+
+
+def decode_log(log, fields):
+    topics = log["topics"][1:]
+    indexed = [(n, t) for n, t, i in fields if i]
+    plain = [(n, t) for n, t, i in fields if not i]
+
+    args = {}
+    for (name, typ), topic in zip(indexed, topics):
+        args[name] = eth_abi.decode([typ], bytes(HexBytes(topic)))[0]
+    values = eth_abi.decode([t for _, t in plain], bytes(HexBytes(log["data"])))
+    for (name, _), value in zip(plain, values):
+        args[name] = value
+
+    return {name: _jsonable(args[name]) for name, _, _ in fields}
+
+
+class EventIndexer:
+    def __init__(self, web3, db_path, vault, governance=None, start_block=0, batch_size=DEFAULT_BATCH_SIZE):
+        self.web3 = web3
+        self.start_block = start_block
+        self.vault = to_checksum_address(vault)
+        self.governance = to_checksum_address(governance) if governance is not None else None
+        self.batch_size = batch_size
+
+        # topic0 -> (event name, fields) for each contract.
+        self.topics = {self.vault: {event_topic(n, f): (n, f) for n, f in VAULT_EVENTS.items()}}
+        if self.governance is not None:
+            self.topics[self.governance] = {event_topic(n, f): (n, f) for n, f in GOVERNANCE_EVENTS.items()}
+
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @property
+    def last_block(self):
+        row = self.db.execute("SELECT value FROM sync_state WHERE key = 'last_block'").fetchone()
+        return row[0] if row is not None else self.start_block - 1
+
+    def sync(self, to_block=None, from_block=None):
+        # Index everything after the last synced block up to to_block (latest by default).
+        # Returns how many logs were stored.
+        if to_block is None:
+            to_block = self.web3.eth.block_number
+        start = self.last_block + 1 if from_block is None else from_block
+
+        stored = 0
+        while start <= to_block:
+            end = min(start + self.batch_size - 1, to_block)
+            logs = self.web3.eth.get_logs({"fromBlock": start, "toBlock": end,
+                                           "address": list(self.topics.keys())})
+            with self.db:
+                stored += self._store_logs(logs)
+                self._sample_share_price(end)
+                self.db.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('last_block', ?)",
+                                (max(end, self.last_block),))
+            start = end + 1
+
+        return stored
+
+    def _store_logs(self, logs):
+        stored = 0
+        for log in logs:
+            contract = to_checksum_address(log["address"])
+            topic = HexBytes(log["topics"][0]) if len(log["topics"]) > 0 else None
+            event = self.topics.get(contract, {}).get(topic)
+            if event is None: continue
+
+            # Overlapping batches are fine, a log is only ever counted once.
+            block_number, log_index = log["blockNumber"], log["logIndex"]
+            if self.db.execute("SELECT 1 FROM events WHERE block_number = ? AND log_index = ?",
+                               (block_number, log_index)).fetchone() is not None: continue
+
+            name, fields = event
+            args = decode_log(log, fields)
+            if contract == self.governance and name == "StrategyProposal":
+                args["Weights"] = self._proposal_weights(log["transactionHash"], args["WeightsHash"])
+
+            self.db.execute("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)",
+                            (block_number, log_index, "0x" + bytes(HexBytes(log["transactionHash"])).hex(),
+                             contract, name, json.dumps(args)))
+            stored += 1
+
+            # A self-transfer leaves the balance as it was, its two rows would share a key.
+            if contract == self.vault and name == "Transfer" and args["sender"] != args["receiver"]:
+                changes = [(args["sender"], -args["value"]), (args["receiver"], args["value"])]
+                for account, delta in changes:
+                    if account == ZERO_ADDRESS: continue
+                    self.db.execute("INSERT OR IGNORE INTO balance_changes VALUES (?, ?, ?, ?)",
+                                    (account, block_number, log_index, str(delta)))
+
+        return stored
+
+    def _proposal_weights(self, tx_hash, weights_hash):
+        # None if the proposal didn't come straight from a submitStrategy transaction.
+        data = bytes(HexBytes(self.web3.eth.get_transaction(tx_hash)["input"]))
+        if data[:4] != SUBMIT_STRATEGY_SELECTOR: return None
+        weights = list(eth_abi.decode(["(uint256[],uint256,uint256)"], data[4:])[0][0])
+        if HexBytes(keccak(eth_abi.encode(["uint256[]"], [weights]))) != HexBytes(weights_hash): return None
+        return weights
+
+    def _sample_share_price(self, block_number):
+        total_assets = self._call_uint(TOTAL_ASSETS_SELECTOR, block_number)
+        total_supply = self._call_uint(TOTAL_SUPPLY_SELECTOR, block_number)
+        timestamp = self.web3.eth.get_block(block_number)["timestamp"]
+        self.db.execute("INSERT OR REPLACE INTO share_prices VALUES (?, ?, ?, ?)",
+                        (block_number, timestamp, str(total_assets), str(total_supply)))
+
+    def _call_uint(self, selector, block_number):
+        data = self.web3.eth.call({"to": self.vault, "data": "0x" + selector.hex()}, block_number)
+        # Nothing deployed there yet.
+        if len(data) == 0: return 0
+        return eth_abi.decode(["uint256"], bytes(HexBytes(data)))[0]
+
+    ### Queries, these never touch the node.
+
+    def events(self, name=None, from_block=0, to_block=None):
+        query = "SELECT block_number, log_index, tx_hash, contract, event, args FROM events WHERE block_number >= ?"
+        params = [from_block]
+        if to_block is not None:
+            query += " AND block_number <= ?"
+            params.append(to_block)
+        if name is not None:
+            query += " AND event = ?"
+            params.append(name)
+        query += " ORDER BY block_number, log_index"
+
+        return [{"block_number": b, "log_index": i, "tx_hash": h, "contract": c, "event": e, "args": json.loads(a)}
+                for b, i, h, c, e, a in self.db.execute(query, params)]
+
+    def balance_history(self, account):
+        # [(block_number, balance)] after each block in which the share balance changed.
+        rows = self.db.execute("SELECT block_number, delta FROM balance_changes WHERE account = ? "
+                               "ORDER BY block_number, log_index", (to_checksum_address(account),))
+        history = []
+        balance = 0
+        for block_number, delta in rows:
+            balance += int(delta)
+            if len(history) > 0 and history[-1][0] == block_number:
+                history[-1] = (block_number, balance)
+            else:
+                history.append((block_number, balance))
+        return history
+
+    def balance_at(self, account, block_number):
+        rows = self.db.execute("SELECT delta FROM balance_changes WHERE account = ? AND block_number <= ?",
+                               (to_checksum_address(account), block_number))
+        return sum(int(delta) for delta, in rows)
+
+    def share_price_at(self, block_number):
+        # (block_number, timestamp, assets per share) of the last sample at or before block_number.
+        row = self.db.execute("SELECT block_number, timestamp, total_assets, total_supply FROM share_prices "
+                              "WHERE block_number <= ? ORDER BY block_number DESC LIMIT 1", (block_number,)).fetchone()
+        if row is None: return None
+        sample_block, timestamp, total_assets, total_supply = row
+        if int(total_supply) == 0:
+            return sample_block, timestamp, 1.0
+        return sample_block, timestamp, int(total_assets) / int(total_supply)
+
+    def apy(self, from_block, to_block):
+        # Annualized, compounded share value growth between the samples closest to the two blocks.
+        start = self.share_price_at(from_block)
+        end = self.share_price_at(to_block)
+        if start is None or end is None or end[1] <= start[1]: return None
+        return (end[2] / start[2]) ** (SECONDS_PER_YEAR / (end[1] - start[1])) - 1
@@ -0,0 +1,129 @@
+# Record/replay JSON-RPC stand-in so mainnet fork tests can run without Alchemy.
+#
+# Hardhat only ever asks the upstream node for state at the pinned fork block
+# (eth_getStorageAt, eth_getCode, eth_getBalance, eth_getTransactionCount,
+# eth_getBlockByNumber...) so every answer can be cached & served again verbatim.
+#
+# Record (needs network), run the fork suite once against it:
+#     python scripts/fork_cache.py record tests/fork_cache.json https://eth-mainnet.alchemyapi.io/v2/$WEB3_ALCHEMY_API_KEY
+#     FORK_RPC_URL=http://localhost:8546 ./runtests
+#
+# Replay (offline), unknown requests get a JSON-RPC error:
+#     python scripts/fork_cache.py replay tests/fork_cache.json
+#     FORK_RPC_URL=http://localhost:8546 ./runtests
+
+import requests, json, os, signal, sys, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8546
+
+# Save the cache after this many new entries as well as on shutdown.
+SAVE_EVERY = 100
+
+
+def cache_key(method, params):
+    # Hex quantities & addresses aren't case sensitive.
+    return (method + " " + json.dumps(params, sort_keys=True, separators=(",", ":"))).lower()
+
+
+class ForkCache:
+    def __init__(self, path, upstream=None):
+        self.path = path
+        self.upstream = upstream
+        self.lock = threading.Lock()
+        self.unsaved = 0
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        with self.lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f, sort_keys=True)
+            os.replace(tmp, self.path)
+            self.unsaved = 0
+
+    def handle(self, request):
+        key = cache_key(request["method"], request.get("params", []))
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is None:
+            if self.upstream is None:
+                response["error"] = {"code": -32000, "message": "fork_cache miss: " + key}
+                return response
+
+            upstream_request = {"jsonrpc": "2.0", "id": 1, "method": request["method"], "params": request.get("params", [])}
+            upstream_response = requests.post(self.upstream, json=upstream_request).json()
+
+            # Errors may be transient (rate limits...) so they aren't cached.
+            if "error" in upstream_response:
+                response["error"] = upstream_response["error"]
+                return response
+
+            entry = {"result": upstream_response["result"]}
+            with self.lock:
+                self.entries[key] = entry
+                self.unsaved += 1
+                save = self.unsaved >= SAVE_EVERY
+            if save: self.save()
+
+        response["result"] = entry["result"]
+        return response
+
+
+def make_handler(cache):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if isinstance(body, list):
+                result = [cache.handle(r) for r in body]
+            else:
+                result = cache.handle(body)
+
+            payload = json.dumps(result).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(cache, port=DEFAULT_PORT):
+    server = ThreadingHTTPServer(("localhost", port), make_handler(cache))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if cache.upstream is not None: cache.save()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("record", "replay") or (sys.argv[1] == "record" and len(sys.argv) < 4):
+        print("usage: fork_cache.py record <cache.json> <upstream url> [port]")
+        print("       fork_cache.py replay <cache.json> [port]")
+        sys.exit(1)
+
+    if sys.argv[1] == "record":
+        cache = ForkCache(sys.argv[2], sys.argv[3])
+        port = int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_PORT
+    else:
+        cache = ForkCache(sys.argv[2])
+        port = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_PORT
+
+    # Let `kill` save the cache too.
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    print("fork_cache %s on http://localhost:%d with %d cached entries." % (sys.argv[1], port, len(cache.entries)))
+    serve(cache, port)
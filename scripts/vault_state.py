@@ -0,0 +1,34 @@
+# Decode DynamoLens.vault_state(vault) so monitoring can poll a vault with one eth_call.
+#
+#     from web3 import Web3
+#     from scripts.vault_state import fetch_vault_state
+#     state = fetch_vault_state(Web3(Web3.HTTPProvider(rpc_endpoint)), lens_address, vault_address)
+#     print(state["total_assets"], [a["total_assets"] for a in state["adapters"]])
+
+from web3 import Web3
+import eth_abi
+
+ADAPTER_STATE_FIELDS = ["adapter", "ratio", "total_assets", "max_withdraw", "max_deposit"]
+ADAPTER_STATE_TYPE = "(address,uint256,uint256,uint256,uint256)"
+
+VAULT_STATE_FIELDS = ["total_assets", "total_supply", "local_asset_balance", "share_value",
+                      "total_strategy_weight", "float_low_bps", "float_target_bps", "float_high_bps",
+                      "claimable_yield_fees", "claimable_strategy_fees", "adapters"]
+VAULT_STATE_TYPE = "(" + ",".join(["uint256"] * 10 + [ADAPTER_STATE_TYPE + "[]"]) + ")"
+
+VAULT_STATE_SELECTOR = Web3.keccak(text="vault_state(address)")[:4]
+
+
+def decode_vault_state(data: bytes) -> dict:
+    values = eth_abi.decode([VAULT_STATE_TYPE], bytes(data))[0]
+    state = dict(zip(VAULT_STATE_FIELDS, values))
+    state["adapters"] = [dict(zip(ADAPTER_STATE_FIELDS, adapter)) for adapter in state["adapters"]]
+    for adapter in state["adapters"]:
+        adapter["adapter"] = Web3.toChecksumAddress(adapter["adapter"])
+    return state
+
+
+def fetch_vault_state(web3: Web3, lens: str, vault: str, block_identifier="latest") -> dict:
+    calldata = VAULT_STATE_SELECTOR + eth_abi.encode(["address"], [Web3.toChecksumAddress(vault)])
+    data = web3.eth.call({"to": Web3.toChecksumAddress(lens), "data": calldata}, block_identifier)
+    return decode_vault_state(data)
@@ -1,6 +1,20 @@
 import pytest
+import ape
 from ape import chain
-import json, requests, os
+from web3 import Web3
+import json, requests, os, yaml
+import eth_abi
+
+HARDHAT_RPC = "http://localhost:8545/"
+
+DAI = "0x6B175474E89094C44Da98b954EedeAC495271d0F"
+
+# Upstream node for the fork, e.g. scripts/fork_cache.py to run offline.
+FORK_RPC_URL = os.getenv("FORK_RPC_URL")
+
+# Pinned fork block from ape-config.yaml.
+with open(os.path.join(os.path.dirname(__file__), "..", "ape-config.yaml")) as f:
+    FORK_BLOCK = yaml.safe_load(f)["hardhat"]["fork"]["ethereum"]["mainnet"]["block_number"]
 
 @pytest.fixture(scope="session")
 def owner(accounts):
@@ -15,23 +29,51 @@ def is_not_hard_hat():
         print("Alert: Not connected to a chain.")
         return True
 
-@pytest.fixture
-def ensure_hardhat():
+
+def hardhat_rpc(method, params=[]):
+    request = {"jsonrpc": "2.0", "method": method, "id": 1, "params": params}
+    response = requests.post(HARDHAT_RPC, json.dumps(request)).json()
+    assert "error" not in response, "%s failed: %s" % (method, response["error"])
+    return response["result"]
+
+
+@pytest.fixture(scope="session")
+def hardhat_fork():
     if is_not_hard_hat():
         pytest.skip("Not on hard hat Ethereum snapshot.")
-    #reset hardhat
-    reset_request = {"jsonrpc": "2.0", "method": "hardhat_reset", "id": 1,
-        "params": [{
-            "forking": {
-                "jsonRpcUrl": "https://eth-mainnet.alchemyapi.io/v2/"+os.getenv('WEB3_ALCHEMY_API_KEY'),
-                #hardcoding here, not good.
-                #TODO: figure out how to copy from apt-config.yaml
-                "blockNumber": 16581700
-            }
-        }]}
-    requests.post("http://localhost:8545/", json.dumps(reset_request))
+    # Fork once per session, tests are isolated with evm_snapshot/evm_revert
+    # by ensure_hardhat.
+    hardhat_rpc("hardhat_reset", [{
+        "forking": {
+            "jsonRpcUrl": FORK_RPC_URL or "https://eth-mainnet.alchemyapi.io/v2/"+os.getenv('WEB3_ALCHEMY_API_KEY'),
+            "blockNumber": FORK_BLOCK
+        }
+    }])
 
 
+@pytest.fixture(scope="session")
+def fork_dai(project, accounts, hardhat_fork):
+    deployer, trader = accounts[0], accounts[1]
+    dai = project.DAI.at(DAI)
+    #Make deployer a minter
+    #background info https://mixbytes.io/blog/modify-ethereum-storage-hardhats-mainnet-fork
+    #Dai contract has  minters in first slot mapping (address => uint) public wards;
+    abi_encoded = eth_abi.encode(['address', 'uint256'], [deployer.address, 0])
+    storage_slot = Web3.solidityKeccak(["bytes"], ["0x" + abi_encoded.hex()]).hex()
+    hardhat_rpc("hardhat_setStorageAt", [DAI, storage_slot, "0x" + eth_abi.encode(["uint256"], [1]).hex()])
+    #make the trader rich, airdrop $10 billion
+    dai.mint(trader, '10000000000 Ether', sender=deployer)
+    return project.ERC20.at(DAI)
+
+
+@pytest.fixture
+def ensure_hardhat(hardhat_fork):
+    # Session scoped fixtures (the fork, fork_dai...) are set up before this
+    # runs so they're part of the snapshot every test reverts back to.
+    snapshot = hardhat_rpc("evm_snapshot")
+    yield
+    assert hardhat_rpc("evm_revert", [snapshot]), "evm_revert to %s failed." % snapshot
+
 
 # @pytest.fixture(scope="session")
 # def receiver(accounts):
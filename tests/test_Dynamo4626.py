@@ -3,6 +3,8 @@ import ape
 from tests.conftest import is_not_hard_hat
 
 from itertools import zip_longest
+from web3 import Web3
+import eth_abi
 
 d4626_name = "DynamoDAI"
 d4626_token = "dyDAI"
@@ -51,6 +53,11 @@ def dynamo4626(project, deployer, dai, trader):
     return v
 
 
+@pytest.fixture
+def dynamo_lens(project, deployer):
+    return deployer.deploy(project.DynamoLens)
+
+
 # tx is an ape.Result
 # event_names is an in-order list of strings of the names of the events generated in the tx.
 # if full_match == True, event_names must match all result events.
@@ -69,6 +76,17 @@ def test_basic_initialization(project, deployer, dynamo4626):
     assert dynamo4626.decimals(sender=deployer) == d4626_decimals
 
 
+# EIP-170: deployed runtime code (immutables included) must stay under 24576 bytes.
+# Keep a margin so the next feature still deploys, read only views go in DynamoLens.
+EIP170_LIMIT = 24576
+CODE_SIZE_MARGIN = 1024
+
+def test_code_size(project, deployer, dynamo4626):
+    code = ape.chain.provider.web3.eth.get_code(dynamo4626.address)
+    assert len(code) <= EIP170_LIMIT - CODE_SIZE_MARGIN, \
+        "Dynamo4626 is %d bytes, less than %d under the EIP-170 limit." % (len(code), CODE_SIZE_MARGIN)
+
+
 def test_initial_pools_initialization(project, deployer, dai, pool_adapterA, pool_adapterB, pool_adapterC):
     pools = [pool_adapterA, pool_adapterB, pool_adapterC]
     dynamo = deployer.deploy(project.Dynamo4626, d4626_name, d4626_token, d4626_decimals, dai, pools, deployer)    
@@ -106,12 +124,17 @@ def test_add_pool(project, deployer, dynamo4626, pool_adapterA, trader, dai):
     # dai is not a valid adapter.
     with ape.reverts("Doesn't appear to be an LPAdapter."):    
         result = dynamo4626.add_pool(dai, sender=deployer) 
+
+    # Nor is a 4626 vault without the state() snapshots are built from.
+    fake = deployer.deploy(project.Fake4626, "Wrapped DAI", "dDAI4626", 18, dai)
+    with ape.reverts("Doesn't appear to be an LPAdapter."):
+        dynamo4626.add_pool(fake, sender=deployer)
     
     pool_count = len(dynamo4626.lending_pools())
     assert pool_count == 1
 
     # How many more pools can we add?
-    for i in range(4): # Dynamo4626.MAX_POOLS - 1
+    for i in range(15): # Dynamo4626.MAX_POOLS - 1
         a = deployer.deploy(project.MockLPAdapter, dai, dai)
         result = dynamo4626.add_pool(a, sender=deployer) 
         assert result.return_value == True
@@ -123,8 +146,57 @@ def test_add_pool(project, deployer, dynamo4626, pool_adapterA, trader, dai):
         dynamo4626.add_pool(a, sender=deployer)
 
 
-def test_remove_pool(project, deployer, dynamo4626, pool_adapterA, trader, dai):
-    pytest.skip("TODO: Not implemented yet.")
+def test_remove_pool(project, deployer, dynamo4626, dynamo_lens, pool_adapterA, pool_adapterB, pool_adapterC, trader, dai):
+    for adapter in [pool_adapterA, pool_adapterB, pool_adapterC]:
+        _setup_single_adapter(project,dynamo4626, deployer, dai, adapter)
+
+    dai.approve(dynamo4626, 3000, sender=trader)
+    dynamo4626.deposit(3000, trader, sender=trader)
+    dynamo4626.rebalance(3, 0, sender=trader)
+    assert [dai.balanceOf(a) for a in [pool_adapterA, pool_adapterB, pool_adapterC]] == [1000, 1000, 1000]
+
+    with ape.reverts("Only owner can remove Lending Pools."):
+        dynamo4626.remove_pool(pool_adapterA, sender=trader)
+
+    with ape.reverts("pool not supported."):
+        dynamo4626.remove_pool(dai, sender=deployer)
+
+    # At most 400 assets come out per step & go straight to the other pools.
+    result = dynamo4626.remove_pool(pool_adapterA, 400, sender=deployer)
+    assert result.return_value == False
+    removal = [log for log in result.decode_logs() if log.event_name == "PoolRemoval"]
+    assert len(removal) == 1
+    assert removal[0].assets_withdrawn == 400
+    assert removal[0].assets_remaining == 600
+    assert dynamo_lens.strategy(dynamo4626, pool_adapterA) == 0
+    assert dynamo4626.total_strategy_weight() == 2
+    assert len(dynamo4626.lending_pools()) == 3
+    assert dai.balanceOf(pool_adapterA) == 600
+    assert dai.balanceOf(pool_adapterB) + dai.balanceOf(pool_adapterC) == 2400
+    assert dynamo4626.totalAssets() == 3000
+
+    dynamo4626.remove_pool(pool_adapterA, 400, sender=deployer)
+
+    # Last step empties the pool & pool C fills its slot.
+    result = dynamo4626.remove_pool(pool_adapterA, 400, sender=deployer)
+    assert result.return_value == True
+    assert dynamo4626.lending_pools() == [pool_adapterC, pool_adapterB]
+    assert [dai.balanceOf(a) for a in [pool_adapterA, pool_adapterB, pool_adapterC]] == [0, 1500, 1500]
+    assert dynamo4626.totalAssets() == 3000
+
+    with ape.reverts("pool not supported."):
+        dynamo4626.remove_pool(pool_adapterA, sender=deployer)
+
+    # Yield earned before a removal is charged by the removal itself.
+    dai.mint(pool_adapterB, 1000, sender=deployer)
+
+    # Without a limit the whole pool goes in one step.
+    result = dynamo4626.remove_pool(pool_adapterC, sender=deployer)
+    assert result.return_value == True
+    assert dynamo4626.lending_pools() == [pool_adapterB]
+    assert dai.balanceOf(pool_adapterB) == 4000
+    # 110 of the 1000 yield in fees, as 84 new shares on top of 3000.
+    assert dynamo4626.balanceOf(dynamo4626) == 84
 
 
 def _setup_single_adapter(_project, _dynamo4626, _deployer, _dai, _adapter):
@@ -253,11 +325,334 @@ def test_single_adapter_share_value_increase(project, deployer, dynamo4626, pool
 
     assert dynamo4626.totalAssets() == 2000
 
-    # Assumes YIELD_FEE_PERCENTAGE : constant(decimal) = 10.0
-    #     and PROPOSER_FEE_PERCENTAGE : constant(decimal) = 1.0
-    assert dynamo4626.convertToAssets(1000) == 1000 + (1000 - (1000*0.11))
+    # No fees are taken until the next state changing call, but the views
+    # already count the fee shares it will mint.
+    assert dynamo4626.totalSupply() == 1000
 
-    assert dynamo4626.convertToShares(2000) == 1000    
+    assert dynamo4626.convertToAssets(1000) == 1890
 
-    
+    assert dynamo4626.convertToShares(2000) == 1058
+
+    # Assumes YIELD_FEE_PERCENTAGE : constant(uint256) = 10
+    #     and PROPOSER_FEE_PERCENTAGE : constant(uint256) = 1
+    # so 110 assets of fees, 58 shares minted to the vault.
+    dynamo4626.rebalance(0, 0, sender=trader)
+    assert dynamo4626.totalSupply() == 1058
+    assert dynamo4626.balanceOf(dynamo4626) == 58
+
+    assert dynamo4626.convertToAssets(1000) == 1890
+
+    assert dynamo4626.convertToShares(2000) == 1058
+
+    # Returns haven't passed the high-water mark, nothing more to take.
+    dynamo4626.rebalance(0, 0, sender=trader)
+    assert dynamo4626.totalSupply() == 1058
+
+    # Shares are no longer 1:1 with assets, deposits & mints still go through.
+    dai.approve(dynamo4626, 1190, sender=trader)
+    assert dynamo4626.previewDeposit(1000) == 529
+    result = dynamo4626.deposit(1000, trader, sender=trader)
+    assert result.return_value == 529
+    assert dynamo4626.balanceOf(trader) == 1529
+
+    assert dynamo4626.previewMint(100) == 190
+    result = dynamo4626.mint(100, trader, sender=trader)
+    assert result.return_value == 190
+    assert dynamo4626.balanceOf(trader) == 1629
+    assert dynamo4626.totalAssets() == 3190
+
+
+
+
+def test_multiple_adapter_balancing(project, deployer, dynamo4626, pool_adapterA, pool_adapterB, pool_adapterC, dai, trader):
+    adapters = [pool_adapterA, pool_adapterB, pool_adapterC]
+    for adapter in adapters:
+        _setup_single_adapter(project,dynamo4626, deployer, dai, adapter)
+
+    dai.approve(dynamo4626, 3600, sender=trader)
+
+    # Equal strategy ratios but MAX_BALTX_DEPOSIT limits us to two moves.
+    dynamo4626.deposit(3000, trader, sender=trader)
+
+    assert [a.totalAssets() for a in adapters] == [1000, 1000, 0]
+    assert dai.balanceOf(dynamo4626) == 1000
+    assert dynamo4626.totalAssets() == 3000
+
+    # Largest moves first, funded from the local balance.
+    dynamo4626.deposit(600, trader, sender=trader)
+
+    assert [a.totalAssets() for a in adapters] == [1200, 1000, 1200]
+    assert dai.balanceOf(dynamo4626) == 200
+    assert dynamo4626.totalAssets() == 3600
+
+    # Two withdrawals have to cover the whole shortfall.
+    dynamo4626.withdraw(1000, trader, trader, sender=trader)
+
+    assert [a.totalAssets() for a in adapters] == [734, 1000, 866]
+    assert dai.balanceOf(dynamo4626) == 0
+    assert dynamo4626.totalAssets() == 2600
+
+
+def test_float_skips_adapters(project, deployer, dynamo4626, pool_adapterA, dai, trader):
+    _setup_single_adapter(project,dynamo4626, deployer, dai, pool_adapterA)
+
+    with ape.reverts("Only owner can set the float."):
+        dynamo4626.set_float(1000, 2000, 3000, sender=trader)
 
+    with ape.reverts("Float watermarks out of order."):
+        dynamo4626.set_float(2000, 1000, 3000, sender=deployer)
+
+    # No float by default, deposits & withdrawals skip it entirely.
+    assert dynamo4626.float_bps() == (0, 0, 0)
+
+    # Keep between 10% & 30% of totalAssets locally, rebalancing back to 20%.
+    dynamo4626.set_float(1000, 2000, 3000, sender=deployer)
+    assert dynamo4626.float_bps() == (1000, 2000, 3000)
+
+    dai.approve(dynamo4626, 1050, sender=trader)
+
+    # Above the high watermark so we rebalance down to the target float.
+    dynamo4626.deposit(1000, trader, sender=trader)
+    assert pool_adapterA.totalAssets() == 800
+    assert dai.balanceOf(dynamo4626) == 200
+
+    # Small deposit stays inside the float.
+    dynamo4626.deposit(50, trader, sender=trader)
+    assert pool_adapterA.totalAssets() == 800
+    assert dai.balanceOf(dynamo4626) == 250
+
+    # Small withdraw is paid out of the float.
+    dynamo4626.withdraw(100, trader, trader, sender=trader)
+    assert pool_adapterA.totalAssets() == 800
+    assert dai.balanceOf(dynamo4626) == 150
+
+    # This one would take us below the low watermark.
+    dynamo4626.withdraw(200, trader, trader, sender=trader)
+    assert pool_adapterA.totalAssets() == 600
+    assert dai.balanceOf(dynamo4626) == 150
+    assert dynamo4626.totalAssets() == 750
+
+
+def test_keeper_rebalance(project, deployer, dynamo4626, pool_adapterA, pool_adapterB, dai, trader):
+    for adapter in [pool_adapterA, pool_adapterB]:
+        _setup_single_adapter(project,dynamo4626, deployer, dai, adapter)
+
+    # Never rebalance on deposit, leave it all to the keeper.
+    dynamo4626.set_float(0, 0, 10000, sender=deployer)
+
+    dai.approve(dynamo4626, 1010, sender=trader)
+    dynamo4626.deposit(1000, trader, sender=trader)
+    assert dai.balanceOf(dynamo4626) == 1000
+
+    # Anyone may rebalance, limited to _max_txs moves.
+    result = dynamo4626.rebalance(1, 0, sender=trader)
+    assert result.return_value == 1
+    logs = list(result.decode_logs(dynamo4626.Rebalance))
+    assert len(logs) == 1
+    assert logs[0].moves == 1
+    assert logs[0].assets_moved == 500
+    assert logs[0].gas_used > 0
+    assert pool_adapterA.totalAssets() == 500
+
+    # The 5 asset top up to pool_adapterA is dust.
+    dynamo4626.deposit(10, trader, sender=trader)
+    result = dynamo4626.rebalance(5, 100, sender=trader)
+    assert result.return_value == 1
+    assert pool_adapterA.totalAssets() == 500
+    assert pool_adapterB.totalAssets() == 505
+    assert dai.balanceOf(dynamo4626) == 5
+
+
+def test_chunked_rebalance(project, deployer, dynamo4626, dynamo_lens, pool_adapterA, pool_adapterB, pool_adapterC, dai, trader):
+    ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+    adapters = [pool_adapterA, pool_adapterB, pool_adapterC]
+    for adapter in adapters:
+        _setup_single_adapter(project,dynamo4626, deployer, dai, adapter)
+
+    dai.approve(dynamo4626, 3000, sender=trader)
+    dynamo4626.deposit(3000, trader, sender=trader)
+    assert [a.totalAssets() for a in adapters] == [1000, 1000, 0]
+    assert dynamo_lens.rebalance_progress(dynamo4626) == (0, 1000)
+
+    # A new strategy doesn't move anything by itself.
+    strategy = [(pool_adapterA, 1), (pool_adapterC, 3)] + [(ZERO_ADDRESS, 0)] * 3
+    dynamo4626.set_strategy(trader, strategy, 0, sender=deployer)
+    assert [a.totalAssets() for a in adapters] == [1000, 1000, 0]
+    assert dynamo_lens.rebalance_progress(dynamo4626) == (0, 3500)
+
+    # Keepers get there one move at a time.
+    steps = [([1000, 1000, 1000], (1000, 2500)),
+             ([1000, 0, 1000], (2000, 1500)),
+             ([1000, 0, 2000], (3000, 500)),
+             ([750, 0, 2000], (3250, 250)),
+             ([750, 0, 2250], (3500, 0))]
+    for balances, progress in steps:
+        assert dynamo4626.rebalance(1, 0, sender=trader).return_value == 1
+        assert [a.totalAssets() for a in adapters] == balances
+        assert dynamo_lens.rebalance_progress(dynamo4626) == progress
+
+
+def test_preview_rounding(project, deployer, dynamo4626, pool_adapterA, dai, trader):
+    _setup_single_adapter(project,dynamo4626, deployer, dai, pool_adapterA)
+
+    dai.approve(dynamo4626, 1000, sender=trader)
+    dynamo4626.deposit(1000, trader, sender=trader)
+
+    # 1500 assets backing 1000 shares, the views count the 38 fee shares the
+    # next checkpoint mints for the 55 assets of fees.
+    dai.mint(pool_adapterA, 500, sender=deployer)
+
+    # Previews round against the caller, conversions round down.
+    assert dynamo4626.convertToAssets(3) == 4
+    assert dynamo4626.previewRedeem(3) == 4
+    assert dynamo4626.previewMint(3) == 5
+
+    assert dynamo4626.convertToShares(5) == 3
+    assert dynamo4626.previewDeposit(5) == 3
+    assert dynamo4626.previewWithdraw(5) == 4
+
+    # No more int128 ceiling.
+    assert dynamo4626.maxDeposit() > 2**128
+    assert dynamo4626.maxMint(trader) > 2**128
+
+    # So a preview never promises more than the redeem that follows pays out.
+    assert dynamo4626.maxWithdraw(trader) == 1445
+    preview = dynamo4626.previewRedeem(600)
+    assert preview == 867
+    before = dai.balanceOf(trader)
+    dynamo4626.redeem(600, trader, trader, sender=trader)
+    assert dai.balanceOf(trader) - before == preview
+    assert dynamo4626.balanceOf(dynamo4626) == 38
+
+
+def test_set_strategy(project, deployer, dai, dynamo_lens, pool_adapterA, pool_adapterB, pool_adapterC, trader):
+    ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+    pools = [pool_adapterA, pool_adapterB, pool_adapterC]
+    dynamo = deployer.deploy(project.Dynamo4626, d4626_name, d4626_token, d4626_decimals, dai, pools, deployer)
+
+    # Each new pool starts out with an equal ratio.
+    assert dynamo.total_strategy_weight() == 3
+
+    strategy = [(pool_adapterA, 2), (pool_adapterC, 5)] + [(ZERO_ADDRESS, 0)] * 3
+
+    with ape.reverts("Only Governance DAO may set a new strategy."):
+        dynamo.set_strategy(trader, strategy, 0, sender=trader)
+
+    result = dynamo.set_strategy(trader, strategy, 0, sender=deployer)
+    assert result.return_value == True
+    assert events_in_logs(result, ["StrategyActivation"])
+    activation = list(result.decode_logs(dynamo.StrategyActivation))[0]
+    assert activation.proposer == trader
+    # Only a hash of the strategy is logged, it's in the calldata.
+    encoded = eth_abi.encode(["(address,uint256)[]"], [[(getattr(a, "address", a), r) for a, r in strategy]])
+    assert activation.strategy_hash == Web3.keccak(encoded)
+
+    # Pools left out of the strategy get no allocation.
+    assert [dynamo_lens.strategy(dynamo, p) for p in pools] == [2, 0, 5]
+    assert dynamo.total_strategy_weight() == 7
+
+    # Ratios are packed 16 bits apiece.
+    with ape.reverts("Strategy ratio must fit in 16 bits."):
+        dynamo.set_strategy(trader, [(pool_adapterA, 2**16)] + [(ZERO_ADDRESS, 0)] * 4, 0, sender=deployer)
+
+    dynamo.set_strategy(trader, [(pool_adapterA, 2), (pool_adapterB, 3), (pool_adapterC, 2**16 - 1)], 0, sender=deployer)
+    assert [dynamo_lens.strategy(dynamo, p) for p in pools] == [2, 3, 2**16 - 1]
+
+    # The last pool's ratio moves into the removed pool's place.
+    dynamo.remove_pool(pool_adapterA, sender=deployer)
+    assert dynamo.lending_pools() == [pool_adapterC, pool_adapterB]
+    assert [dynamo_lens.strategy(dynamo, p) for p in pools] == [0, 3, 2**16 - 1]
+    assert dynamo.total_strategy_weight() == 2**16 + 2
+
+
+def test_packed_accounting(project, deployer, dynamo4626, pool_adapterA, dai, trader):
+    ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+    _setup_single_adapter(project,dynamo4626, deployer, dai, pool_adapterA)
+
+    dai.approve(dynamo4626, (1<<256)-1, sender=trader)
+    dynamo4626.deposit(5000, trader, sender=trader)
+    dynamo4626.deposit(5000, trader, sender=trader)
+    dynamo4626.withdraw(1100, trader, trader, sender=trader)
+
+    # Counters sharing a slot don't bleed into each other.
+    assert dynamo4626.total_assets_deposited() == 10000
+    assert dynamo4626.total_assets_withdrawn() == 1100
+
+    # 2500 assets of yield, 10% to the owner.
+    dai.mint(pool_adapterA, 2500, sender=deployer)
+    result = dynamo4626.claim_yield_fees(sender=deployer)
+    assert result.return_value == 250
+    assert dynamo4626.total_yield_fees_claimed() == 250
+    assert dynamo4626.total_strategy_fees_claimed() == 0
+    # Claimed fees count as withdrawn so they aren't charged again.
+    assert dynamo4626.total_assets_withdrawn() == 1350
+
+    # Proposer & min payout share a slot too.
+    strategy = [(pool_adapterA, 1)] + [(ZERO_ADDRESS, 0)] * 4
+    dynamo4626.set_strategy(trader, strategy, 5, sender=deployer)
+
+    with ape.reverts("Only curent proposer may claim strategy fees."):
+        dynamo4626.claim_strategy_fees(sender=deployer)
+
+    # 1% of the same 2500 returns.
+    result = dynamo4626.claim_strategy_fees(sender=trader)
+    assert result.return_value == 25
+    assert dynamo4626.total_yield_fees_claimed() == 250
+    assert dynamo4626.total_strategy_fees_claimed() == 25
+
+    # Every fee share has been burned.
+    assert dynamo4626.balanceOf(dynamo4626) == 0
+    assert dynamo4626.totalSupply() == 8900
+
+    # Counters are uint128 and payouts uint96, overflowing reverts.
+    dai.mint(trader, 1<<128, sender=deployer)
+    with ape.reverts():
+        dynamo4626.deposit(1<<128, trader, sender=trader)
+
+    with ape.reverts():
+        dynamo4626.set_strategy(deployer, strategy, 1<<96, sender=deployer)
+
+    assert dynamo4626.total_assets_deposited() == 10000
+
+    # 3 assets of strategy fees is below the replaced proposer's min payout of 5.
+    dai.mint(pool_adapterA, 300, sender=deployer)
+    before = dai.balanceOf(trader)
+    dynamo4626.set_strategy(deployer, strategy, 0, sender=deployer)
+    assert dai.balanceOf(trader) == before
+    assert dynamo4626.total_strategy_fees_claimed() == 25
+
+
+def test_vault_state(project, deployer, dynamo4626, dynamo_lens, pool_adapterA, pool_adapterB, dai, trader):
+    from scripts.vault_state import fetch_vault_state
+
+    for adapter in [pool_adapterA, pool_adapterB]:
+        _setup_single_adapter(project,dynamo4626, deployer, dai, adapter)
+
+    dai.approve(dynamo4626, 1100, sender=trader)
+    dynamo4626.deposit(1100, trader, sender=trader)
+    dai.mint(pool_adapterA, 10000, sender=deployer)
+    # Checkpoint so the fees get taken.
+    dynamo4626.rebalance(0, 0, sender=trader)
+
+    state = dynamo_lens.vault_state(dynamo4626)
+    assert state.total_assets == dynamo4626.totalAssets() == 11100
+    # 121 fee shares minted to the vault.
+    assert state.total_supply == dynamo4626.totalSupply() == 1221
+    assert state.local_asset_balance == 0
+    assert state.share_value == dynamo4626.convertToAssets(10**d4626_decimals)
+    assert state.total_strategy_weight == 2
+    assert state.claimable_yield_fees == 1000
+    assert state.claimable_strategy_fees == 100
+    assert [a.adapter for a in state.adapters] == dynamo4626.lending_pools()
+    assert [a.ratio for a in state.adapters] == [1, 1]
+    assert [a.total_assets for a in state.adapters] == [10550, 550]
+    # Only the 550 LP shares the vault holds can be withdrawn.
+    assert [a.max_withdraw for a in state.adapters] == [550, 550]
+    assert [a.max_deposit for a in state.adapters] == [2**255 - 1] * 2
+
+    # Same thing decoded off a raw eth_call.
+    raw = fetch_vault_state(ape.chain.provider.web3, dynamo_lens.address, dynamo4626.address)
+    assert raw["total_assets"] == 11100
+    assert raw["share_value"] == state.share_value
+    assert [a["adapter"] for a in raw["adapters"]] == [pool_adapterA.address, pool_adapterB.address]
+    assert [a["total_assets"] for a in raw["adapters"]] == [10550, 550]
@@ -5,6 +5,8 @@ import ape
 
 import pytest
 from  pytest import raises
+from web3 import Web3
+import eth_abi
 
 WEIGHTS = [100, 1000]
 APYNOW = 5
@@ -13,13 +15,20 @@ BADAPYPREDICTED = 3
 NONCE = 1
 VOTE_COUNT = 6
 ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+MAX_GUARDS = 32
+MAX_PENDING = 8
+
+# Strategy events only carry the hash of the weights.
+def weights_hash(weights):
+    return Web3.keccak(eth_abi.encode(["uint256[]"], [weights]))
 
 @pytest.fixture
 def vault_contract(owner, project, accounts):
 
     owner, operator, someoneelse, someone, newcontract, currentvault, currentgovernance = accounts[:7]
 
-    vcontract = owner.deploy(project.Vault_test, owner)
+    # One lending pool per weight.
+    vcontract = owner.deploy(project.Vault_test, owner, [newcontract, currentvault])
 
     return vcontract
 
@@ -54,9 +63,11 @@ def test_submitStrategy(governance_contract, accounts, owner):
     sp = governance_contract.submitStrategy(ProposedStrategy, sender=owner)
     logs = list(sp.decode_logs(governance_contract.StrategyProposal))
     assert len(logs) == 1
-    assert logs[0].strategy[2] == tuple(WEIGHTS)
-    assert logs[0].strategy[3] == APYNOW
-    assert logs[0].strategy[4] == APYPREDICTED
+    assert logs[0].Nonce == NONCE
+    assert logs[0].ProposerAddress == owner
+    assert logs[0].WeightsHash == weights_hash(WEIGHTS)
+    assert logs[0].APYNow == APYNOW
+    assert logs[0].APYPredicted == APYPREDICTED
 
     print("Current timestamp %s" % datetime.fromtimestamp(ape.chain.pending_timestamp))
     print("TDelay %s" % datetime.fromtimestamp(int(governance_contract.TDelay())) )
@@ -66,16 +77,34 @@ def test_submitStrategy(governance_contract, accounts, owner):
     print("Expire time %s " % datetime.fromtimestamp(int(ape.chain.pending_timestamp) + tdelay) )
 
 
-    governance_contract.PendingStrategy.Nonce = NONCE
-
-    #Test if i can submit a strategy while there is pending strategy
-    with ape.reverts():
-        governance_contract.submitStrategy(ProposedStrategy, sender=owner)
+    assert governance_contract.StrategyStatus(NONCE) == 1
+    assert governance_contract.Strategies(NONCE).TExpires == governance_contract.Strategies(NONCE).TSubmitted + tdelay
 
     #Test if i can submit a strategy where the APY does not increase
     with ape.reverts():
         governance_contract.submitStrategy(BadStrategy, sender=owner)
 
+    #Test if i can submit a strategy that doesn't cover the vault's pools
+    with ape.reverts("Weights must match the vault's lending pools"):
+        governance_contract.submitStrategy((WEIGHTS + [1], APYNOW, APYPREDICTED), sender=owner)
+
+    #Test if i can submit a weight the vault can't pack into 16 bits
+    with ape.reverts("Strategy weights must fit in 16 bits"):
+        governance_contract.submitStrategy(([2**16] + WEIGHTS[1:], APYNOW, APYPREDICTED), sender=owner)
+
+    #Test if i can submit a strategy without any weight
+    with ape.reverts("Cannot Submit Strategy without Weights"):
+        governance_contract.submitStrategy(([0, 0], APYNOW, APYPREDICTED), sender=owner)
+
+    #Several strategies can be pending at once, up to MAX_PENDING
+    for i in range(MAX_PENDING - 1):
+        governance_contract.submitStrategy(ProposedStrategy, sender=owner)
+    assert list(governance_contract.PendingStrategies()) == list(range(1, MAX_PENDING + 1))
+
+    with ape.reverts("Too many pending strategies"):
+        governance_contract.submitStrategy(ProposedStrategy, sender=owner)
+
+
     print("Current timestamp %s" % datetime.fromtimestamp(ape.chain.pending_timestamp))
 
 
@@ -101,8 +130,6 @@ def test_withdrawStrategy(governance_contract, accounts):
     with ape.reverts():
         ws = governance_contract.withdrawStrategy(2, sender=owner)
 
-    governance_contract.PendingStrategy.Nonce = NONCE
-
     #Test if i can withdraw strategy when i am not eligible
     with ape.reverts():
         ws = governance_contract.withdrawStrategy(NONCE, sender=someone)
@@ -127,8 +154,6 @@ def test_withdrawStrategy(governance_contract, accounts):
 
     print("Current timestamp %s" % datetime.fromtimestamp(ape.chain.pending_timestamp))
 
-    governance_contract.PendingStrategy.Nonce = 2
-
     #Endorse the strategy
     es = governance_contract.endorseStrategy(2, sender=someone)
     logs = list(es.decode_logs(governance_contract.StrategyVote))
@@ -137,9 +162,8 @@ def test_withdrawStrategy(governance_contract, accounts):
     acs = governance_contract.activateStrategy(2, sender=owner)
     logs = list(acs.decode_logs(governance_contract.StrategyActivation))
     assert len(logs) == 1
-    assert logs[0].strategy[2] == tuple(WEIGHTS)
-    assert logs[0].strategy[3] == APYNOW
-    assert logs[0].strategy[4] == APYPREDICTED
+    assert logs[0].Nonce == 2
+    assert logs[0].ProposerAddress == owner
 
     #Test if i can withdraw strategy when its already activated
     with ape.reverts():
@@ -163,8 +187,6 @@ def test_endorseStrategy(governance_contract, accounts):
     with ape.reverts():
         es = governance_contract.endorseStrategy(2, sender=someone)
 
-    governance_contract.PendingStrategy.Nonce = NONCE
-
     #Test to see if we can vote while not being a guard
     with ape.reverts():
         es = governance_contract.endorseStrategy(NONCE, sender=owner)
@@ -214,8 +236,6 @@ def test_rejectStrategy(governance_contract, accounts):
     with ape.reverts():
         rs = governance_contract.rejectStrategy(2, sender=someone)
 
-    governance_contract.PendingStrategy.Nonce = NONCE
-
     #Check to see if we can vote while not being a guard
     with ape.reverts():
         rs = governance_contract.rejectStrategy(NONCE, sender=owner)
@@ -228,13 +248,17 @@ def test_rejectStrategy(governance_contract, accounts):
     assert logs[0].GuardAddress == someone
     assert logs[0].Endorse == True
 
+    #A majority of rejections takes the strategy out of the queue
+    assert governance_contract.StrategyStatus(NONCE) == 5
+    assert list(governance_contract.PendingStrategies()) == []
+
     #Test to see if i can vote again
     with ape.reverts():
         rs = governance_contract.rejectStrategy(NONCE, sender=someone)
 
 
 
-def test_activateStrategy(governance_contract, accounts):
+def test_activateStrategy(governance_contract, vault_contract, accounts):
     ProposedStrategy = (WEIGHTS, APYNOW, APYPREDICTED)
     owner, operator, someoneelse, someone = accounts[:4]
 
@@ -246,25 +270,36 @@ def test_activateStrategy(governance_contract, accounts):
     logs = list(sp.decode_logs(governance_contract.StrategyProposal))
     assert len(logs) == 1
 
-    governance_contract.PendingStrategy.Nonce = NONCE
-
     #Endorse the strategy
     es = governance_contract.endorseStrategy(NONCE, sender=someone)
     logs = list(es.decode_logs(governance_contract.StrategyVote))
 
+    #Only the contract owner sets the prior proposer's minimum payout.
+    with ape.reverts("Cannot set payout unless you are contract owner"):
+        governance_contract.setMinProposerPayout(1000, sender=someone)
+    governance_contract.setMinProposerPayout(1000, sender=owner)
+    assert governance_contract.MinProposerPayout() == 1000
+
     #Activate the startegy
     acs = governance_contract.activateStrategy(NONCE, sender=owner)
     logs = list(acs.decode_logs(governance_contract.StrategyActivation))
     assert len(logs) == 1
-    assert logs[0].strategy[2] == tuple(WEIGHTS)
-    assert logs[0].strategy[3] == APYNOW
-    assert logs[0].strategy[4] == APYPREDICTED
+    assert logs[0].Nonce == NONCE
+    assert logs[0].ProposerAddress == owner
+
+    # The weights themselves are in the proposal's calldata.
+    assert list(governance_contract.CurrentStrategy().Weights) == WEIGHTS
+
+    # The vault gets the weights paired with its lending pools.
+    logs = list(acs.decode_logs(vault_contract.StrategySet))
+    assert len(logs) == 1
+    assert logs[0].Proposer == owner
+    assert [(s.adapter, s.ratio) for s in logs[0].Strategies] == list(zip(vault_contract.lending_pools(), WEIGHTS))
+    assert logs[0].MinProposerPayout == 1000
 
     #Submit another Strategy
     governance_contract.submitStrategy(ProposedStrategy, sender=owner)
 
-    governance_contract.PendingStrategy.Nonce = 2
-
     #Endorse the second strategy
     es = governance_contract.endorseStrategy(2, sender=someone)
 
@@ -273,12 +308,36 @@ def test_activateStrategy(governance_contract, accounts):
         acs = governance_contract.activateStrategy(3, sender=owner)
 
     ws = governance_contract.withdrawStrategy(2, sender=owner)
+    assert governance_contract.StrategyStatus(2) == 4
+    assert list(governance_contract.PendingStrategies()) == []
 
     #Test if i can activate strategy when its withdrawn
     with ape.reverts():
         acs = governance_contract.activateStrategy(2, sender=owner)
  
 
+def test_activateStrategy_pools_changed(governance_contract, vault_contract, accounts):
+    ProposedStrategy = (WEIGHTS, APYNOW, APYPREDICTED)
+    owner, operator, someoneelse, someone = accounts[:4]
+
+    governance_contract.addGuard(someone, sender=owner)
+    governance_contract.submitStrategy(ProposedStrategy, sender=owner)
+    governance_contract.endorseStrategy(NONCE, sender=someone)
+
+    #The vault gains a pool after the weights were matched up with its pools.
+    vault_contract.add_pool(someoneelse, sender=owner)
+
+    with ape.reverts("Vault's lending pools changed since submission"):
+        governance_contract.activateStrategy(NONCE, sender=owner)
+    assert governance_contract.StrategyStatus(NONCE) == 1
+
+    #A proposal against the current pools still goes through.
+    governance_contract.submitStrategy((WEIGHTS + [10], APYNOW, APYPREDICTED), sender=owner)
+    governance_contract.endorseStrategy(2, sender=someone)
+    governance_contract.activateStrategy(2, sender=owner)
+    assert governance_contract.CurrentNonce() == 2
+
+
 def test_addGuard(governance_contract, accounts):
     owner, operator, someoneelse, someone = accounts[:4]
 
@@ -301,9 +360,13 @@ def test_addGuard(governance_contract, accounts):
         ag = governance_contract.addGuard(ZERO_ADDRESS, sender=owner)
 
     ag = governance_contract.addGuard(someoneelse, sender=owner)
+    assert governance_contract.GuardIndex(someoneelse) == 2
+
+    for i in range(MAX_GUARDS - 2):
+        governance_contract.addGuard("0x%040x" % (i + 1), sender=owner)
 
     #Test if i can add a guard when len(LGov) = MAX_GUARDS
-    with ape.reverts():
+    with ape.reverts("Cannot add anymore guards"):
         ag = governance_contract.addGuard(operator, sender=owner)
 
 
@@ -400,4 +463,65 @@ def test_replaceGovernance(governance_contract, accounts):
 
     #Test if VoteCount increases correctly
     assert logs[0].VoteCount == 1
-    assert logs[0].TotalGuards == 1
\ No newline at end of file
+    assert logs[0].TotalGuards == 1
+
+
+def test_guard_votes(governance_contract, accounts):
+    ProposedStrategy = (WEIGHTS, APYNOW, APYPREDICTED)
+    owner, operator, someoneelse, someone = accounts[:4]
+
+    for guard in [operator, someoneelse, someone]:
+        governance_contract.addGuard(guard, sender=owner)
+    governance_contract.submitStrategy(ProposedStrategy, sender=owner)
+
+    # Votes are bitmaps by position in LGov.
+    governance_contract.endorseStrategy(NONCE, sender=operator)
+    governance_contract.rejectStrategy(NONCE, sender=someone)
+    assert governance_contract.Strategies(NONCE).VotesEndorse == 0b001
+    assert governance_contract.Strategies(NONCE).VotesReject == 0b100
+
+    with ape.reverts("Guard already voted"):
+        governance_contract.endorseStrategy(NONCE, sender=someone)
+
+    # Removed guard's vote goes away, the last guard's vote moves into its place.
+    governance_contract.removeGuard(operator, sender=owner)
+    assert governance_contract.LGov(0) == someone
+    assert governance_contract.GuardIndex(someone) == 1
+    assert governance_contract.GuardIndex(operator) == 0
+    assert governance_contract.Strategies(NONCE).VotesEndorse == 0
+    assert governance_contract.Strategies(NONCE).VotesReject == 0b001
+
+    # A guard swapped in gets to vote afresh.
+    governance_contract.swapGuard(someone, operator, sender=owner)
+    assert governance_contract.Strategies(NONCE).VotesReject == 0
+    governance_contract.endorseStrategy(NONCE, sender=operator)
+    governance_contract.endorseStrategy(NONCE, sender=someoneelse)
+
+    acs = governance_contract.activateStrategy(NONCE, sender=owner)
+    assert governance_contract.CurrentNonce() == NONCE
+    assert governance_contract.CurrentStrategy().VotesEndorse == 0b011
+
+
+def test_strategy_expiry(governance_contract, accounts):
+    ProposedStrategy = (WEIGHTS, APYNOW, APYPREDICTED)
+    owner, operator, someoneelse, someone = accounts[:4]
+
+    governance_contract.addGuard(someone, sender=owner)
+    for i in range(MAX_PENDING):
+        governance_contract.submitStrategy(ProposedStrategy, sender=owner)
+
+    # Proposals lapse TDelay * 1.25 after submission.
+    ape.chain.pending_timestamp = governance_contract.Strategies(NONCE).TExpires + 1
+    assert governance_contract.StrategyStatus(NONCE) == 6
+
+    with ape.reverts():
+        governance_contract.endorseStrategy(NONCE, sender=someone)
+    with ape.reverts():
+        governance_contract.activateStrategy(NONCE, sender=owner)
+
+    # A full queue makes room by dropping an expired proposal.
+    governance_contract.submitStrategy(ProposedStrategy, sender=owner)
+    pending = list(governance_contract.PendingStrategies())
+    assert len(pending) == MAX_PENDING
+    assert NONCE not in pending
+    assert MAX_PENDING + 1 in pending
@@ -12,6 +12,7 @@ ADAI = "0x018008bfb33d285247A21d44E50697654f754e63"
 AAVE_PAUSE_MASK = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFFFFFFFFFFF
 #validate with aave dapp
 AAVE_DAI_SUPPLY_CAP = 338000000000000000000000000
+RAY = 10**27
 
 @pytest.fixture
 def deployer(accounts):
@@ -30,23 +31,9 @@ def lendingpool(project, ensure_hardhat):
     return project.aavePool.at(AAVE_LENDING_POOL)
 
 @pytest.fixture
-def dai(project, deployer, trader, ensure_hardhat):
-    dai = project.DAI.at(DAI)
-    # print("wards", dai.wards(deployer))
-    #Make deployer a minter
-    #background info https://mixbytes.io/blog/modify-ethereum-storage-hardhats-mainnet-fork
-    #Dai contract has  minters in first slot mapping (address => uint) public wards;
-    abi_encoded = eth_abi.encode(['address', 'uint256'], [deployer.address, 0])
-    storage_slot = Web3.solidityKeccak(["bytes"], ["0x" + abi_encoded.hex()]).hex()
-
-    set_storage_request = {"jsonrpc": "2.0", "method": "hardhat_setStorageAt", "id": 1,
-        "params": [DAI, storage_slot, "0x" + eth_abi.encode(["uint256"], [1]).hex()]}
-    print(requests.post("http://localhost:8545/", json.dumps(set_storage_request)))
-    # print("wards", dai.wards(deployer))
-    #make the trader rich, airdrop $1 billion
-    dai.mint(trader, '10000000000 Ether', sender=deployer)
-    # print(dai.balanceOf(trader))
-    return project.ERC20.at(DAI)
+def dai(fork_dai, ensure_hardhat):
+    # Deployer is a minter & trader is funded once per session, see conftest.
+    return fork_dai
 
 @pytest.fixture
 def aave_adapter(project, deployer, dai, ensure_hardhat):
@@ -55,6 +42,13 @@ def aave_adapter(project, deployer, dai, ensure_hardhat):
     return project.LPAdapter.at(aa)
 
 
+def aave_dai_headroom(lendingpool, adai, dai):
+    #supply cap minus aDAI supply & what the treasury accrued, both at the current liquidity index.
+    income = lendingpool.getReserveNormalizedIncome(dai)
+    treasury = lendingpool.getReserveData(dai).accruedToTreasury
+    return AAVE_DAI_SUPPLY_CAP - adai.totalSupply() - (treasury * income + RAY // 2) // RAY
+
+
 @pytest.fixture
 def aave_configurator(project, ensure_hardhat):
     return project.aavePoolConfigurator.at("0x64b761D848206f447Fe2dd461b0c635Ec39EbB27")
@@ -64,18 +58,21 @@ def test_aave_adapter(aave_adapter, trader, dai, adai, aave_configurator, ensure
     #we use sender=aave_adapter in view functions to troll the vault_location() method
     assert aave_adapter.totalAssets(sender=aave_adapter) == 0, "Asset balance should be 0"
     assert aave_adapter.maxWithdraw(sender=aave_adapter) == 0, "maxWithdraw should be 0"
-    assert aave_adapter.maxDeposit(sender=aave_adapter) == pytest.approx(AAVE_DAI_SUPPLY_CAP - adai.totalSupply()), "maxDeposit should be MAX_UINT256"
+    assert aave_adapter.maxDeposit(sender=aave_adapter) == pytest.approx(aave_dai_headroom(lendingpool, adai, dai), abs=1), "maxDeposit should be the exact supply cap headroom"
     assert adai.balanceOf(aave_adapter) == 0, "adai balance incorrect"
     #Deposit 1000,000 DAI
     #Normally this would be delegate call from 4626 that already has the funds,
     #but here we fake it by transferring DAI first then doing a CALL
     dai.transfer(aave_adapter, "1000000 Ether", sender=trader)
     aave_adapter.deposit("1000000 Ether", sender=trader) #Anyone can call this, its intended to be delegate
+    #Approved once for the max, later deposits reuse it.
+    assert dai.allowance(aave_adapter, AAVE_LENDING_POOL) > 2**255, "allowance should be max"
     #There is no yield yet... so everything should be a million
     assert adai.balanceOf(aave_adapter) < 1000001*10**18, "adai balance incorrect"
     assert aave_adapter.totalAssets(sender=aave_adapter) < 1000001*10**18, "Asset balance should be 1000000"
     assert aave_adapter.maxWithdraw(sender=aave_adapter) < 1000001*10**18, "maxWithdraw should be 1000000"
-    assert aave_adapter.maxDeposit(sender=aave_adapter) == pytest.approx(AAVE_DAI_SUPPLY_CAP  - adai.totalSupply()), "maxDeposit should be MAX_UINT256"
+    assert aave_adapter.maxDeposit(sender=aave_adapter) == pytest.approx(aave_dai_headroom(lendingpool, adai, dai), abs=1), "maxDeposit should be the exact supply cap headroom"
+    assert aave_adapter.state(sender=aave_adapter) == (aave_adapter.totalAssets(sender=aave_adapter), aave_adapter.maxWithdraw(sender=aave_adapter), aave_adapter.maxDeposit(sender=aave_adapter)), "state() should match the individual views"
     # print(adai.balanceOf(aave_adapter))
     #cause aDAI to have a huge profit
     #mine 100000 blocks with an interval of 5 minute
@@ -86,7 +83,7 @@ def test_aave_adapter(aave_adapter, trader, dai, adai, aave_configurator, ensure
     assert adai.balanceOf(aave_adapter) == pytest.approx(1007704413122972883649524), "adai balance incorrect"
     assert aave_adapter.totalAssets(sender=aave_adapter) == pytest.approx(1007704413122972883649524), "Asset balance should be 1000000"
     assert aave_adapter.maxWithdraw(sender=aave_adapter) == pytest.approx(1007704413122972883649524), "maxWithdraw should be 1000000"
-    assert aave_adapter.maxDeposit(sender=aave_adapter) == pytest.approx(AAVE_DAI_SUPPLY_CAP  - adai.totalSupply()), "maxDeposit should be MAX_UINT256"
+    assert aave_adapter.maxDeposit(sender=aave_adapter) == pytest.approx(aave_dai_headroom(lendingpool, adai, dai), abs=1), "maxDeposit should be the exact supply cap headroom"
     #Withdraw everything
     trader_balance_pre = dai.balanceOf(trader)
     aave_adapter.withdraw(aave_adapter.totalAssets(sender=aave_adapter), trader, sender=trader)
@@ -94,7 +91,7 @@ def test_aave_adapter(aave_adapter, trader, dai, adai, aave_configurator, ensure
     assert trader_gotten == pytest.approx(1007704413465903087954661), "trader gain balance incorrect"
     assert aave_adapter.totalAssets(sender=aave_adapter) < 10**18, "Asset balance should be 0"
     assert aave_adapter.maxWithdraw(sender=aave_adapter) < 10**18, "maxWithdraw should be 0"
-    assert aave_adapter.maxDeposit(sender=aave_adapter) == pytest.approx(AAVE_DAI_SUPPLY_CAP  - adai.totalSupply()), "maxDeposit should be MAX_UINT256"
+    assert aave_adapter.maxDeposit(sender=aave_adapter) == pytest.approx(aave_dai_headroom(lendingpool, adai, dai), abs=1), "maxDeposit should be the exact supply cap headroom"
     assert adai.balanceOf(aave_adapter) < 10**18, "adai balance incorrect"
     
     paused = lendingpool.getConfiguration(dai).data & ~AAVE_PAUSE_MASK
@@ -145,6 +142,7 @@ def test_aave_adapter(aave_adapter, trader, dai, adai, aave_configurator, ensure
     assert aave_adapter.totalAssets(sender=aave_adapter) == pytest.approx(100000256852263405719), "Asset balance should be 0"
     assert aave_adapter.maxWithdraw(sender=aave_adapter) == 0, "maxWithdraw should be 0"
     assert aave_adapter.maxDeposit(sender=aave_adapter) == 0, "maxDeposit should be zero"
+    assert aave_adapter.state(sender=aave_adapter) == (aave_adapter.totalAssets(sender=aave_adapter), aave_adapter.maxWithdraw(sender=aave_adapter), aave_adapter.maxDeposit(sender=aave_adapter)), "state() should match the individual views"
     assert adai.balanceOf(aave_adapter) == pytest.approx(100000256852263405719), "adai balance incorrect"
 
     #Doing a deposit should revert
@@ -22,23 +22,9 @@ def cdai(project, deployer, trader, ensure_hardhat):
     return project.cToken.at(CDAI)
 
 @pytest.fixture
-def dai(project, deployer, trader, ensure_hardhat):
-    dai = project.DAI.at(DAI)
-    # print("wards", dai.wards(deployer))
-    #Make deployer a minter
-    #background info https://mixbytes.io/blog/modify-ethereum-storage-hardhats-mainnet-fork
-    #Dai contract has  minters in first slot mapping (address => uint) public wards;
-    abi_encoded = eth_abi.encode(['address', 'uint256'], [deployer.address, 0])
-    storage_slot = Web3.solidityKeccak(["bytes"], ["0x" + abi_encoded.hex()]).hex()
-
-    set_storage_request = {"jsonrpc": "2.0", "method": "hardhat_setStorageAt", "id": 1,
-        "params": [DAI, storage_slot, "0x" + eth_abi.encode(["uint256"], [1]).hex()]}
-    print(requests.post("http://localhost:8545/", json.dumps(set_storage_request)))
-    # print("wards", dai.wards(deployer))
-    #make the trader rich, airdrop $1 billion
-    dai.mint(trader, '10000000000 Ether', sender=deployer)
-    # print(dai.balanceOf(trader))
-    return project.ERC20.at(DAI)
+def dai(fork_dai, ensure_hardhat):
+    # Deployer is a minter & trader is funded once per session, see conftest.
+    return fork_dai
 
 @pytest.fixture
 def compound_adapter(project, deployer, dai, ensure_hardhat):
@@ -57,6 +43,8 @@ def test_compound_adapter(compound_adapter, trader, dai, cdai, ensure_hardhat):
     #but here we fake it by transferring DAI first then doing a CALL
     dai.transfer(compound_adapter, "1000000 Ether", sender=trader)
     compound_adapter.deposit("1000000 Ether", sender=trader) #Anyone can call this, its intended to be delegate
+    #Approved once for the max, later deposits reuse it.
+    assert dai.allowance(compound_adapter, CDAI) > 2**255, "allowance should be max"
     #There is no yield yet... so everything should be a million
     assert cdai.balanceOfUnderlying(compound_adapter, sender=trader).return_value < 1000001*10**18, "adai balance incorrect"
     assert compound_adapter.totalAssets(sender=compound_adapter) < 1000001*10**18, "Asset balance should be 1000000"
@@ -65,6 +53,7 @@ def test_compound_adapter(compound_adapter, trader, dai, cdai, ensure_hardhat):
     assert compound_adapter.totalAssets(sender=compound_adapter) > 999999*10**18, "Asset balance should be 1000000"
     assert compound_adapter.maxWithdraw(sender=compound_adapter) > 999999*10**18, "maxWithdraw should be 1000000"
     assert compound_adapter.maxDeposit(sender=compound_adapter) == 2**256 - 1, "maxDeposit should be MAX_UINT256"
+    assert compound_adapter.state(sender=compound_adapter) == (compound_adapter.totalAssets(sender=compound_adapter), compound_adapter.maxWithdraw(sender=compound_adapter), compound_adapter.maxDeposit(sender=compound_adapter)), "state() should match the individual views"
     #cause cDAI to have a huge profit
     #mine 100000 blocks with an interval of 5 minute
     set_storage_request = {"jsonrpc": "2.0", "method": "hardhat_mine", "id": 1,
@@ -26,23 +26,9 @@ def edai(project, deployer, trader, ensure_hardhat):
     return project.eToken.at(EDAI)
 
 @pytest.fixture
-def dai(project, deployer, trader, ensure_hardhat):
-    dai = project.DAI.at(DAI)
-    # print("wards", dai.wards(deployer))
-    #Make deployer a minter
-    #background info https://mixbytes.io/blog/modify-ethereum-storage-hardhats-mainnet-fork
-    #Dai contract has  minters in first slot mapping (address => uint) public wards;
-    abi_encoded = eth_abi.encode(['address', 'uint256'], [deployer.address, 0])
-    storage_slot = Web3.solidityKeccak(["bytes"], ["0x" + abi_encoded.hex()]).hex()
-
-    set_storage_request = {"jsonrpc": "2.0", "method": "hardhat_setStorageAt", "id": 1,
-        "params": [DAI, storage_slot, "0x" + eth_abi.encode(["uint256"], [1]).hex()]}
-    print(requests.post("http://localhost:8545/", json.dumps(set_storage_request)))
-    # print("wards", dai.wards(deployer))
-    #make the trader rich, airdrop $1 billion
-    dai.mint(trader, '10000000000 Ether', sender=deployer)
-    # print(dai.balanceOf(trader))
-    return project.ERC20.at(DAI)
+def dai(fork_dai, ensure_hardhat):
+    # Deployer is a minter & trader is funded once per session, see conftest.
+    return fork_dai
 
 @pytest.fixture
 def euler_adapter(project, deployer, dai, ensure_hardhat):
@@ -61,10 +47,13 @@ def test_euler_adapter(euler_adapter, trader, dai, edai, ensure_hardhat):
     #but here we fake it by transferring DAI first then doing a CALL
     dai.transfer(euler_adapter, "10000 Ether", sender=trader)
     euler_adapter.deposit("10000 Ether", sender=trader) #Anyone can call this, its intended to be delegate
+    #Approved once for the max, later deposits reuse it.
+    assert dai.allowance(euler_adapter, EULER) > 2**255, "allowance should be max"
     #There is no yield yet... so everything should be a million
     assert euler_adapter.totalAssets(sender=euler_adapter) == pytest.approx(10000*10**18), "Asset balance should be 0"
     assert euler_adapter.maxWithdraw(sender=euler_adapter) == pytest.approx(10000*10**18), "maxWithdraw should be 0"
     assert euler_adapter.maxDeposit(sender=euler_adapter) == 2**256 - 1, "maxDeposit should be MAX_UINT256"
+    assert euler_adapter.state(sender=euler_adapter) == (euler_adapter.totalAssets(sender=euler_adapter), euler_adapter.maxWithdraw(sender=euler_adapter), euler_adapter.maxDeposit(sender=euler_adapter)), "state() should match the individual views"
     assert edai.balanceOf(euler_adapter) == pytest.approx(9796693142892179130093), "eDAI balance incorrect"
     #cause eDAI to have a huge profit
     #mine 100000 blocks with an interval of 5 minute
@@ -0,0 +1,63 @@
+import pytest
+import ape
+
+from scripts.event_indexer import EventIndexer, SECONDS_PER_YEAR
+from tests.test_Dynamo4626 import deployer, trader, dai, pool_adapterA, dynamo4626, _setup_single_adapter
+
+
+def test_event_indexer(project, deployer, trader, dai, pool_adapterA, dynamo4626, tmp_path):
+    web3 = ape.chain.provider.web3
+    start = web3.eth.block_number
+
+    _setup_single_adapter(project, dynamo4626, deployer, dai, pool_adapterA)
+    governance = deployer.deploy(project.Governance, deployer, dynamo4626, 21600)
+    governance.addGuard(trader, sender=deployer)
+    governance.submitStrategy(([1000], 5, 10), sender=trader)
+
+    dai.approve(dynamo4626, 1000, sender=trader)
+    deposit = dynamo4626.deposit(1000, trader, sender=trader)
+    transfer = dynamo4626.transfer(deployer, 300, sender=trader)
+    self_transfer = dynamo4626.transfer(trader, 50, sender=trader)
+
+    # Small batches so the range is split up.
+    indexer = EventIndexer(web3, str(tmp_path / "vault.db"), dynamo4626.address, governance.address, start, batch_size=2)
+    assert indexer.sync() == 6
+    assert indexer.last_block == self_transfer.block_number
+
+    assert [e["event"] for e in indexer.events()] == ["PoolAdded", "NewGuard", "StrategyProposal", "Transfer", "Transfer", "Transfer"]
+    assert indexer.events("NewGuard")[0]["args"] == {"GuardAddress": trader.address}
+    proposal = indexer.events("StrategyProposal")[0]["args"]
+    assert (proposal["Nonce"], proposal["ProposerAddress"], proposal["APYNow"], proposal["APYPredicted"]) == (1, trader.address, 5, 10)
+    # Weights are recovered from the calldata.
+    assert proposal["Weights"] == [1000]
+    assert indexer.events("Transfer", from_block=transfer.block_number)[0]["args"] == \
+        {"sender": trader.address, "receiver": deployer.address, "value": 300}
+
+    # Store is append only, going over the same blocks again adds nothing.
+    assert indexer.sync(from_block=start) == 0
+    assert len(indexer.events()) == 6
+
+    assert indexer.balance_history(trader) == [(deposit.block_number, 1000), (transfer.block_number, 700)]
+    assert indexer.balance_history(deployer) == [(transfer.block_number, 300)]
+    assert indexer.balance_at(trader, deposit.block_number) == 1000
+    assert indexer.balance_at(deployer, deposit.block_number) == 0
+    # A self-transfer doesn't change the balance.
+    assert indexer.balance_at(trader, self_transfer.block_number) == 700
+
+    # 10% yield over 30 days.
+    dai.mint(pool_adapterA, 100, sender=deployer)
+    ape.chain.pending_timestamp = ape.chain.pending_timestamp + 30 * 24 * 60 * 60
+    ape.chain.mine()
+    indexer.sync()
+
+    end = web3.eth.block_number
+    assert indexer.share_price_at(transfer.block_number)[2] == 1.0
+    assert indexer.share_price_at(end)[2] == 1.1
+
+    elapsed = web3.eth.get_block(end)["timestamp"] - web3.eth.get_block(transfer.block_number)["timestamp"]
+    assert indexer.apy(transfer.block_number, end) == pytest.approx(1.1 ** (SECONDS_PER_YEAR / elapsed) - 1)
+
+    # Answered from the database alone.
+    indexer.web3 = None
+    assert indexer.balance_history(trader)[-1] == (transfer.block_number, 700)
+    indexer.close()
@@ -0,0 +1,56 @@
+import pytest
+import json, threading, requests
+
+from scripts.fork_cache import ForkCache, cache_key, make_handler
+from http.server import ThreadingHTTPServer
+
+
+@pytest.fixture
+def upstream():
+    # Stand-in for the archive node that counts what it's asked.
+    calls = []
+    class Upstream:
+        def handle(self, request):
+            calls.append(request["method"])
+            if request["method"] == "eth_getCode":
+                return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32005, "message": "rate limited"}}
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": "0x2a"}
+
+    server = ThreadingHTTPServer(("localhost", 0), make_handler(Upstream()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://localhost:%d/" % server.server_port, calls
+    server.shutdown()
+
+
+def test_fork_cache_record_replay(upstream, tmp_path):
+    url, calls = upstream
+    path = str(tmp_path / "fork_cache.json")
+    storage = {"jsonrpc": "2.0", "id": 7, "method": "eth_getStorageAt", "params": ["0xABCD", "0x0", "0xfb0dc4"]}
+
+    recorder = ForkCache(path, url)
+    assert recorder.handle(storage) == {"jsonrpc": "2.0", "id": 7, "result": "0x2a"}
+
+    # Served from the cache regardless of id or address case.
+    assert recorder.handle(dict(storage, id=8, params=["0xabcd", "0x0", "0xfb0dc4"]))["result"] == "0x2a"
+    assert calls == ["eth_getStorageAt"]
+
+    # Upstream errors are passed on but never cached.
+    assert "error" in recorder.handle({"id": 9, "method": "eth_getCode", "params": ["0xabcd", "0xfb0dc4"]})
+    recorder.save()
+
+    with open(path) as f:
+        assert list(json.load(f).keys()) == [cache_key("eth_getStorageAt", ["0xabcd", "0x0", "0xfb0dc4"])]
+
+    # Replay never goes upstream, a miss is a JSON-RPC error.
+    replay = ForkCache(path)
+    server = ThreadingHTTPServer(("localhost", 0), make_handler(replay))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        batch = [storage, {"jsonrpc": "2.0", "id": 10, "method": "eth_getBalance", "params": ["0xabcd", "0xfb0dc4"]}]
+        result = requests.post("http://localhost:%d/" % server.server_port, json=batch).json()
+    finally:
+        server.shutdown()
+
+    assert result[0] == {"jsonrpc": "2.0", "id": 7, "result": "0x2a"}
+    assert result[1]["error"]["code"] == -32000
+    assert calls == ["eth_getStorageAt", "eth_getCode"]
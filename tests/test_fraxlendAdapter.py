@@ -49,10 +49,13 @@ def test_fraxlend_adapter(trader, frax, fraxpair, fraxlend_adapter, deployer, en
     #deposit a million FRAX
     frax.transfer(fraxlend_adapter, "1000000 Ether", sender=trader)
     fraxlend_adapter.deposit("1000000 Ether", sender=trader) #Anyone can call this, its intended to be delegate
+    #Approved once for the max, later deposits reuse it.
+    assert frax.allowance(fraxlend_adapter, BTC_FRAX_PAIR) > 2**255, "allowance should be max"
 
     assert fraxlend_adapter.totalAssets(sender=fraxlend_adapter) == pytest.approx(1000000*10**18), "Asset balance should be 0"
     assert fraxlend_adapter.maxWithdraw(sender=fraxlend_adapter) == pytest.approx(1000000*10**18), "maxWithdraw should be 0"
     assert fraxlend_adapter.maxDeposit(sender=fraxlend_adapter) == 2**256 - 1, "maxDeposit should be MAX_UINT256"
+    assert fraxlend_adapter.state(sender=fraxlend_adapter) == (fraxlend_adapter.totalAssets(sender=fraxlend_adapter), fraxlend_adapter.maxWithdraw(sender=fraxlend_adapter), fraxlend_adapter.maxDeposit(sender=fraxlend_adapter)), "state() should match the individual views"
     assert fraxpair.balanceOf(fraxlend_adapter) == pytest.approx(999131280088931076622037), "fToken balance incorrect"
 
     # print(fraxlend_adapter.totalAssets())
@@ -0,0 +1,102 @@
+import pytest
+import ape
+import json, os
+
+from tests.test_Dynamo4626 import deployer, trader, dai, dynamo_lens, _setup_single_adapter
+
+# Gas used by each Dynamo4626 user flow is written to GAS_RESULTS. Any flow that
+# costs more than its GAS_BASELINE entry plus GAS_TOLERANCE fails, flows without
+# an entry are only recorded.
+#
+# The baseline has to come from the pinned toolchain (ape, hardhat, vyper 0.3.7),
+# record or refresh it with:
+#     make gas-baseline
+GAS_RESULTS = os.getenv("GAS_RESULTS", os.path.join(os.path.dirname(__file__), "gas_results.json"))
+GAS_BASELINE = os.getenv("GAS_BASELINE", os.path.join(os.path.dirname(__file__), "gas_baseline.json"))
+GAS_TOLERANCE = float(os.getenv("GAS_TOLERANCE", "0.02"))
+
+# Up to Dynamo4626.MAX_POOLS, gas should follow the adapters in use.
+ADAPTER_COUNTS = [1, 2, 3, 4, 5, 8, 16]
+
+# Strategy ratios for n adapters.
+DISTRIBUTIONS = {
+    "even": lambda n: [1] * n,
+    "skewed": lambda n: [2**i for i in range(n)],
+    "concentrated": lambda n: [1] + [0] * (n - 1),
+}
+
+
+def _load_baseline():
+    if not os.path.exists(GAS_BASELINE): return {}
+    with open(GAS_BASELINE) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module")
+def gas_report():
+    report = {"baseline": _load_baseline(), "results": {}}
+
+    yield report
+
+    with open(GAS_RESULTS, "w") as f:
+        json.dump(report["results"], f, indent=2, sort_keys=True)
+
+    if os.getenv("GAS_UPDATE_BASELINE"):
+        baseline = report["baseline"]
+        baseline.update(report["results"])
+        with open(GAS_BASELINE, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def _record(report, key, gas):
+    report["results"][key] = gas
+
+    # Flows without a baseline yet are only recorded.
+    if os.getenv("GAS_UPDATE_BASELINE") or key not in report["baseline"]: return
+
+    limit = int(report["baseline"][key] * (1 + GAS_TOLERANCE))
+    assert gas <= limit, "%s used %d gas, baseline is %d." % (key, gas, report["baseline"][key])
+
+
+@pytest.mark.parametrize("distribution", DISTRIBUTIONS.keys())
+@pytest.mark.parametrize("n_adapters", ADAPTER_COUNTS)
+def test_user_flow_gas(project, deployer, trader, dai, dynamo_lens, gas_report, n_adapters, distribution):
+    dynamo = deployer.deploy(project.Dynamo4626, "DynamoDAI", "dyDAI", 18, dai, [], deployer)
+
+    adapters = []
+    for i in range(n_adapters):
+        wdai = deployer.deploy(project.ERC20, "wDAI%d" % i, "wDAI%d" % i, 18, 0, deployer)
+        adapter = deployer.deploy(project.MockLPAdapter, dai, wdai)
+        _setup_single_adapter(project, dynamo, deployer, dai, adapter)
+        adapters.append(adapter)
+
+    dai.approve(dynamo, (1<<256)-1, sender=trader)
+
+    # Seed the vault so every flow below runs against warm, non-zero balances.
+    dynamo.deposit('1000 Ether', trader, sender=trader)
+
+    def record(flow, receipt):
+        _record(gas_report, "%s/%d/%s" % (flow, n_adapters, distribution), receipt.gas_used)
+
+    ratios = DISTRIBUTIONS[distribution](n_adapters)
+    strategy = list(zip(adapters, ratios))
+    record("set_strategy", dynamo.set_strategy(trader, strategy, 0, sender=deployer))
+
+    # set_strategy leaves moving the assets to keepers, settle first so the user
+    # flows start out at the strategy's allocation.
+    rebalance_gas = 0
+    for i in range(n_adapters):
+        if dynamo_lens.rebalance_progress(dynamo)[1] == 0: break
+        rebalance_gas += dynamo.rebalance(n_adapters, 0, sender=trader).gas_used
+    assert dynamo_lens.rebalance_progress(dynamo)[1] == 0
+    _record(gas_report, "rebalance/%d/%s" % (n_adapters, distribution), rebalance_gas)
+
+    record("deposit", dynamo.deposit('100 Ether', trader, sender=trader))
+    record("mint", dynamo.mint('100 Ether', trader, sender=trader))
+    record("withdraw", dynamo.withdraw('100 Ether', trader, trader, sender=trader))
+    record("redeem", dynamo.redeem('100 Ether', trader, trader, sender=trader))
+
+    # Some yield so there are fees to claim.
+    dai.mint(adapters[0], '100 Ether', sender=deployer)
+    record("claim_yield_fees", dynamo.claim_yield_fees(sender=deployer))
+    record("claim_strategy_fees", dynamo.claim_strategy_fees(sender=trader))
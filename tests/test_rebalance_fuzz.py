@@ -0,0 +1,147 @@
+import pytest
+import ape
+from ape import chain
+import os, random
+
+from contracts.getBalanceTxs import ERC20, Pool, MAX_POOLS, batch_balance_txs
+
+# Differential fuzz of Dynamo4626 rebalancing against the models in
+# contracts/getBalanceTxs.py. The bulk of the cases only call DynamoLens'
+# getBalanceTxs view against a handful of seeded vault states & are checked
+# against one batched NumPy run per state, a small sample actually executes the
+# vault's own plan through rebalance().
+# Run more cases with e.g. FUZZ_CASES=5000.
+FUZZ_CASES = int(os.getenv("FUZZ_CASES", "1000"))
+FUZZ_STATES = int(os.getenv("FUZZ_STATES", "10"))
+FUZZ_EXECUTED = int(os.getenv("FUZZ_EXECUTED", "5"))
+FUZZ_SEED = int(os.getenv("FUZZ_SEED", "4626"))
+
+@pytest.fixture(scope="module")
+def deployer(accounts):
+    return accounts[0]
+
+@pytest.fixture(scope="module")
+def dai(project, deployer):
+    return deployer.deploy(project.ERC20, "DAI", "DAI", 18, 0, deployer)
+
+@pytest.fixture(scope="module")
+def adapters(project, deployer, dai):
+    # The deployer keeps minting rights on the wrapped tokens so we can hand
+    # the vaults LP shares directly.
+    result = []
+    for i in range(MAX_POOLS):
+        wdai = deployer.deploy(project.ERC20, "wDAI%d" % i, "wDAI%d" % i, 18, 0, deployer)
+        result.append((deployer.deploy(project.MockLPAdapter, dai, wdai), project.ERC20.at(wdai)))
+    return result
+
+@pytest.fixture(scope="module")
+def vaults(project, deployer, dai, adapters):
+    # One vault per pool count, deployed once & reused through snapshot/revert.
+    return {n: deployer.deploy(project.Dynamo4626, "DynamoDAI", "dyDAI", 18, dai, [a for a, w in adapters[:n]], deployer)
+            for n in range(1, MAX_POOLS + 1)}
+
+@pytest.fixture(scope="module")
+def lens(project, deployer):
+    return deployer.deploy(project.DynamoLens)
+
+
+def _random_state(rng):
+    pool_count = rng.randint(1, MAX_POOLS)
+    balances = [rng.choice([0, rng.randint(1, 1000)]) for x in range(pool_count)]
+    return dict(
+        pool_count = pool_count,
+        local = rng.choice([0, rng.randint(1, 1000)]),
+        balances = balances,
+        # LP shares the vault holds, below the adapter balance limits maxWithdraw.
+        shares = [b if rng.random() < 0.8 else rng.randint(0, b) for b in balances],
+        ratios = [rng.randint(0, 5) for x in range(pool_count)])
+
+
+def _random_request(rng, state):
+    # Mostly reachable targets, some we can't balance to. A _min_move of 0 plans
+    # like a user flow, the rest like rebalance().
+    total = state["local"] + sum(state["balances"])
+    return rng.choice([0, rng.randint(0, total), rng.randint(0, 2 * total)]), rng.randint(0, MAX_POOLS), \
+        rng.choice([0, 1, rng.randint(1, 500)])
+
+
+def _seed(state, vault, deployer, dai, adapters):
+    # Vault is empty so setting the strategy doesn't move anything.
+    addresses = [a.address for a, w in adapters[:state["pool_count"]]]
+    vault.set_strategy(deployer, list(zip(addresses, state["ratios"])), 0, sender=deployer)
+
+    for (adapter, wdai), balance, shares in zip(adapters, state["balances"], state["shares"]):
+        if balance: dai.mint(adapter, balance, sender=deployer)
+        if shares: wdai.mint(vault, shares, sender=deployer)
+    if state["local"]: dai.mint(vault, state["local"], sender=deployer)
+    return addresses
+
+
+def _model_plan(state, addresses, target, max_txs):
+    dai = ERC20(_balanceOf = {})
+    for address, balance in zip(addresses, state["balances"]):
+        dai.deposit(address, balance)
+
+    pool = Pool(addresses, dai, state["ratios"] + [0] * (MAX_POOLS - state["pool_count"]),
+                max_withdraws = dict(zip(addresses, state["shares"])))
+    dai.deposit(pool, state["local"])
+
+    return [(tx.Qty, tx.Adapter) for tx in pool.getBalanceTxs(target, max_txs)]
+
+
+def test_getBalanceTxs_matches_model(deployer, dai, adapters, vaults, lens):
+    rng = random.Random(FUZZ_SEED)
+
+    for i in range(FUZZ_STATES):
+        state = _random_state(rng)
+        requests = [_random_request(rng, state) for x in range(FUZZ_CASES // FUZZ_STATES)]
+        targets, max_txs, min_moves = zip(*requests)
+
+        count = len(requests)
+        expected = batch_balance_txs([state["local"]] * count, [state["balances"]] * count, [state["ratios"]] * count,
+                                     targets, max_txs, max_withdraws = [state["shares"]] * count, min_moves = min_moves)
+
+        vault = vaults[state["pool_count"]]
+        snapshot = chain.snapshot()
+        try:
+            addresses = _seed(state, vault, deployer, dai, adapters)
+
+            for row, (target, txs, min_move) in enumerate(requests):
+                if not expected.feasible[row]:
+                    with ape.reverts("CAN'T BALANCE SOON ENOUGH!"):
+                        lens.getBalanceTxs(vault, target, txs, min_move)
+                    continue
+
+                plan = {tx.Adapter: tx.Qty for tx in lens.getBalanceTxs(vault, target, txs, min_move)}
+                assert [plan.get(address, 0) for address in addresses] == list(expected.planned[row]), \
+                    "State %d target %d max_txs %d min_move %d diverged: %s" % (i, target, txs, min_move, state)
+        finally:
+            chain.restore(snapshot)
+
+
+def test_rebalance_executes_model_plan(deployer, dai, adapters, vaults):
+    rng = random.Random(FUZZ_SEED + 1)
+
+    for i in range(FUZZ_EXECUTED):
+        state = _random_state(rng)
+        max_txs = rng.randint(1, state["pool_count"])
+        pool_adapters = adapters[:state["pool_count"]]
+
+        vault = vaults[state["pool_count"]]
+        snapshot = chain.snapshot()
+        try:
+            addresses = _seed(state, vault, deployer, dai, adapters)
+            for adapter, wdai in pool_adapters:
+                wdai.transferMinter(vault, sender=deployer)
+                dai.setApprove(adapter, vault, (1<<256)-1, sender=deployer)
+
+            # No float so rebalance() plans for an empty local balance.
+            moved = {adapter: qty for qty, adapter in _model_plan(state, addresses, 0, max_txs)}
+            vault.rebalance(max_txs, 0, sender=deployer)
+
+            assert [adapter.totalAssets() for adapter, w in pool_adapters] == \
+                [balance + moved.get(address, 0) for address, balance in zip(addresses, state["balances"])], \
+                "Case %d diverged: %s" % (i, state)
+            assert dai.balanceOf(vault) == state["local"] - sum(moved.values())
+        finally:
+            chain.restore(snapshot)